@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+""" AddressValidator.py
+
+This file represents the local validation of TRTL addresses and payment
+IDs, so a malformed address is caught before it is sent to walletd. An
+address is decoded from CryptoNote base58, its network prefix checked,
+and its Keccak-256 checksum verified. Keccak comes from pysha3 or
+pycryptodome when either is installed, with a pure Python fallback.
+The bulk API checks whole payout lists at once and reports every failure.
+"""
+
+from collections import namedtuple
+import logging
+import re
+import struct
+
+# Get Logger made in start.py
+address_logger = logging.getLogger('trtl_log.address')
+
+# Network prefix every TRTL address starts with, which encodes to 'TRTL'
+ADDRESS_PREFIX = 3914525
+# Lengths of a standard address and of an integrated address (one with a payment ID built in)
+ADDRESS_LENGTH = 99
+INTEGRATED_ADDRESS_LENGTH = 187
+# A payment ID is 32 bytes written as hex
+PAYMENT_ID_LENGTH = 64
+KEY_SIZE = 32
+CHECKSUM_SIZE = 4
+
+BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+BASE58_DIGITS = dict((character, value) for value, character in enumerate(BASE58_ALPHABET))
+# Base58 is encoded in blocks of 8 bytes, a block of n bytes takes ENCODED_BLOCK_SIZES[n] characters
+FULL_BLOCK_SIZE = 8
+FULL_ENCODED_BLOCK_SIZE = 11
+ENCODED_BLOCK_SIZES = [0, 2, 3, 5, 6, 7, 9, 10, 11]
+
+PAYMENT_ID_PATTERN = re.compile(r'^[0-9a-fA-F]{%d}$' % PAYMENT_ID_LENGTH)
+
+# A decoded address. payment_id is None for a standard address.
+AddressInfo = namedtuple('AddressInfo', ['spend_key', 'view_key', 'payment_id'])
+
+
+_MASK = (1 << 64) - 1
+_ROUND_CONSTANTS = [
+    0x0000000000000001, 0x0000000000008082, 0x800000000000808A, 0x8000000080008000,
+    0x000000000000808B, 0x0000000080000001, 0x8000000080008081, 0x8000000000008009,
+    0x000000000000008A, 0x0000000000000088, 0x0000000080008009, 0x000000008000000A,
+    0x000000008000808B, 0x800000000000008B, 0x8000000000008089, 0x8000000000008003,
+    0x8000000000008002, 0x8000000000000080, 0x000000000000800A, 0x800000008000000A,
+    0x8000000080008081, 0x8000000000008080, 0x0000000080000001, 0x8000000080008008]
+# Bytes absorbed per Keccak-f permutation for a 256 bit digest
+_RATE = 136
+
+
+def _keccak_f(state):
+    """
+    The Keccak-f[1600] permutation of 25 64 bit lanes, written out lane by lane
+    since indexing lists is what makes a pure Python Keccak slow
+    """
+    (a0, a1, a2, a3, a4, a5, a6, a7, a8, a9, a10, a11, a12,
+     a13, a14, a15, a16, a17, a18, a19, a20, a21, a22, a23, a24) = state
+    mask = _MASK
+    for round_constant in _ROUND_CONSTANTS:
+        # Theta
+        c0 = a0 ^ a5 ^ a10 ^ a15 ^ a20
+        c1 = a1 ^ a6 ^ a11 ^ a16 ^ a21
+        c2 = a2 ^ a7 ^ a12 ^ a17 ^ a22
+        c3 = a3 ^ a8 ^ a13 ^ a18 ^ a23
+        c4 = a4 ^ a9 ^ a14 ^ a19 ^ a24
+        d0 = c4 ^ (((c1 << 1) | (c1 >> 63)) & mask)
+        d1 = c0 ^ (((c2 << 1) | (c2 >> 63)) & mask)
+        d2 = c1 ^ (((c3 << 1) | (c3 >> 63)) & mask)
+        d3 = c2 ^ (((c4 << 1) | (c4 >> 63)) & mask)
+        d4 = c3 ^ (((c0 << 1) | (c0 >> 63)) & mask)
+        # Rho and pi
+        b0 = a0 ^ d0
+        t = a6 ^ d1
+        b1 = ((t << 44) | (t >> 20)) & mask
+        t = a12 ^ d2
+        b2 = ((t << 43) | (t >> 21)) & mask
+        t = a18 ^ d3
+        b3 = ((t << 21) | (t >> 43)) & mask
+        t = a24 ^ d4
+        b4 = ((t << 14) | (t >> 50)) & mask
+        t = a3 ^ d3
+        b5 = ((t << 28) | (t >> 36)) & mask
+        t = a9 ^ d4
+        b6 = ((t << 20) | (t >> 44)) & mask
+        t = a10 ^ d0
+        b7 = ((t << 3) | (t >> 61)) & mask
+        t = a16 ^ d1
+        b8 = ((t << 45) | (t >> 19)) & mask
+        t = a22 ^ d2
+        b9 = ((t << 61) | (t >> 3)) & mask
+        t = a1 ^ d1
+        b10 = ((t << 1) | (t >> 63)) & mask
+        t = a7 ^ d2
+        b11 = ((t << 6) | (t >> 58)) & mask
+        t = a13 ^ d3
+        b12 = ((t << 25) | (t >> 39)) & mask
+        t = a19 ^ d4
+        b13 = ((t << 8) | (t >> 56)) & mask
+        t = a20 ^ d0
+        b14 = ((t << 18) | (t >> 46)) & mask
+        t = a4 ^ d4
+        b15 = ((t << 27) | (t >> 37)) & mask
+        t = a5 ^ d0
+        b16 = ((t << 36) | (t >> 28)) & mask
+        t = a11 ^ d1
+        b17 = ((t << 10) | (t >> 54)) & mask
+        t = a17 ^ d2
+        b18 = ((t << 15) | (t >> 49)) & mask
+        t = a23 ^ d3
+        b19 = ((t << 56) | (t >> 8)) & mask
+        t = a2 ^ d2
+        b20 = ((t << 62) | (t >> 2)) & mask
+        t = a8 ^ d3
+        b21 = ((t << 55) | (t >> 9)) & mask
+        t = a14 ^ d4
+        b22 = ((t << 39) | (t >> 25)) & mask
+        t = a15 ^ d0
+        b23 = ((t << 41) | (t >> 23)) & mask
+        t = a21 ^ d1
+        b24 = ((t << 2) | (t >> 62)) & mask
+        # Chi and iota
+        a0 = b0 ^ (~b1 & b2) ^ round_constant
+        a1 = b1 ^ (~b2 & b3)
+        a2 = b2 ^ (~b3 & b4)
+        a3 = b3 ^ (~b4 & b0)
+        a4 = b4 ^ (~b0 & b1)
+        a5 = b5 ^ (~b6 & b7)
+        a6 = b6 ^ (~b7 & b8)
+        a7 = b7 ^ (~b8 & b9)
+        a8 = b8 ^ (~b9 & b5)
+        a9 = b9 ^ (~b5 & b6)
+        a10 = b10 ^ (~b11 & b12)
+        a11 = b11 ^ (~b12 & b13)
+        a12 = b12 ^ (~b13 & b14)
+        a13 = b13 ^ (~b14 & b10)
+        a14 = b14 ^ (~b10 & b11)
+        a15 = b15 ^ (~b16 & b17)
+        a16 = b16 ^ (~b17 & b18)
+        a17 = b17 ^ (~b18 & b19)
+        a18 = b18 ^ (~b19 & b15)
+        a19 = b19 ^ (~b15 & b16)
+        a20 = b20 ^ (~b21 & b22)
+        a21 = b21 ^ (~b22 & b23)
+        a22 = b22 ^ (~b23 & b24)
+        a23 = b23 ^ (~b24 & b20)
+        a24 = b24 ^ (~b20 & b21)
+    return [a0, a1, a2, a3, a4, a5, a6, a7, a8, a9, a10, a11, a12,
+            a13, a14, a15, a16, a17, a18, a19, a20, a21, a22, a23, a24]
+
+
+def _keccak_256_python(data):
+    """Pure Python Keccak-256, used when neither pysha3 nor pycryptodome is installed"""
+    message = bytearray(data)
+    # Keccak padding: a 1 bit after the message and another at the end of the last block
+    padding = _RATE - len(message) % _RATE
+    message += bytearray([0x01] + [0] * (padding - 1))
+    message[-1] |= 0x80
+    state = [0] * 25
+    for offset in range(0, len(message), _RATE):
+        lanes = struct.unpack('<17Q', bytes(message[offset:offset + _RATE]))
+        state = _keccak_f([lane ^ lanes[i] if i < 17 else lane for i, lane in enumerate(state)])
+    return struct.pack('<4Q', *state[:4])
+
+
+# Keccak-256 as used by CryptoNote, which pads differently to the standardised SHA3-256 in hashlib
+try:
+    import sha3
+
+    def keccak_256(data):
+        return sha3.keccak_256(bytes(data)).digest()
+    KECCAK_BACKEND = 'pysha3'
+except ImportError:
+    try:
+        from Crypto.Hash import keccak
+
+        def keccak_256(data):
+            return keccak.new(data=bytes(data), digest_bits=256).digest()
+        KECCAK_BACKEND = 'pycryptodome'
+    except ImportError:
+        keccak_256 = _keccak_256_python
+        KECCAK_BACKEND = 'python'
+
+
+def encode_varint(value):
+    """
+    :return: bytearray of value as a little endian base 128 varint
+    """
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return encoded
+
+
+def decode_varint(data):
+    """
+    :return: tuple of (value, bytes used) of the varint at the start of data
+    """
+    value = 0
+    for position, byte in enumerate(data[:10]):
+        value |= (byte & 0x7F) << (7 * position)
+        if not byte & 0x80:
+            return value, position + 1
+    raise ValueError("Invalid prefix")
+
+
+def base58_decode(text):
+    """
+    Decodes CryptoNote base58, which encodes each block of 8 bytes separately
+    :return: bytearray of the decoded data
+    """
+    full_blocks, last_block_size = divmod(len(text), FULL_ENCODED_BLOCK_SIZE)
+    if last_block_size not in ENCODED_BLOCK_SIZES:
+        raise ValueError("Invalid length")
+    decoded = bytearray()
+    for start in range(0, len(text), FULL_ENCODED_BLOCK_SIZE):
+        block = text[start:start + FULL_ENCODED_BLOCK_SIZE]
+        size = ENCODED_BLOCK_SIZES.index(len(block))
+        number = 0
+        for character in block:
+            digit = BASE58_DIGITS.get(character)
+            if digit is None:
+                raise ValueError("Invalid character '{}'".format(character))
+            number = number * 58 + digit
+        if number >> (8 * size):
+            raise ValueError("Invalid encoding")
+        decoded += bytearray((number >> (8 * i)) & 0xFF for i in reversed(range(size)))
+    return decoded
+
+
+def base58_encode(data):
+    """
+    Encodes data as CryptoNote base58
+    :return: the encoded text
+    """
+    data = bytearray(data)
+    encoded = []
+    for start in range(0, len(data), FULL_BLOCK_SIZE):
+        block = data[start:start + FULL_BLOCK_SIZE]
+        number = 0
+        for byte in block:
+            number = number * 256 + byte
+        characters = []
+        for _ in range(ENCODED_BLOCK_SIZES[len(block)]):
+            number, digit = divmod(number, 58)
+            characters.append(BASE58_ALPHABET[digit])
+        encoded.append(''.join(reversed(characters)))
+    return ''.join(encoded)
+
+
+def validate_payment_id(payment_id):
+    """
+    :raises ValueError: if payment_id isn't 64 hex characters
+    """
+    if not PAYMENT_ID_PATTERN.match(payment_id):
+        raise ValueError("Payment ID must be {} hex characters".format(PAYMENT_ID_LENGTH))
+
+
+def validate_address(address):
+    """
+    Checks an address is a well formed TRTL address, standard or integrated
+    :return: AddressInfo of the decoded keys and payment ID
+    :raises ValueError: describing what is wrong with the address
+    """
+    if len(address) not in (ADDRESS_LENGTH, INTEGRATED_ADDRESS_LENGTH):
+        raise ValueError("Address must be {} or {} characters long, not {}".format(
+            ADDRESS_LENGTH, INTEGRATED_ADDRESS_LENGTH, len(address)))
+    data = base58_decode(address)
+    prefix, prefix_size = decode_varint(data)
+    if prefix != ADDRESS_PREFIX:
+        raise ValueError("Not a TRTL address")
+    body, checksum = data[:-CHECKSUM_SIZE], data[-CHECKSUM_SIZE:]
+    if bytearray(keccak_256(body)[:CHECKSUM_SIZE]) != checksum:
+        raise ValueError("Address checksum doesn't match, check it for typos")
+    keys = body[prefix_size:]
+    payment_id = None
+    if len(address) == INTEGRATED_ADDRESS_LENGTH:
+        payment_id = bytes(keys[:PAYMENT_ID_LENGTH]).decode('ascii', 'replace')
+        validate_payment_id(payment_id)
+        keys = keys[PAYMENT_ID_LENGTH:]
+    if len(keys) != 2 * KEY_SIZE:
+        raise ValueError("Invalid address")
+    return AddressInfo(bytes(keys[:KEY_SIZE]), bytes(keys[KEY_SIZE:]), payment_id)
+
+
+def make_address(spend_key, view_key, payment_id=None):
+    """
+    Encodes public keys, and optionally a payment ID, as a TRTL address
+    :return: the standard or integrated address
+    """
+    body = encode_varint(ADDRESS_PREFIX)
+    if payment_id:
+        body += bytearray(payment_id.encode('ascii'))
+    body += bytearray(spend_key) + bytearray(view_key)
+    return base58_encode(body + bytearray(keccak_256(body)[:CHECKSUM_SIZE]))
+
+
+def split_integrated_address(address, payment_id=None):
+    """
+    Validates an address and payment ID for sending, splitting an integrated address into
+    its standard address and payment ID
+    :return: tuple of (standard address, payment ID or None)
+    :raises ValueError: if either is invalid, or an integrated address is given a payment ID as well
+    """
+    info = validate_address(address)
+    if payment_id:
+        validate_payment_id(payment_id)
+    if info.payment_id is None:
+        return address, payment_id or None
+    if payment_id and payment_id.lower() != info.payment_id.lower():
+        raise ValueError("Integrated address already includes a different payment ID")
+    return make_address(info.spend_key, info.view_key), info.payment_id
+
+
+def validate_bulk(entries):
+    """
+    Validates a list of payouts, e.g. an imported payout list. Addresses that appear more
+    than once are only decoded once.
+    :param entries: iterable of addresses, or of (address, payment ID) pairs
+    :return: list of (position, entry, error message) for every invalid entry
+    """
+    results = {}
+    failures = []
+    count = 0
+    for position, entry in enumerate(entries):
+        count += 1
+        if isinstance(entry, (tuple, list)):
+            address, payment_id = (tuple(entry) + (None,))[:2]
+        else:
+            address, payment_id = entry, None
+        key = (address, payment_id)
+        if key not in results:
+            try:
+                split_integrated_address(address, payment_id)
+                results[key] = None
+            except ValueError as e:
+                results[key] = str(e)
+        if results[key] is not None:
+            failures.append((position, entry, results[key]))
+    address_logger.debug("Validated {} payout entries, {} invalid".format(count, len(failures)))
+    return failures
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+""" Checkpointer.py
+
+This file represents the periodic saving of the wallet while it is
+open. walletd only writes its state to disk when asked to save, so a
+crash would otherwise lose all synchronisation progress since the wallet
+was opened. The checkpointer saves in the background whenever new
+blocks or transactions have been processed, at most once per interval,
+and never while a transaction is being sent.
+"""
+
+import threading
+import time
+import logging
+from requests.exceptions import RequestException
+from ConnectionManager import MAINTENANCE
+import Metrics
+
+# Get Logger made in start.py
+checkpoint_logger = logging.getLogger('trtl_log.checkpoint')
+
+
+class Checkpointer(object):
+    """
+    This class saves the wallet through walletd whenever it has changed since the last save
+    """
+    def __init__(self, wallet_connection, min_interval=120, check_interval=10, save_timeout=60):
+        """
+        :param wallet_connection: the WalletConnection whose wallet is saved
+        :param min_interval: minimum seconds between two background saves
+        :param check_interval: seconds between checks for changes
+        :param save_timeout: seconds to wait for walletd to save
+        """
+        self.wallet_connection = wallet_connection
+        self.min_interval = min_interval
+        self.check_interval = check_interval
+        self.save_timeout = save_timeout
+
+        self.saved_state = None
+        self.current_state = None
+        self.last_save_time = time.time()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def dirty(self):
+        """True if blocks or transactions have been processed since the last save"""
+        return self.current_state is not None and self.current_state != self.saved_state
+
+    def on_snapshot(self, snapshot):
+        """
+        Snapshot subscriber, notes the block and transaction counts walletd has reached
+        """
+        if not snapshot.status:
+            return
+        transaction_count = sum(len(block['transactions']) for block in snapshot.blocks)
+        self.current_state = (snapshot.status['blockCount'], transaction_count)
+        if self.saved_state is None:
+            # The wallet was saved when walletd loaded it, so the first state seen is the baseline
+            self.saved_state = self.current_state
+
+    def start(self):
+        """Starts checkpointing on a background thread"""
+        self._thread = threading.Thread(target=self.checkpoint_loop, name="Checkpointer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stops checkpointing, waiting up to timeout seconds for a save in progress to finish"""
+        self._stop_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def checkpoint_loop(self):
+        """Saves the wallet whenever it is dirty and min_interval has passed, until stopped"""
+        while not self._stop_event.wait(self.check_interval):
+            if self.dirty and time.time() - self.last_save_time >= self.min_interval:
+                self.checkpoint(blocking=False)
+
+    def checkpoint(self, blocking=True):
+        """
+        Saves the wallet
+        :param blocking: wait for a transaction being sent to finish, rather than skipping the save
+        :return: True if the wallet was saved
+        """
+        send_lock = self.wallet_connection.send_lock
+        if not send_lock.acquire(blocking):
+            checkpoint_logger.debug("Transaction being sent, postponing the wallet save")
+            return False
+        try:
+            state = self.current_state
+            start_time = time.time()
+            self.wallet_connection.request("save", timeout=self.save_timeout, priority=MAINTENANCE)
+            duration = time.time() - start_time
+        except (RequestException, ValueError) as e:
+            checkpoint_logger.warning("Failed to save the wallet: {}".format(e))
+            return False
+        finally:
+            send_lock.release()
+
+        self.saved_state = state
+        self.last_save_time = time.time()
+        Metrics.record('wallet.save_seconds', duration)
+        checkpoint_logger.info("Saved the wallet at block {} in {:.2f}s".format(state[0] if state else "?", duration))
+        return True
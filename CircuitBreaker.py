@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+""" CircuitBreaker.py
+
+This file represents the circuit breaker in front of walletd's RPC
+server. After several requests in a row fail to reach walletd, the
+breaker opens and requests fail straight away instead of each waiting
+for a timeout. Once a while has passed a single request is let through
+to probe whether walletd has recovered, closing the breaker if it has
+and keeping it open for longer if it hasn't.
+"""
+
+import logging
+import threading
+import time
+from requests.exceptions import ConnectionError
+
+import Metrics
+
+# Get Logger made in start.py
+breaker_logger = logging.getLogger('trtl_log.breaker')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(ConnectionError):
+    """Raised instead of making a request while walletd is known to be unreachable"""
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    This class tracks whether walletd is reachable, failing requests fast while it isn't
+    """
+    def __init__(self, failure_threshold=3, reset_timeout=5, max_reset_timeout=60):
+        """
+        :param failure_threshold: consecutive failed requests that open the breaker
+        :param reset_timeout: seconds the breaker stays open before the first probe
+        :param max_reset_timeout: longest the breaker stays open, the time doubles with every failed probe
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+
+        self.state = CLOSED
+        self.failures = 0
+        self.open_timeout = reset_timeout
+        self.opened_at = 0
+        self._lock = threading.Lock()
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        """
+        Registers a callback called with the new state and the seconds until the next probe whenever the
+        state changes. Callbacks run on the thread that made the request, so GTK work must be passed on
+        with GLib.idle_add.
+        """
+        self._subscribers.append(callback)
+
+    def retry_in(self):
+        """
+        :return: seconds until the next probe while open, otherwise 0
+        """
+        if self.state != OPEN:
+            return 0
+        return max(self.opened_at + self.open_timeout - time.time(), 0)
+
+    def before_request(self):
+        """
+        Called before a request is made
+        :raises CircuitOpenError: if the breaker is open, or a probe is already in flight
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and time.time() >= self.opened_at + self.open_timeout:
+                # Let this request through as the probe
+                self._set_state(HALF_OPEN)
+                return
+            if self.state == HALF_OPEN:
+                raise CircuitOpenError("Wallet daemon is not responding, checking whether it has recovered")
+            retry_in = self.retry_in()
+        raise CircuitOpenError("Wallet daemon is not responding, trying again in {:.0f}s".format(retry_in))
+
+    def record_success(self):
+        """Called when a request reached walletd"""
+        with self._lock:
+            self.failures = 0
+            self.open_timeout = self.reset_timeout
+            if self.state != CLOSED:
+                breaker_logger.info("Wallet daemon is answering again")
+                self._set_state(CLOSED)
+
+    def record_failure(self):
+        """Called when a request failed to reach walletd"""
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                self.open_timeout = min(self.open_timeout * 2, self.max_reset_timeout)
+                self._open()
+            elif self.state == CLOSED and self.failures >= self.failure_threshold:
+                self._open()
+
+    def reset(self):
+        """Closes the breaker, e.g. after walletd has been restarted"""
+        self.record_success()
+
+    def _open(self):
+        self.opened_at = time.time()
+        breaker_logger.warning("Wallet daemon unreachable after {} failed requests, failing fast for {:.0f}s".format(
+            self.failures, self.open_timeout))
+        Metrics.increment('rpc.breaker_opened')
+        self._set_state(OPEN)
+
+    def _set_state(self, state):
+        """Changes state, called with the lock held"""
+        self.state = state
+        retry_in = self.retry_in()
+        for callback in self._subscribers:
+            try:
+                callback(state, retry_in)
+            except Exception as e:
+                breaker_logger.error("Circuit breaker subscriber failed: {}".format(e))
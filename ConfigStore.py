@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+""" ConfigStore.py
+
+This file represents the wallet's configuration store. The config file
+is read once and served from memory; changes are written back in the
+background, a short while after the last change, using an atomic
+replace so a crash can never leave a half written file behind.
+"""
+
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+
+# Get Logger made in start.py
+config_logger = logging.getLogger('trtl_log.config')
+
+
+def atomic_write_json(path, data):
+    """
+    Writes data as JSON to path atomically: the JSON is written to a temporary file in the
+    same directory, flushed to disk, then renamed over the target.
+    :param path: file to write
+    :param data: JSON serialisable data
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as tFile:
+            tFile.write(json.dumps(data))
+            tFile.flush()
+            os.fsync(tFile.fileno())
+        if os.path.exists(path):
+            # Keep the permissions of the file being replaced, the temporary file is private
+            os.chmod(temp_path, os.stat(path).st_mode & 0o777)
+        if os.name == 'nt' and os.path.exists(path):
+            # Windows can't rename over an existing file
+            os.remove(path)
+        os.rename(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    if os.name != 'nt':
+        # Make sure the rename itself is on disk
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class ConfigStore(object):
+    """
+    This class holds the wallet configuration in memory and persists it to a JSON file.
+    It can be used like a dict; setting a value schedules a write and notifies subscribers.
+    """
+    def __init__(self, path, write_delay=1.0):
+        """
+        :param path: path of the config file, a relative one is resolved against the current working directory now
+        :param write_delay: seconds to wait after a change before writing, so bursts of changes are written once
+        """
+        self.path = os.path.abspath(path)
+        self.write_delay = write_delay
+        self.loaded = False
+        self._data = {}
+        self._loaded_data = {}
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._subscribers = []
+        self._dirty = False
+        self._timer = None
+
+    def load(self, defaults=None):
+        """
+        Reads the config file. Only the first call reads the file, later calls are ignored.
+        If the file is missing or corrupt the defaults are used and written back.
+        :param defaults: dict of values to use when there is no usable config file
+        """
+        with self._lock:
+            if self.loaded:
+                return
+            self.loaded = True
+            try:
+                with open(self.path) as cFile:
+                    self._data = json.loads(cFile.read())
+            except (IOError, OSError):
+                if defaults is not None:
+                    config_logger.info("No config file, creating it")
+                    self._data = dict(defaults)
+                    self.save()
+            except ValueError:
+                config_logger.error("Failed to decode the JSON file, using defaults")
+                if defaults is not None:
+                    self._data = dict(defaults)
+                    self.save()
+            self._loaded_data = dict(self._data)
+        atexit.register(self.flush)
+
+    def loaded_value(self, key, default=None):
+        """
+        :return: the value the key had when the config file was loaded, ignoring later changes
+        """
+        return self._loaded_data.get(key, default)
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def get_bool(self, key, default=False):
+        return bool(self._data.get(key, default))
+
+    def get_int(self, key, default=0):
+        try:
+            return int(self._data.get(key, default))
+        except (TypeError, ValueError):
+            config_logger.warning("Config value {} is not a whole number, using {}".format(key, default))
+            return default
+
+    def get_float(self, key, default=0.0):
+        try:
+            return float(self._data.get(key, default))
+        except (TypeError, ValueError):
+            config_logger.warning("Config value {} is not a number, using {}".format(key, default))
+            return default
+
+    def get_list(self, key, default=None):
+        value = self._data.get(key, default)
+        return list(value) if isinstance(value, (list, tuple)) else list(default or [])
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def set(self, key, value):
+        """Sets a value, scheduling a write and notifying subscribers if it has changed"""
+        with self._lock:
+            if key in self._data and self._data[key] == value:
+                return
+            self._data[key] = value
+            self.save()
+        for callback in self._subscribers:
+            try:
+                callback(key, value)
+            except Exception as e:
+                config_logger.error("Config subscriber failed: {}".format(e))
+
+    def update(self, values):
+        """Sets several values at once"""
+        for key, value in values.items():
+            self.set(key, value)
+
+    def subscribe(self, callback):
+        """
+        Registers a callback to be called with (key, value) whenever a value changes.
+        Callbacks run on the thread that made the change.
+        """
+        self._subscribers.append(callback)
+
+    def save(self):
+        """Schedules the config to be written once no further changes arrive for write_delay seconds"""
+        with self._lock:
+            self._dirty = True
+            if self._timer:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.write_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Writes any pending changes to the config file now"""
+        with self._write_lock:
+            # Only hold the data lock while copying, so changes aren't held up by the disk
+            with self._lock:
+                if self._timer:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+                data = dict(self._data)
+            try:
+                atomic_write_json(self.path, data)
+            except Exception as e:
+                config_logger.warn("Could not save config file: {}".format(e))
+                # Keep the changes pending, so the next change or the final flush tries again
+                with self._lock:
+                    self._dirty = True
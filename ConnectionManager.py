@@ -8,33 +8,300 @@ connections, currently just to Walletd.
 import json
 import psutil
 import requests
-from requests.exceptions import ConnectionError
+from requests.exceptions import ConnectionError, RequestException, Timeout
 from HelperFunctions import get_wallet_daemon_path, get_rpc_password
+import threading
 import time
 import os
 import os.path
+import sys
 from subprocess import Popen
 import global_variables
 import logging
 import hashlib
+import hmac
+import binascii
+import random
+from RequestCoalescer import RequestCoalescer
+from CircuitBreaker import CircuitBreaker
+import Metrics
 
 # Get Logger made in start.py
 WC_logger = logging.getLogger('trtl_log.walletConnection')
 
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+
+# (connect, read) seconds to wait for walletd, for methods not in METHOD_TIMEOUTS
+DEFAULT_TIMEOUT = (3.05, 30)
+# Methods that can take walletd a long time to answer
+METHOD_TIMEOUTS = {
+    'getStatus': (3.05, 10),
+    'getBalance': (3.05, 10),
+    'getAddresses': (3.05, 10),
+    'getTransactions': (3.05, 300),
+    'getTransactionHashes': (3.05, 300),
+    'sendTransaction': (3.05, 300),
+    'createDelayedTransaction': (3.05, 300),
+    'sendFusionTransaction': (3.05, 300),
+    'save': (3.05, 120),
+    'reset': (3.05, 120),
+}
+# Seconds a read-only request is first retried after, doubling with each retry
+RETRY_BACKOFF = 0.5
+
+# Priority classes of requests to walletd, most urgent first
+INTERACTIVE = 'interactive'  # Requests the user is waiting on
+MAINTENANCE = 'maintenance'  # Saves, exports and scheduled payouts
+BACKGROUND = 'background'  # Polling
+PRIORITIES = (INTERACTIVE, MAINTENANCE, BACKGROUND)
+
+# PBKDF2 iterations of the wallet password verifier kept with a detached daemon's details
+PASSWORD_VERIFIER_ITERATIONS = 100000
+
+# Windows process creation flags used to detach walletd from the wallet's console
+DETACHED_PROCESS = 0x00000008
+CREATE_NEW_PROCESS_GROUP = 0x00000200
+
+
+def get_daemon_secret_path(wallet_file):
+    """
+    :return: path of the file holding the details of the detached wallet daemon serving wallet_file
+    """
+    return os.path.abspath(wallet_file) + ".walletd"
+
+
+def read_daemon_secret(secret_file):
+    """
+    Reads the details of a detached wallet daemon
+    :return: dict of the daemon details, or None if there are none
+    """
+    try:
+        with open(secret_file) as sFile:
+            return json.loads(sFile.read())
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_daemon_secret(secret_file, info):
+    """
+    Writes the details of a detached wallet daemon, including its RPC password,
+    to a file only readable by the current user
+    """
+    fd = os.open(secret_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.chmod(secret_file, 0o600)  # In case the file already existed with wider permissions
+    with os.fdopen(fd, 'w') as sFile:
+        sFile.write(json.dumps(info))
+
+
+def make_password_verifier(password):
+    """
+    Derives a salted PBKDF2 hash of the wallet password, so a later session can check the password
+    it was given before attaching to a detached daemon, which has already unlocked the wallet
+    :return: dict of the verifier, to be kept in the daemon details
+    """
+    salt = os.urandom(16)
+    derived = hashlib.pbkdf2_hmac('sha256', password_bytes(password), salt, PASSWORD_VERIFIER_ITERATIONS)
+    return {'salt': binascii.hexlify(salt).decode('ascii'), 'iterations': PASSWORD_VERIFIER_ITERATIONS,
+            'hash': binascii.hexlify(derived).decode('ascii')}
+
+
+def check_password_verifier(verifier, password):
+    """
+    :return: True if password matches the verifier made by make_password_verifier, False if it doesn't
+        or the verifier is damaged
+    """
+    if not verifier or password is None:
+        return False
+    try:
+        derived = hashlib.pbkdf2_hmac('sha256', password_bytes(password), binascii.unhexlify(verifier['salt']),
+                                      int(verifier['iterations']))
+    except (KeyError, TypeError, ValueError):
+        return False
+    return hmac.compare_digest(binascii.hexlify(derived).decode('ascii'), verifier['hash'])
+
+
+def password_bytes(password):
+    """
+    :return: the password as UTF-8 bytes, for hashing
+    """
+    return password if isinstance(password, bytes) else password.encode('utf-8')
+
+
+def remove_daemon_secret(secret_file):
+    """Removes the details of a detached wallet daemon, if there are any"""
+    try:
+        os.remove(secret_file)
+    except OSError:
+        pass
+
+
+class AttachedProcess(object):
+    """
+    A Popen-like wrapper around a wallet daemon that was started by a previous session,
+    so it can be supervised and stopped like one we started ourselves.
+    The exit code of a process we didn't start isn't available, so 0 is reported once it has gone.
+    """
+    def __init__(self, process):
+        self.process = process
+        self.pid = process.pid
+        self.returncode = None
+
+    def poll(self):
+        try:
+            if self.process.is_running() and self.process.status() != psutil.STATUS_ZOMBIE:
+                return None
+        except psutil.NoSuchProcess:
+            pass
+        self.returncode = 0
+        return self.returncode
+
+    def wait(self):
+        try:
+            self.process.wait()
+        except psutil.NoSuchProcess:
+            pass
+        return self.poll()
+
+    def terminate(self):
+        try:
+            self.process.terminate()
+        except psutil.NoSuchProcess:
+            pass
+
+    def kill(self):
+        try:
+            self.process.kill()
+        except psutil.NoSuchProcess:
+            pass
+
+class RPCDispatcher(object):
+    """
+    This class limits how many requests are made to walletd at once, letting waiting requests through
+    in priority order and then in the order they arrived. Background requests never take the last slot,
+    so there is always one free for a request the user is waiting on.
+    """
+    def __init__(self, max_concurrent=2):
+        """
+        :param max_concurrent: most requests made to walletd at once
+        """
+        self.max_concurrent = max(max_concurrent, 1)
+        self._condition = threading.Condition()
+        self._active = dict((priority, 0) for priority in PRIORITIES)
+        self._waiting = []  # (priority rank, arrival number) of waiting requests
+        self._arrivals = 0
+
+    def _can_start(self, ticket):
+        """Whether a waiting request may start now, called with the condition held"""
+        active = sum(self._active.values())
+        for rank, arrival in sorted(self._waiting):
+            if active >= self.max_concurrent:
+                return False
+            if PRIORITIES[rank] == BACKGROUND and self.max_concurrent > 1 and \
+                    self._active[BACKGROUND] >= self.max_concurrent - 1:
+                # Held back for now, but shouldn't hold back less urgent requests either
+                continue
+            return (rank, arrival) == ticket
+        return False
+
+    def acquire(self, priority):
+        """
+        Waits for a slot to make a request in
+        :param priority: INTERACTIVE, MAINTENANCE or BACKGROUND
+        """
+        start_time = time.time()
+        with self._condition:
+            ticket = (PRIORITIES.index(priority), self._arrivals)
+            self._arrivals += 1
+            self._waiting.append(ticket)
+            while not self._can_start(ticket):
+                self._condition.wait()
+            self._waiting.remove(ticket)
+            self._active[priority] += 1
+            # Another waiting request may be able to start too
+            self._condition.notify_all()
+        Metrics.record('rpc.wait.{}_seconds'.format(priority), time.time() - start_time)
+
+    def release(self, priority):
+        """Gives up a slot taken with acquire"""
+        with self._condition:
+            self._active[priority] -= 1
+            self._condition.notify_all()
+
+
 class WalletConnection(object):
     """
     This class represents an RPC connection to Walletd
     """
-    def request(self, method, params={}):
-        """Makes an RPC request to Walletd"""
-        if self.rpc_connection is not None: # Check to make sure that an RPC connection has been established
-            response = self.rpc_connection.request(method, params) # Make the request
-            WC_logger.debug("Request Response: \r\n" + str(response['result']) )
-            return response['result'] # Return the response from the request
+    def request(self, method, params={}, timeout=None, cached=True, priority=INTERACTIVE):
+        """
+        Makes an RPC request to Walletd. Read-only requests that fail to reach walletd are retried,
+        and requests fail straight away while the circuit breaker knows walletd is unreachable.
+        :param timeout: seconds to wait for walletd, or a (connect, read) tuple. Defaults to the method's timeouts.
+        :param cached: share the result of an identical read-only request in flight or made moments ago,
+            False to always ask walletd straight away, bypassing the circuit breaker and the dispatcher,
+            e.g. to check it is answering
+        :param priority: INTERACTIVE for requests the user is waiting on, MAINTENANCE or BACKGROUND otherwise.
+            Requests wait for a free slot in priority order.
+        """
+        rpc_connection = self.rpc_connection # The connection is replaced when walletd is restarted
+        if rpc_connection is not None: # Check to make sure that an RPC connection has been established
+            if timeout is None:
+                timeout = self.get_timeout(method)
+
+            def make_request():
+                if cached:
+                    self.breaker.before_request()
+                # Only requests that can safely be repeated are retried, and not liveness checks
+                retries = self.max_retries if cached and self.coalescer.is_read_only(method) else 0
+                # Any answer from walletd, an RPC error included, shows it is reachable. Anything else counts
+                # as a failure, so a probe of a half-open breaker always closes or reopens it.
+                answered = False
+                try:
+                    for attempt in range(retries + 1):
+                        if cached:
+                            self.dispatcher.acquire(priority)
+                        try:
+                            response = rpc_connection.request(method, params, timeout) # Make the request
+                            break
+                        except (ConnectionError, Timeout) as e:
+                            if attempt == retries:
+                                raise
+                            # Back off with full jitter, so callers retrying together don't stay in step
+                            delay = random.uniform(0, RETRY_BACKOFF * 2 ** attempt)
+                            WC_logger.debug("{} failed, retrying in {:.2f}s: {}".format(method, delay, e))
+                            Metrics.increment('rpc.retries')
+                        except ValueError:
+                            # walletd answered with an error, or with something other than JSON
+                            answered = True
+                            raise
+                        finally:
+                            if cached:
+                                self.dispatcher.release(priority)
+                        time.sleep(delay)
+                    answered = True
+                finally:
+                    if answered:
+                        self.breaker.record_success()
+                    else:
+                        self.breaker.record_failure()
+                WC_logger.debug("Request Response: \r\n" + str(response['result']) )
+                return response['result'] # Return the response from the request
+            if not cached:
+                return make_request()
+            return self.coalescer.request(method, params, make_request)
         else:
             WC_logger.error(global_variables.message_dict["NO_RPC"])
             raise Exception(global_variables.message_dict["NO_RPC"])
             
+    def get_timeout(self, method):
+        """
+        :return: (connect, read) timeout for a method, from the rpcTimeouts config or the defaults
+        """
+        configured = global_variables.wallet_config.get('rpcTimeouts', {}).get(method)
+        if configured:
+            return tuple(configured)
+        return METHOD_TIMEOUTS.get(method, DEFAULT_TIMEOUT)
+
     def check_daemon_running(self):
         """
         checks if daemon is running by looping through every process and comparing
@@ -87,7 +354,7 @@ class WalletConnection(object):
         #gets known good daemon path
         good_daemon = get_wallet_daemon_path()
         # Determine walletd args
-        walletd_args = [get_wallet_daemon_path(), '-w', wallet_file, '-p', password, '--rpc-password', rpc_password]
+        walletd_args = [get_wallet_daemon_path(), '-w', os.path.abspath(wallet_file), '-p', password, '--rpc-password', rpc_password]
         remote_daemon_address = global_variables.wallet_config.get('remoteDaemonAddress', None)
         # Evaluate if a remote daemon is to be used, else we use the local argument
         if remote_daemon_address:
@@ -111,7 +378,16 @@ class WalletConnection(object):
             raise ValueError(global_variables.message_dict["EXISTING_DAEMON"].format(existing_daemon.pid))
 
         # Start the daemon
-        walletd = Popen(walletd_args)
+        if self.detached:
+            # Start walletd in its own session, so it keeps running after the wallet exits
+            devnull = open(os.devnull, 'r+')
+            if os.name == 'nt':
+                walletd = Popen(walletd_args, stdin=devnull, stdout=devnull, stderr=devnull,
+                                creationflags=DETACHED_PROCESS | CREATE_NEW_PROCESS_GROUP)
+            else:
+                walletd = Popen(walletd_args, stdin=devnull, stdout=devnull, stderr=devnull, preexec_fn=os.setsid)
+        else:
+            walletd = Popen(walletd_args)
 
         # Poll the daemon, if poll returns None the daemon is active
         while walletd.poll():
@@ -122,38 +398,268 @@ class WalletConnection(object):
         # This is an attempt to wait for that to process.
         # When the main window appears the request status will naturally fail if the daemon is not running.
         if not walletd.poll():
+            if self.detached:
+                # Record the daemon so later sessions can attach to it
+                self.write_daemon_details(walletd.pid, rpc_password)
             return walletd
         else:
             WC_logger.error(global_variables.message_dict["INACCESS_DAEMON"])
             raise ValueError(global_variables.message_dict["INACCESS_DAEMON"])
 
-    def stop_wallet_daemon(self):
+    def stop_wallet_daemon(self, force=False, save_timeout=10, terminate_timeout=10, kill_timeout=5):
         """
-        Attempts to terminate (SIGTERM) the wallet daemon.
-        Using Popen.wait() this will hold until the daemon is successfully terminated.
+        Saves the wallet and terminates (SIGTERM) the wallet daemon, killing (SIGKILL) it if it
+        doesn't exit in time, so stopping never hangs on an unresponsive daemon.
+        A detached daemon is left running for later sessions unless force is set.
+        :param save_timeout: seconds to wait for the wallet to be saved
+        :param terminate_timeout: seconds to wait for the daemon to exit after SIGTERM
+        :param kill_timeout: seconds to wait for the daemon to exit after SIGKILL
         :return:
         """
-        if self.walletd and self.check_daemon_running():
+        if self.detached and not force:
+            self.release_wallet_daemon(save_timeout)
+            return
+        if self.detached:
+            remove_daemon_secret(self.secret_file)
+        if self.walletd and self.walletd.poll() is None:
+            self.save_wallet(save_timeout)
+            self.end_wallet_daemon(terminate_timeout, kill_timeout)
+
+    def save_wallet(self, timeout):
+        """
+        Saves the wallet, first waiting for any transaction being sent to finish
+        :param timeout: seconds allowed for waiting and saving together
+        :return: True if the wallet was saved
+        """
+        deadline = time.time() + timeout
+        while not self.send_lock.acquire(False):
+            if time.time() >= deadline:
+                WC_logger.warning("Transaction still being sent after {} seconds, not saving the wallet".format(timeout))
+                return False
+            time.sleep(0.1)
+        try:
+            self.request("save", timeout=max(deadline - time.time(), 1))
+            return True
+        except (RequestException, ValueError) as e:
+            # The RPC server may not be running, or may not have answered in time
+            WC_logger.warning("Failed to save the wallet: {}".format(e))
+            return False
+        finally:
+            self.send_lock.release()
+
+    def end_wallet_daemon(self, terminate_timeout, kill_timeout):
+        """
+        Terminates (SIGTERM) the wallet daemon, killing (SIGKILL) it if it doesn't exit in time
+        :param terminate_timeout: seconds to wait for the daemon to exit after SIGTERM
+        :param kill_timeout: seconds to wait for the daemon to exit after SIGKILL
+        :return: True if the daemon has exited
+        """
+        if self.walletd.poll() is not None:
+            return True
+        self.walletd.terminate()
+        if self.wait_for_exit(self.walletd, terminate_timeout):
+            return True
+        WC_logger.warning("Wallet daemon did not exit within {} seconds, killing it".format(terminate_timeout))
+        self.walletd.kill()
+        if self.wait_for_exit(self.walletd, kill_timeout):
+            return True
+        WC_logger.error("Wallet daemon pid {} did not exit after being killed".format(self.walletd.pid))
+        return False
+
+    def rescan(self, scan_height=None):
+        """
+        Tells walletd to forget what it knows and scan the blockchain again.
+        :param scan_height: block height to scan from, or None to scan the whole blockchain
+        """
+        params = {'scanHeight': scan_height} if scan_height else {}
+        WC_logger.info("Rescanning the wallet from block {}".format(scan_height or 0))
+        self.request("reset", params)
+
+    def restart_wallet_daemon(self, save=False, timeout=10):
+        """
+        Stops our wallet daemon (killing it if it doesn't exit in time), starts a new one
+        with the same credentials and rebinds the RPC connection to it.
+
+        :param save: save the wallet before stopping the daemon, for planned restarts
+        :param timeout: seconds to wait for the daemon to exit before killing it
+        :return: popen instance of the new wallet daemon process
+        """
+        if save:
             try:
-                self.request("save")
-            except ConnectionError:
-                # The RPC server may not be running and raise a ConnectionError
-                pass
+                self.request("save", timeout=timeout)
+            except (RequestException, ValueError) as e:
+                WC_logger.warning("Failed to save the wallet before restarting the wallet daemon: {}".format(e))
+
+        if self.walletd.poll() is None:
             self.walletd.terminate()
-            self.walletd.wait()
+            if not self.wait_for_exit(self.walletd, timeout):
+                WC_logger.warning("Wallet daemon did not exit within {} seconds, killing it".format(timeout))
+                self.walletd.kill()
+                self.wait_for_exit(self.walletd, timeout)
+
+        self.walletd = self.start_wallet_daemon(self.wallet_file, self.password, self.rpc_password)
+        self.rpc_connection = self.create_rpc_connection()
+        # Nothing the old daemon said applies to the new one
+        self.coalescer.invalidate()
+        self.breaker.reset()
+        return self.walletd
+
+    def wait_for_exit(self, process, timeout):
+        """
+        Waits for a process to exit
+        :return: True if the process exited within the timeout, otherwise False
+        """
+        deadline = time.time() + timeout
+        while process.poll() is None:
+            if time.time() >= deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+    def create_rpc_connection(self):
+        """
+        :return: a new RPCConnection to the wallet daemon
+        """
+        return RPCConnection(self.create_rpc_url(), self.rpc_password)
+
+    def write_daemon_details(self, pid, rpc_password):
+        """Records the details needed to attach to our detached wallet daemon"""
+        process = psutil.Process(pid)
+        write_daemon_secret(self.secret_file, {
+            'pid': pid,
+            'createTime': process.create_time(),
+            'walletFile': os.path.abspath(self.wallet_file),
+            'rpcPassword': rpc_password,
+            'passwordVerifier': make_password_verifier(self.password),
+            'rpcUrl': self.create_rpc_url(),
+            'sessionPid': os.getpid(),
+            'lastActive': time.time()
+        })
+
+    def attach_wallet_daemon(self, claim=True, verify_password=True):
+        """
+        Attaches to a detached wallet daemon started by a previous session for this wallet.
+        The daemon is only used if it is still the same process, runs our walletd executable
+        for this wallet, and accepts the recorded RPC password. The daemon has already unlocked
+        the wallet, so the password this session was given is checked against the verifier
+        recorded when it was started.
+
+        :param claim: mark the daemon as in use by this session, so it isn't stopped for being idle
+        :param verify_password: check the wallet password, False only to stop the daemon
+        :return: AttachedProcess for the daemon, or None if there is none to attach to
+        :raises ValueError: if the wallet password is wrong, or can't be checked
+        """
+        info = read_daemon_secret(self.secret_file)
+        if not info:
+            return None
+        try:
+            process = psutil.Process(info['pid'])
+            if process.create_time() != info['createTime'] or process.status() == psutil.STATUS_ZOMBIE:
+                raise psutil.NoSuchProcess(info['pid'])
+            if not self.check_existing_daemon(process, get_wallet_daemon_path()):
+                WC_logger.warning("Not attaching to wallet daemon pid {}, it is not our wallet daemon".format(info['pid']))
+                return None
+            if info['walletFile'] not in process.cmdline():
+                WC_logger.warning("Not attaching to wallet daemon pid {}, it is serving a different wallet".format(info['pid']))
+                return None
+            rpc_connection = RPCConnection(info['rpcUrl'], info['rpcPassword'])
+            rpc_connection.request("getStatus", timeout=5)
+        except (psutil.NoSuchProcess, KeyError):
+            WC_logger.info("Detached wallet daemon has gone, removing its details")
+            remove_daemon_secret(self.secret_file)
+            return None
+        except (psutil.AccessDenied, RequestException, ValueError) as e:
+            WC_logger.warning("Unable to attach to wallet daemon pid {}: {}".format(info['pid'], e))
+            return None
+
+        # The daemon is running this wallet, don't let it be used without the wallet password
+        if verify_password:
+            if 'passwordVerifier' not in info:
+                WC_logger.error(global_variables.message_dict["UNVERIFIABLE_DAEMON"])
+                raise ValueError(global_variables.message_dict["UNVERIFIABLE_DAEMON"])
+            if not check_password_verifier(info['passwordVerifier'], self.password):
+                WC_logger.error(global_variables.message_dict["WRONG_PASSWORD"])
+                raise ValueError(global_variables.message_dict["WRONG_PASSWORD"])
+
+        self.rpc_password = info['rpcPassword']
+        self.rpc_connection = rpc_connection
+        if claim:
+            info['sessionPid'] = os.getpid()
+        info['lastActive'] = time.time()
+        write_daemon_secret(self.secret_file, info)
+        WC_logger.info("Attached to running wallet daemon pid {}".format(info['pid']))
+        return AttachedProcess(process)
+
+    def release_wallet_daemon(self, save_timeout=10):
+        """
+        Leaves a detached wallet daemon running for later sessions and starts a watcher
+        that stops it once it has been idle for the configured time
+        :param save_timeout: seconds to wait for the wallet to be saved
+        """
+        info = read_daemon_secret(self.secret_file)
+        if not info or info.get('pid') != self.walletd.pid:
+            return
+        self.save_wallet(save_timeout)
+        info['sessionPid'] = None
+        info['lastActive'] = time.time()
+        write_daemon_secret(self.secret_file, info)
+
+        idle_timeout = global_variables.wallet_config.get_int('daemonIdleTimeout', 3600)
+        WC_logger.info("Leaving wallet daemon pid {} running, it will stop after {} idle seconds".format(info['pid'], idle_timeout))
+        devnull = open(os.devnull, 'r+')
+        watcher_args = [sys.executable, os.path.join(cur_dir, 'cli.py'), '-w', self.wallet_file,
+                        'idle-stop', '--timeout', str(idle_timeout)]
+        if os.name == 'nt':
+            Popen(watcher_args, stdin=devnull, stdout=devnull, stderr=devnull,
+                  creationflags=DETACHED_PROCESS | CREATE_NEW_PROCESS_GROUP)
+        else:
+            Popen(watcher_args, stdin=devnull, stdout=devnull, stderr=devnull, preexec_fn=os.setsid)
 
-    def __init__(self, wallet_file, password):
+    def create_rpc_url(self):
+        """
+        :return: URL of the wallet daemon's RPC server
+        """
+        # If a user is running their own daemon, they can configure the host/port
+        host = os.getenv('DAEMON_HOST', "http://127.0.0.1")
+        port = os.getenv('DAEMON_PORT', 8070)
+        return "{}:{}/json_rpc".format(host, port)
+
+    def __init__(self, wallet_file, password=None, detached=False, attach_only=False, verify_password=True):
+        """
+        :param wallet_file: path to the wallet file
+        :param password: password for the wallet, needed to start the daemon or attach to a running one
+        :param detached: keep the daemon running after the wallet exits, and attach to one left running earlier
+        :param attach_only: only attach to a running detached daemon, never start one (e.g. for the CLI)
+        :param verify_password: check the password before attaching, False only for connections that
+            just stop the daemon
+        """
         self.wallet_file = wallet_file
         self.password = password
+        self.detached = detached or attach_only
+        self.secret_file = get_daemon_secret_path(wallet_file)
+        # Held while sending a transaction, so background saves never overlap a send
+        self.send_lock = threading.Lock()
+        # Shares identical read-only requests between callers
+        self.coalescer = RequestCoalescer()
+        # Fails requests fast while walletd is unreachable
+        self.breaker = CircuitBreaker(global_variables.wallet_config.get_int('rpcBreakerThreshold', 3),
+                                      global_variables.wallet_config.get_float('rpcBreakerResetTimeout', 5))
+        self.max_retries = global_variables.wallet_config.get_int('rpcRetries', 2)
+        # Orders requests by priority and limits how many walletd handles at once
+        self.dispatcher = RPCDispatcher(global_variables.wallet_config.get_int('rpcMaxConcurrent', 2))
         if not os.path.isfile(wallet_file):
             WC_logger.error(global_variables.message_dict["NO_WALLET_FILE"].format(wallet_file))
             raise ValueError(global_variables.message_dict["NO_WALLET_FILE"].format(wallet_file))
-        self.rpc_password = get_rpc_password()
-        self.walletd = self.start_wallet_daemon(wallet_file, password, self.rpc_password)
-        # If a user is running their own daemon, they can configure the host/port
-        host = os.getenv('DAEMON_HOST', "http://127.0.0.1")
-        port = os.getenv('DAEMON_PORT', 8070)
-        self.rpc_connection = RPCConnection("{}:{}/json_rpc".format(host, port), self.rpc_password)
+        self.walletd = None
+        if self.detached:
+            self.walletd = self.attach_wallet_daemon(claim=not attach_only, verify_password=verify_password)
+        if self.walletd is None:
+            if attach_only:
+                WC_logger.error(global_variables.message_dict["NO_DETACHED_DAEMON"].format(wallet_file))
+                raise ValueError(global_variables.message_dict["NO_DETACHED_DAEMON"].format(wallet_file))
+            self.rpc_password = get_rpc_password()
+            self.walletd = self.start_wallet_daemon(wallet_file, password, self.rpc_password)
+            self.rpc_connection = self.create_rpc_connection()
 
 
 class RPCConnection(object):
@@ -166,8 +672,11 @@ class RPCConnection(object):
         self.headers = {'content-type':'application/json'} # Set the headers
         self.id = 0 # Set the ID, which will increase with each call
 
-    def request(self, method, params={}):
-        """Makes an RPC request to the endpoint the class was initialised with"""
+    def request(self, method, params={}, timeout=None):
+        """
+        Makes an RPC request to the endpoint the class was initialised with
+        :param timeout: seconds to wait for the endpoint, a (connect, read) tuple, or None to wait indefinitely
+        """
 
         # Initialise the payload that is to be sent to the remote endpoint
         payload = {
@@ -181,7 +690,7 @@ class RPCConnection(object):
         self.id += 1 # Increment the ID by one ready for the next call
 
         # Make the request to the endpoint with specified data
-        response = requests.post(self.url, data=json.dumps(payload), headers=self.headers).json()
+        response = requests.post(self.url, data=json.dumps(payload), headers=self.headers, timeout=timeout).json()
 
         # Check if the response returned an error, and extract and wrap it in an exception if it has
         if 'error' in response:
@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+""" DelayedTransactions.py
+
+This file represents scheduled payouts. Building a transaction (picking
+inputs and making ring signatures) is the slow part of sending, so each
+scheduled payout is built ahead of time as a walletd delayed transaction
+while the wallet is otherwise quiet, and only sent at its due time,
+which is then instant. Delayed transactions walletd has since forgotten,
+e.g. after a rescan, are built again, and one walletd refuses to send
+because its inputs are no longer valid is deleted and rebuilt once. A
+payout whose send walletd didn't answer may have been sent all the
+same, so it is looked up in the wallet rather than built again.
+"""
+
+from collections import OrderedDict
+import json
+import logging
+import os
+import threading
+import time
+from requests.exceptions import RequestException
+
+from CircuitBreaker import CircuitOpenError
+from ConfigStore import atomic_write_json
+from ConnectionManager import BACKGROUND, MAINTENANCE
+import Metrics
+from SendQueue import new_idempotency_key, matches_send_params
+from WalletTypes import WalletTransactionState
+
+# Get Logger made in start.py
+delayed_logger = logging.getLogger('trtl_log.delayed')
+
+# Statuses of a scheduled payout
+SCHEDULED = 'scheduled'
+BUILT = 'built'
+SENT = 'sent'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+# Being sent, or walletd didn't answer the send, so it may or may not have been sent
+UNKNOWN = 'unknown'
+# Seconds before its due time a payout may be built
+PREBUILD_LEAD = 60 * 60
+# Number of finished payouts remembered
+MAX_FINISHED = 100
+
+
+def get_schedule_path(wallet_file):
+    """
+    :return: path of the file holding the scheduled payouts of wallet_file
+    """
+    return os.path.abspath(wallet_file) + ".scheduled"
+
+
+class DelayedTransactionPool(object):
+    """
+    This class builds scheduled payouts as delayed transactions ahead of time, and sends them when due.
+    Entries are dicts with the 'key', 'params', 'due', 'status', 'transactionHash', 'error',
+    'builtAt' and 'updated' of a payout. The schedule file is re-read when another process,
+    such as the command line, changes it.
+    """
+    def __init__(self, wallet_connection, path, is_quiet=None, on_status=None,
+                 prebuild_lead=PREBUILD_LEAD, check_interval=5):
+        """
+        :param wallet_connection: the WalletConnection to build and send through
+        :param path: file the schedule is kept in
+        :param is_quiet: callable returning True when walletd isn't busy, e.g. synchronizing. Payouts are
+            only built ahead of time while it does, and when they are due regardless.
+        :param on_status: called on the pool's thread with a copy of an entry whenever its status changes
+        :param prebuild_lead: seconds before its due time a payout may be built
+        :param check_interval: seconds between checks of the schedule
+        """
+        self.wallet_connection = wallet_connection
+        self.path = path
+        self.is_quiet = is_quiet or (lambda: True)
+        self.on_status = on_status
+        self.prebuild_lead = prebuild_lead
+        self.check_interval = check_interval
+
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._file_mtime = None
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.load()
+
+    def load(self):
+        """Reads the schedule from its file, taking whichever copy of each entry was updated last"""
+        try:
+            self._file_mtime = os.stat(self.path).st_mtime
+            with open(self.path) as sFile:
+                entries = json.load(sFile)
+        except (IOError, OSError):
+            return
+        except ValueError as e:
+            delayed_logger.error("Could not read the payout schedule {}: {}".format(self.path, e))
+            return
+        with self._lock:
+            for entry in entries:
+                known = self.entries.get(entry['key'])
+                if known is None:
+                    self.entries[entry['key']] = entry
+                elif entry['updated'] > known['updated']:
+                    known.update(entry)
+
+    def save(self):
+        """Writes the schedule to its file, forgetting the oldest finished entries"""
+        with self._lock:
+            finished = [key for key, entry in self.entries.items() if entry['status'] in (SENT, FAILED, CANCELLED)]
+            for key in finished[:max(len(finished) - MAX_FINISHED, 0)]:
+                del self.entries[key]
+            entries = [dict(entry) for entry in self.entries.values()]
+        try:
+            atomic_write_json(self.path, entries)
+            self._file_mtime = os.stat(self.path).st_mtime
+        except (IOError, OSError) as e:
+            delayed_logger.error("Could not save the payout schedule {}: {}".format(self.path, e))
+
+    def get(self, key):
+        """
+        :return: a copy of the entry with the given key, or None
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            return dict(entry) if entry else None
+
+    def schedule(self, params, due, key=None):
+        """
+        Schedules a payout. A payout with a key that has been scheduled before isn't scheduled again,
+        and the existing entry is returned instead.
+        :param params: sendTransaction parameters
+        :param due: time the payout is to be sent
+        :param key: idempotency key, a new one is made if not given
+        :return: a copy of the payout's entry
+        """
+        key = key or new_idempotency_key()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                return dict(entry)
+            entry = self.entries[key] = {'key': key, 'params': params, 'due': due, 'status': SCHEDULED,
+                                         'transactionHash': None, 'error': None, 'builtAt': None,
+                                         'updated': time.time()}
+            entry = dict(entry)
+        self.save()
+        self._notify(entry)
+        return entry
+
+    def cancel(self, key):
+        """
+        Cancels a payout that hasn't been sent, deleting its delayed transaction
+        :return: True if the payout was cancelled
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or entry['status'] not in (SCHEDULED, BUILT):
+                return False
+        if entry['status'] == BUILT:
+            self._delete(entry)
+        self._set_status(entry, CANCELLED, transactionHash=None)
+        return True
+
+    def start(self):
+        """Starts checking the schedule on a background thread"""
+        self._thread = threading.Thread(target=self.check_loop, name="DelayedTransactions")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stops checking the schedule, waiting up to timeout seconds for a payout being built or sent"""
+        self._stop_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def check_loop(self):
+        """Checks the schedule every check_interval seconds until stopped"""
+        while not self._stop_event.wait(self.check_interval):
+            try:
+                if os.path.exists(self.path) and os.stat(self.path).st_mtime != self._file_mtime:
+                    self.load()
+                self.check()
+            except (RequestException, ValueError) as e:
+                delayed_logger.warning("Failed to check the scheduled payouts: {}".format(e))
+
+    def check(self, now=None):
+        """
+        Finds out whether the payouts whose send walletd didn't answer were sent, sends the payouts
+        that are due, rebuilds those walletd has forgotten, and builds the next one that is due soon
+        if walletd is quiet
+        """
+        now = now if now is not None else time.time()
+        with self._lock:
+            unknown = [entry for entry in self.entries.values() if entry['status'] == UNKNOWN]
+        for entry in unknown:
+            self.resolve(entry)
+
+        with self._lock:
+            built = [entry for entry in self.entries.values() if entry['status'] == BUILT]
+            waiting = sorted((entry for entry in self.entries.values() if entry['status'] == SCHEDULED),
+                             key=lambda entry: entry['due'])
+
+        if built:
+            delayed_hashes = set(self.wallet_connection.request("getDelayedTransactionHashes", priority=BACKGROUND)['transactionHashes'])
+            for entry in built:
+                if entry['transactionHash'] not in delayed_hashes:
+                    # Make sure it hasn't been sent before building it again
+                    self.resolve(entry)
+                if entry['status'] == SCHEDULED:
+                    waiting.append(entry)
+                elif entry['status'] == BUILT and entry['due'] <= now:
+                    self.dispatch(entry)
+
+        waiting.sort(key=lambda entry: entry['due'])
+        for entry in waiting:
+            if entry['due'] <= now:
+                # Too late to build it ahead of time
+                if self.build(entry, blocking=True):
+                    self.dispatch(entry)
+            elif entry['due'] - now <= self.prebuild_lead and self.is_quiet():
+                # Build one at a time, so walletd stays responsive
+                self.build(entry, blocking=False)
+                break
+
+    def resolve(self, entry):
+        """
+        Looks up the transaction of a payout that may have been sent. It is marked as sent if walletd has
+        sent it, and as built if walletd still holds it unsent. If walletd has forgotten it the payout is
+        scheduled to be built again, but only once walletd is synchronized, as a rescan may not have found
+        the sent transaction yet.
+        :param entry: the pool's own entry, not a copy
+        """
+        try:
+            transaction = self.wallet_connection.request("getTransaction", params={'transactionHash': entry['transactionHash']},
+                                                         priority=MAINTENANCE)['transaction']
+        except ValueError:
+            # walletd doesn't know the transaction
+            transaction = None
+        except RequestException as e:
+            delayed_logger.warning("Could not check whether payout {} was sent: {}".format(entry['key'], e))
+            return
+
+        if transaction is not None and transaction['state'] == WalletTransactionState.succeeded:
+            delayed_logger.info("Payout {} was sent as transaction {}".format(entry['key'], entry['transactionHash']))
+            self._set_status(entry, SENT, error=None)
+        elif transaction is not None and transaction['state'] == WalletTransactionState.created:
+            if entry['status'] != BUILT:
+                delayed_logger.info("Payout {} was not sent, it will be sent again".format(entry['key']))
+                self._set_status(entry, BUILT)
+        else:
+            if transaction is None and entry['status'] == UNKNOWN:
+                status = self.wallet_connection.request("getStatus", priority=MAINTENANCE)
+                if status['blockCount'] + 1 < status['knownBlockCount']:
+                    return
+            delayed_logger.warning("Delayed transaction for payout {} has gone, it will be built again".format(entry['key']))
+            self._delete(entry)
+            self._set_status(entry, SCHEDULED, transactionHash=None, builtAt=None)
+
+    def find_built_transaction(self, entry):
+        """
+        Finds a delayed transaction walletd holds for a payout, but that isn't known to be the payout's,
+        such as one whose build walletd didn't answer
+        :return: hash of the delayed transaction, or None if there is none
+        """
+        with self._lock:
+            taken = set(other['transactionHash'] for other in self.entries.values() if other['transactionHash'])
+        hashes = self.wallet_connection.request("getDelayedTransactionHashes", priority=MAINTENANCE)['transactionHashes']
+        for transaction_hash in hashes:
+            if transaction_hash in taken:
+                continue
+            transaction = self.wallet_connection.request("getTransaction", params={'transactionHash': transaction_hash},
+                                                         priority=MAINTENANCE)['transaction']
+            if matches_send_params(transaction, entry['params'], state=WalletTransactionState.created):
+                return transaction_hash
+        return None
+
+    def build(self, entry, blocking):
+        """
+        Builds a payout as a delayed transaction. If walletd refuses to build it the payout fails, and if
+        walletd doesn't answer it stays scheduled, its build possibly being found by the next attempt.
+        :param blocking: wait for a transaction being sent to finish, rather than trying later
+        :return: True if the payout was built
+        """
+        send_lock = self.wallet_connection.send_lock
+        if not send_lock.acquire(blocking):
+            return False
+        start_time = time.time()
+        try:
+            transaction_hash = self.find_built_transaction(entry)
+            if transaction_hash:
+                delayed_logger.info("Found delayed transaction {} already built for payout {}".format(transaction_hash, entry['key']))
+            else:
+                transaction_hash = self.wallet_connection.request("createDelayedTransaction", params=entry['params'],
+                                                                  priority=MAINTENANCE)['transactionHash']
+        except ValueError as e:
+            delayed_logger.error("Failed to build payout {}: {}".format(entry['key'], e))
+            self._set_status(entry, FAILED, error=str(e))
+            return False
+        except RequestException as e:
+            delayed_logger.warning("Failed to build payout {}, it will be built again: {}".format(entry['key'], e))
+            self._set_status(entry, SCHEDULED, error=str(e))
+            return False
+        finally:
+            send_lock.release()
+        Metrics.record('delayed.build_seconds', time.time() - start_time)
+        delayed_logger.info("Built payout {} as delayed transaction {}".format(entry['key'], transaction_hash))
+        self._set_status(entry, BUILT, transactionHash=transaction_hash, builtAt=time.time(), error=None)
+        return True
+
+    def dispatch(self, entry, rebuild=True):
+        """
+        Sends a built payout. If walletd refuses to send it, e.g. because its inputs have been spent since
+        it was built, it is deleted and built again once. If walletd doesn't answer, the payout is marked
+        as unknown until its transaction has been looked up, and isn't built again before then.
+        """
+        # Marked before sending, so a payout whose send is interrupted is looked up rather than built again
+        self._set_status(entry, UNKNOWN)
+        start_time = time.time()
+        try:
+            with self.wallet_connection.send_lock:
+                self.wallet_connection.request("sendDelayedTransaction", params={'transactionHash': entry['transactionHash']},
+                                               priority=MAINTENANCE)
+        except CircuitOpenError as e:
+            # The send was never made, so try again on the next check
+            delayed_logger.warning("Failed to send payout {}: {}".format(entry['key'], e))
+            self._set_status(entry, BUILT)
+            return
+        except RequestException as e:
+            delayed_logger.warning("Payout {} may not have been sent: {}".format(entry['key'], e))
+            self._set_status(entry, UNKNOWN, error=str(e))
+            return
+        except ValueError as e:
+            self._delete(entry)
+            if not rebuild:
+                delayed_logger.error("Failed to send payout {}: {}".format(entry['key'], e))
+                self._set_status(entry, FAILED, error=str(e), transactionHash=None)
+                return
+            delayed_logger.warning("Failed to send payout {}, building it again: {}".format(entry['key'], e))
+            if self.build(entry, blocking=True):
+                self.dispatch(entry, rebuild=False)
+            return
+        Metrics.record('delayed.send_seconds', time.time() - start_time)
+        delayed_logger.info("Sent payout {} as transaction {}".format(entry['key'], entry['transactionHash']))
+        self._set_status(entry, SENT, error=None)
+
+    def _delete(self, entry):
+        """Deletes a payout's delayed transaction from walletd, if it still has it"""
+        try:
+            self.wallet_connection.request("deleteDelayedTransaction", params={'transactionHash': entry['transactionHash']},
+                                           priority=MAINTENANCE)
+        except (RequestException, ValueError) as e:
+            delayed_logger.debug("Could not delete delayed transaction {}: {}".format(entry['transactionHash'], e))
+
+    def _set_status(self, entry, status, **fields):
+        with self._lock:
+            entry.update(fields, status=status, updated=time.time())
+            entry = dict(entry)
+        self.save()
+        self._notify(entry)
+
+    def _notify(self, entry):
+        if self.on_status:
+            try:
+                self.on_status(entry)
+            except Exception as e:
+                delayed_logger.error("Payout status subscriber failed: {}".format(e))
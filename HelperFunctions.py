@@ -4,7 +4,6 @@
 Stores commonly used functions used across the wallet
 """
 import os
-from gi.repository import Gtk, Gdk
 import global_variables
 from uuid import uuid4
 
@@ -35,6 +34,8 @@ def copy_text(text_to_copy, length=-1):
     :param length: length of text to copy or -1 to copy the entire string
     :return:
     """
+    # Imported here so the command line interface can use these helpers without GTK
+    from gi.repository import Gtk, Gdk
     # From GTK doc: copies the text and the length of text, in bytes, or -1, to calculate the length
     Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD).set_text(text_to_copy, length)
 
@@ -42,3 +43,16 @@ def copy_text(text_to_copy, length=-1):
 def get_rpc_password():
     return str(uuid4())
 
+
+def format_byte_size(size):
+    """
+    Formats a size in bytes as a short human readable string
+    :param size: size in bytes
+    :return: string such as '512 B', '1.5 KB' or '3.2 MB'
+    """
+    if size < 1024:
+        return "{} B".format(size)
+    for unit in ('KB', 'MB', 'GB'):
+        size /= 1024.
+        if size < 1024 or unit == 'GB':
+            return "{:.1f} {}".format(size, unit)
@@ -10,36 +10,52 @@ from datetime import datetime
 import threading
 import time
 from gi.repository import Gtk, Gdk, GLib
-import tzlocal
 import requests
-from requests import ConnectionError, HTTPError
+from requests import ConnectionError, HTTPError, RequestException
 from __init__ import __version__
 import global_variables
 import logging
 import json
 from string import Template
-from enum import IntEnum
 
-from HelperFunctions import copy_text
+from HelperFunctions import copy_text, format_byte_size
+from WalletSnapshot import WalletSnapshotHolder
+from WalletTypes import WalletTransactionState, WalletTransferType
+from WalletSupervisor import WalletSupervisor
+from NodeSelector import NodeMonitor
+from SyncTracker import SyncTracker
+import TransactionExport
+from TransactionIndex import TransactionIndex
+from RenderCache import TransactionRenderCache
+from WalletAnalytics import WalletAnalytics
+from RestoreHeight import parse_restore_point
+from Checkpointer import Checkpointer
+from PendingTransactions import PendingTransactionTracker
+from AddressValidator import split_integrated_address
+import CircuitBreaker
+import Profiler
+from StallDetector import StallDetector
+import MemoryDiagnostics
+import Metrics
+from ConnectionManager import BACKGROUND
+import SendQueue
+import DelayedTransactions
 
 # Get Logger made in start.py
 main_logger = logging.getLogger('trtl_log.main')
 
-
-class WalletTransactionState(IntEnum):
-    """Defines the possible states for a transaction."""
-    succeeded = 0,
-    failed = 1,
-    cancelled = 2,
-    created = 3,
-    deleted = 4
-
-
-class WalletTransferType(IntEnum):
-    """Defines the possible types of a transfer within a transaction."""
-    usual = 0,
-    donation = 1,
-    change = 2
+# Maximum number of characters kept in the RPC console, older output is dropped beyond this
+RPC_BUFFER_MAX_CHARS = 2000000
+# Number of characters of an RPC result rendered before the user has to ask for more
+RPC_RENDER_LIMIT = 100000
+# Number of characters inserted into the RPC console per main loop iteration
+RPC_RENDER_CHUNK_SIZE = 8192
+# Number of RPC console calls remembered across sessions
+RPC_HISTORY_LENGTH = 100
+# Number of new transactions above which the treeview is detached while they are loaded
+TRANSACTION_BULK_LOAD_ROWS = 1000
+# Maximum number of rows shown for a transaction filter, so broad filters stay responsive
+FILTER_RESULT_LIMIT = 5000
 
 
 class UILogHandler(logging.Handler):
@@ -71,8 +87,8 @@ class MainWindow(object):
     def on_MainWindow_destroy(self, object, data=None):
         """Called by GTK when the main window is destroyed"""
         Gtk.main_quit() # Quit the GTK main loop
-        self._stop_update_thread.set() # Set the event to stop the thread
-        threading.Thread.join(self.update_thread, 5) # Wait until the thread terminates
+        # Wake the update thread now, the shutdown coordinator waits for it and stops the daemon
+        self._stop_update_thread.set()
 
     def on_CopyButton_clicked(self, object, data=None):
         """Called by GTK when the copy button is clicked"""
@@ -124,6 +140,248 @@ class MainWindow(object):
             noteBook.remove_page(noteBook.page_num(RPCBox))
             self.builder.get_object("RPCMenuItem").set_active(False)
 
+    def on_ProfilerMenuItem_toggled(self, object, data=None):
+        """Called by GTK when the CPU Profiler menu item is toggled
+            This starts profiling, or stops it and shows where the reports were written"""
+        profiler = global_variables.profiler
+        if object.get_active():
+            if profiler is None:
+                global_variables.profiler = Profiler.Profiler(
+                    Profiler.get_log_directory(), global_variables.wallet_config.get('profileMode', Profiler.SAMPLE),
+                    global_variables.wallet_config.get_float('profileSampleInterval', Profiler.SAMPLE_INTERVAL),
+                    global_variables.wallet_config.get_int('profileReportInterval', Profiler.REPORT_INTERVAL))
+                global_variables.profiler.start()
+        elif profiler is not None:
+            global_variables.profiler = None
+            paths = profiler.stop()
+            if paths:
+                self.MainWindow_generic_dialog("The profile has been written to:\n" + "\n".join(paths), "CPU Profiler")
+            else:
+                self.MainWindow_generic_dialog("The profile could not be written, see the log", "CPU Profiler")
+
+    def on_MemoryDiagnosticsMenuItem_toggled(self, object, data=None):
+        """Called by GTK when the Memory Diagnostics menu item is toggled
+            This starts tracing memory use, or takes a last snapshot and stops"""
+        diagnostics = global_variables.memory_diagnostics
+        self.builder.get_object("MemorySnapshotMenuItem").set_sensitive(object.get_active())
+        if object.get_active():
+            if diagnostics is None:
+                global_variables.memory_diagnostics = MemoryDiagnostics.MemoryDiagnostics(
+                    Profiler.get_log_directory(), self.count_memory_structures,
+                    global_variables.wallet_config.get_int('memorySnapshotInterval', MemoryDiagnostics.SNAPSHOT_INTERVAL))
+                global_variables.memory_diagnostics.start()
+            else:
+                # Started with --memory, before the window existed
+                diagnostics.get_counts = self.count_memory_structures
+        elif diagnostics is not None:
+            global_variables.memory_diagnostics = None
+            self.run_memory_snapshot(diagnostics.stop)
+
+    def on_MemorySnapshotMenuItem_activate(self, object, data=None):
+        """Called by GTK when the Take Memory Snapshot menu item is clicked"""
+        if global_variables.memory_diagnostics is not None:
+            self.run_memory_snapshot(global_variables.memory_diagnostics.take_snapshot)
+
+    def run_memory_snapshot(self, take_snapshot):
+        """Takes a memory snapshot on a background thread, then shows where it was written"""
+        self.builder.get_object("MemorySnapshotMenuItem").set_sensitive(False)
+
+        def snapshot_worker():
+            path = take_snapshot()
+            GLib.idle_add(self.show_memory_snapshot, path)
+
+        snapshot_thread = threading.Thread(target=snapshot_worker, name="MemorySnapshot")
+        snapshot_thread.daemon = True
+        snapshot_thread.start()
+
+    def show_memory_snapshot(self, path):
+        self.builder.get_object("MemorySnapshotMenuItem").set_sensitive(global_variables.memory_diagnostics is not None)
+        self.MainWindow_generic_dialog("The memory snapshot has been written to:\n" + path, "Memory Diagnostics")
+        return False
+
+    def count_memory_structures(self):
+        """
+        Counts the items held by the window's main structures, for the memory diagnostics.
+        GTK objects may only be read on the GTK thread, so the count is made there.
+        :return: dict of structure name -> number of items
+        """
+        if threading.current_thread() is self.gtk_thread:
+            return self.collect_memory_structures()
+        counts = {}
+        counted = threading.Event()
+
+        def collect():
+            counts.update(self.collect_memory_structures())
+            counted.set()
+            return False
+
+        GLib.idle_add(collect)
+        if not counted.wait(5):
+            main_logger.warning("The window was too busy to count its structures for the memory snapshot")
+        return counts
+
+    def collect_memory_structures(self):
+        snapshot = self.wallet_data.current
+        return {
+            'snapshot blocks': len(snapshot.blocks),
+            'snapshot block transactions': sum(len(block['transactions']) for block in snapshot.blocks),
+            'indexed transactions': len(self.transaction_index),
+            'transaction list rows': len(self.transactions_list_store),
+            'rendered transactions': len(self.render_cache),
+            'log lines': self.builder.get_object("LogBuffer").get_line_count(),
+            'RPC console lines': self.RPCbuffer.get_line_count(),
+            'RPC history entries': len(self.rpc_history),
+        }
+
+    def on_AnalyticsMenuItem_activate(self, object, data=None):
+        """Called by GTK when the Analytics menu item is clicked
+            The analytics are worked out on a background thread, then shown in a dialog"""
+        snapshot = self.wallet_data.current
+        if not snapshot.balances:
+            self.MainWindow_generic_dialog("The wallet has not loaded yet, try again shortly", "Analytics")
+            return
+        self.builder.get_object("AnalyticsMenuItem").set_sensitive(False)
+        analytics_thread = threading.Thread(target=self.analytics_worker, args=(snapshot,), name="WalletAnalytics")
+        analytics_thread.daemon = True
+        analytics_thread.start()
+
+    def analytics_worker(self, snapshot):
+        """Works out the analytics for a snapshot away from the GTK thread"""
+        start_time = time.time()
+        try:
+            analytics = WalletAnalytics.from_blocks(snapshot.blocks)
+            results = {
+                'totals': analytics.totals(),
+                'monthly': analytics.grouped('month'),
+                'chart': analytics.downsample(),
+                'reconciliation': analytics.reconcile(snapshot.balances)
+            }
+        except (KeyError, ValueError) as e:
+            main_logger.error("Failed to work out wallet analytics: {}".format(e))
+            GLib.idle_add(self.builder.get_object("AnalyticsMenuItem").set_sensitive, True)
+            return
+        main_logger.debug("Worked out analytics for {} transactions in {:.2f}s".format(len(analytics), time.time() - start_time))
+        GLib.idle_add(self.show_analytics_dialog, results)
+
+    def show_analytics_dialog(self, results):
+        """Shows the analytics worked out by analytics_worker"""
+        self.builder.get_object("AnalyticsMenuItem").set_sensitive(True)
+        totals = results['totals']
+        reconciliation = results['reconciliation']
+
+        dialog = Gtk.Dialog("Wallet Analytics", self.window, 0, (Gtk.STOCK_CLOSE, Gtk.ResponseType.CLOSE))
+        dialog.set_default_size(700, 600)
+        content = dialog.get_content_area()
+
+        summary = Gtk.Label(xalign=0, margin=10)
+        if reconciliation['matches']:
+            reconciliation_text = "Balance matches walletd"
+        else:
+            reconciliation_text = "<b>Balance differs from walletd by {:,.2f}</b>".format(reconciliation['difference']/100.)
+        summary.set_markup("<b>Transactions</b> {:,} | <b>In</b> {:,.2f} | <b>Out</b> {:,.2f} | <b>Fees</b> {:,.2f}\n{}".format(
+            totals['transactions'], totals['inflow']/100., totals['outflow']/100., totals['fees']/100., reconciliation_text))
+        content.pack_start(summary, False, False, 0)
+
+        # Balance over time, drawn from the downsampled series
+        chart = Gtk.DrawingArea()
+        chart.set_size_request(-1, 250)
+        chart.connect("draw", self.draw_balance_chart, results['chart'])
+        content.pack_start(chart, True, True, 0)
+
+        # Monthly figures
+        monthly = results['monthly']
+        monthly_store = Gtk.ListStore(str, str, str, str, str, str)
+        for i in range(len(monthly['period']) - 1, -1, -1):
+            monthly_store.append([
+                str(monthly['period'][i]),
+                "{:,.2f}".format(monthly['inflow'][i]/100.),
+                "{:,.2f}".format(monthly['outflow'][i]/100.),
+                "{:,.2f}".format(monthly['fees'][i]/100.),
+                "{:,}".format(int(monthly['transactions'][i])),
+                "{:,.2f}".format(monthly['balance'][i]/100.)
+            ])
+        monthly_view = Gtk.TreeView(model=monthly_store)
+        for column_index, title in enumerate(("Month", "In", "Out", "Fees", "Transactions", "Balance")):
+            monthly_view.append_column(Gtk.TreeViewColumn(title, Gtk.CellRendererText(), text=column_index))
+        monthly_scrolled_window = Gtk.ScrolledWindow()
+        monthly_scrolled_window.add(monthly_view)
+        content.pack_start(monthly_scrolled_window, True, True, 0)
+
+        dialog.show_all()
+        dialog.run()
+        dialog.destroy()
+        return False
+
+    def on_StatisticsMenuItem_activate(self, object, data=None):
+        """Called by GTK when the Performance Statistics menu item is clicked
+            This shows the main loop stalls by handler, and the metrics recorded by the wallet's subsystems"""
+        dialog = Gtk.Dialog("Performance Statistics", self.window, 0, (Gtk.STOCK_CLOSE, Gtk.ResponseType.CLOSE))
+        dialog.set_default_size(700, 600)
+        content = dialog.get_content_area()
+
+        # Main loop stalls, the handler that froze the window longest in total first
+        stalls = self.stall_detector.snapshot()
+        stall_label = Gtk.Label(xalign=0, margin=10)
+        stall_label.set_markup("<b>Window stalls</b> {:,} over {:.1f}s".format(
+            sum(row[1] for row in stalls), sum(row[2] for row in stalls)))
+        content.pack_start(stall_label, False, False, 0)
+        stall_store = Gtk.ListStore(str, str, str, str)
+        for handler, count, total, longest in stalls:
+            stall_store.append([handler, "{:,}".format(count), "{:.2f}".format(total), "{:.2f}".format(longest)])
+        stall_view = Gtk.TreeView(model=stall_store)
+        for column_index, title in enumerate(("Handler", "Stalls", "Total (s)", "Longest (s)")):
+            stall_view.append_column(Gtk.TreeViewColumn(title, Gtk.CellRendererText(), text=column_index))
+        stall_scrolled_window = Gtk.ScrolledWindow()
+        stall_scrolled_window.add(stall_view)
+        content.pack_start(stall_scrolled_window, True, True, 0)
+
+        # Everything recorded through Metrics
+        metrics_store = Gtk.ListStore(str, str, str, str, str)
+        for name, metric in sorted(Metrics.snapshot().items()):
+            mean = metric['total'] / float(metric['count']) if metric['count'] else 0
+            metrics_store.append([name, "{:,}".format(metric['count']), "{:.3g}".format(metric['last']),
+                                  "{:.3g}".format(mean), "{:.3g}".format(metric['max'])])
+        metrics_view = Gtk.TreeView(model=metrics_store)
+        for column_index, title in enumerate(("Metric", "Count", "Last", "Mean", "Max")):
+            metrics_view.append_column(Gtk.TreeViewColumn(title, Gtk.CellRendererText(), text=column_index))
+        metrics_scrolled_window = Gtk.ScrolledWindow()
+        metrics_scrolled_window.add(metrics_view)
+        content.pack_start(metrics_scrolled_window, True, True, 0)
+
+        dialog.show_all()
+        dialog.run()
+        dialog.destroy()
+
+    def draw_balance_chart(self, widget, cr, chart):
+        """Draws the balance series as a line, with the range of each bucket shaded behind it"""
+        width = widget.get_allocated_width()
+        height = widget.get_allocated_height()
+        if len(chart['close']) < 2:
+            return False
+        first, last = float(chart['timestamp'][0]), float(chart['timestamp'][-1])
+        lowest, highest = float(chart['low'].min()), float(chart['high'].max())
+        time_span = (last - first) or 1.0
+        balance_span = (highest - lowest) or 1.0
+        margin = 10
+
+        def x(timestamp):
+            return margin + (float(timestamp) - first) / time_span * (width - 2 * margin)
+
+        def y(balance):
+            return height - margin - (float(balance) - lowest) / balance_span * (height - 2 * margin)
+
+        cr.set_source_rgba(0.2, 0.6, 0.3, 0.25)
+        for i in range(len(chart['close'])):
+            cr.move_to(x(chart['timestamp'][i]), y(chart['low'][i]))
+            cr.line_to(x(chart['timestamp'][i]), y(chart['high'][i]))
+        cr.stroke()
+        cr.set_source_rgb(0.2, 0.6, 0.3)
+        cr.move_to(x(chart['timestamp'][0]), y(chart['close'][0]))
+        for i in range(1, len(chart['close'])):
+            cr.line_to(x(chart['timestamp'][i]), y(chart['close'][i]))
+        cr.stroke()
+        return False
+
     def on_RPCMethodComboBox_changed(self, object):
         """ Called by GTK when the selected RPC method is changed """
         # Determine which method has been selected
@@ -133,13 +391,14 @@ class MainWindow(object):
         self.builder.get_object("RPCMethodDescriptionLabel").set_text(self.RPCCommands[method]['Description'])
 
         # Get a valid transaction hash (for use within the arguments)
+        snapshot = self.wallet_data.current
         transaction_hash = ""
-        if self.blocks:
-            transaction_hash = self.blocks[-1]['transactions'][-1]['transactionHash']
+        if snapshot.blocks:
+            transaction_hash = snapshot.blocks[-1]['transactions'][-1]['transactionHash']
 
         # Populate the arguments text field with appropriate data based on the selected method
         self.builder.get_object("RPCArgumentsTextBuffer").set_text(self.RPCCommands[method]['Arguments'].safe_substitute(dict(
-            address=self.addresses[0] if self.addresses else "",
+            address=snapshot.addresses[0] if snapshot.addresses else "",
             transactionHash=transaction_hash
         )))
 
@@ -156,8 +415,7 @@ class MainWindow(object):
 
         # Validate the method and arguments are somewhat valid
         if method == "":
-            end_iter = self.RPCbuffer.get_end_iter()
-            self.RPCbuffer.insert(end_iter, "> \nERROR: Must specify a method" + "\n\n")
+            self.append_rpc_text("> \nERROR: Must specify a method" + "\n\n")
             return
         if args == "":
             # If no arguments specified, assume an empty dictionary
@@ -166,24 +424,155 @@ class MainWindow(object):
             try:
                 args_dict = json.loads(args)
             except ValueError:
-                end_iter = self.RPCbuffer.get_end_iter()
-                self.RPCbuffer.insert(end_iter, "> " + method + "()\nERROR: Arguments are not in valid JSON format\n\n")
+                self.append_rpc_text("> " + method + "()\nERROR: Arguments are not in valid JSON format\n\n")
                 return
 
-        # Send the request to RPC server and print results on textview
+        # Remember the call so it can be recalled later, even across sessions
+        self.add_rpc_history(method, args)
+
+        # Send the request to the RPC server on a worker thread so a slow or large call doesn't freeze the window.
+        # Each call gets a new id, which lets us discard the result of a call that has since been cancelled.
+        self.rpc_call_id += 1
+        self.rpc_pending_text = ""
+        self.builder.get_object("rpcShowMoreButton").set_sensitive(False)
+        self.builder.get_object("rpcSendButton").set_sensitive(False)
+        self.builder.get_object("rpcCancelButton").set_sensitive(True)
+        worker = threading.Thread(target=self.rpc_request_worker, args=(self.rpc_call_id, method, args_dict))
+        worker.daemon = True
+        worker.start()
+
+    def rpc_request_worker(self, call_id, method, args_dict):
+        """
+        Runs an RPC console request away from the GTK thread.
+        The response is serialised here as well, since a large result can take a while to encode.
+        :param call_id: id of the console call, used to detect cancellation
+        :param method: the RPC method to call
+        :param args_dict: the parameters for the RPC method
+        """
+        start_time = time.time()
         try:
             r = global_variables.wallet_connection.request(method, args_dict)
-            end_iter = self.RPCbuffer.get_end_iter()
-            self.RPCbuffer.insert(end_iter, "> " + method + "()\n" + json.dumps(r) + "\n\n")
+            text = json.dumps(r)
+            header = "> {}() [{:.2f}s, {}]\n".format(method, time.time() - start_time, format_byte_size(len(text)))
         except Exception as e:
-            end_iter = self.RPCbuffer.get_end_iter()
-            self.RPCbuffer.insert(end_iter, "> " + method + "()\nERROR: " + str(e) + "\n\n")
+            text = "ERROR: " + str(e)
+            header = "> {}() [{:.2f}s]\n".format(method, time.time() - start_time)
+        GLib.idle_add(self.rpc_request_finished, call_id, header, text)
+
+    def rpc_request_finished(self, call_id, header, text):
+        """Called on the GTK thread once an RPC console request has completed"""
+        if call_id != self.rpc_call_id:
+            # The call was cancelled while it was running, so the result is no longer wanted
+            main_logger.debug("Discarding result of cancelled RPC console call: " + header.strip())
+            return False
+        self.builder.get_object("rpcSendButton").set_sensitive(True)
+        self.builder.get_object("rpcCancelButton").set_sensitive(False)
+        self.append_rpc_text(header)
+
+        # Only render the start of very large results, the rest can be requested with the 'show more' button
+        self.rpc_pending_text = text[RPC_RENDER_LIMIT:]
+        self.render_rpc_text(call_id, text[:RPC_RENDER_LIMIT])
+        return False
+
+    def render_rpc_text(self, call_id, text):
+        """
+        Incrementally inserts text into the RPC buffer, one chunk per main loop iteration,
+        so rendering a large result doesn't block the UI.
+        """
+        if call_id != self.rpc_call_id:
+            return False
+        if len(text) > RPC_RENDER_CHUNK_SIZE:
+            self.append_rpc_text(text[:RPC_RENDER_CHUNK_SIZE])
+            GLib.idle_add(self.render_rpc_text, call_id, text[RPC_RENDER_CHUNK_SIZE:])
+            return False
+        self.append_rpc_text(text)
+        if self.rpc_pending_text:
+            self.append_rpc_text("\n... {} more\n\n".format(format_byte_size(len(self.rpc_pending_text))))
+            self.builder.get_object("rpcShowMoreButton").set_sensitive(True)
+        else:
+            self.append_rpc_text("\n\n")
+        return False
+
+    def append_rpc_text(self, text):
+        """Appends text to the RPC buffer, dropping the oldest output once the buffer is too large"""
+        self.RPCbuffer.insert(self.RPCbuffer.get_end_iter(), text)
+        overflow = self.RPCbuffer.get_char_count() - RPC_BUFFER_MAX_CHARS
+        if overflow > 0:
+            self.RPCbuffer.delete(self.RPCbuffer.get_start_iter(), self.RPCbuffer.get_iter_at_offset(overflow))
+
+    def on_rpcCancelButton_clicked(self, object, data=None):
+        """ Called by GTK when the RPCCancel button has been clicked """
+        # The request itself can't be aborted once sent, but its result will be discarded when it arrives
+        self.rpc_call_id += 1
+        self.rpc_pending_text = ""
+        self.builder.get_object("rpcSendButton").set_sensitive(True)
+        self.builder.get_object("rpcCancelButton").set_sensitive(False)
+        self.builder.get_object("rpcShowMoreButton").set_sensitive(False)
+        self.append_rpc_text("CANCELLED\n\n")
+
+    def on_rpcShowMoreButton_clicked(self, object, data=None):
+        """ Called by GTK when the RPCShowMore button has been clicked """
+        text = self.rpc_pending_text[:RPC_RENDER_LIMIT]
+        self.rpc_pending_text = self.rpc_pending_text[RPC_RENDER_LIMIT:]
+        self.builder.get_object("rpcShowMoreButton").set_sensitive(False)
+        self.render_rpc_text(self.rpc_call_id, text)
+
+    def on_RPCArgumentsTextView_key_press_event(self, widget, event):
+        """
+        Called by GTK when a key is pressed in the RPC arguments text view.
+        Ctrl+Up and Ctrl+Down step through the console history.
+        """
+        if not event.state & Gdk.ModifierType.CONTROL_MASK or not self.rpc_history:
+            return False
+        if event.keyval == Gdk.KEY_Up:
+            self.rpc_history_position = max(self.rpc_history_position - 1, 0)
+        elif event.keyval == Gdk.KEY_Down:
+            self.rpc_history_position = min(self.rpc_history_position + 1, len(self.rpc_history) - 1)
+        else:
+            return False
+
+        entry = self.rpc_history[self.rpc_history_position]
+        for row in self.rpc_method_list_store:
+            if row[0] == entry['method']:
+                self.builder.get_object("RPCMethodComboBox").set_active_iter(row.iter)
+                break
+        # Setting the method fills in its template, so restore the arguments afterwards
+        self.builder.get_object("RPCArgumentsTextBuffer").set_text(entry['arguments'])
+        return True
+
+    def add_rpc_history(self, method, args):
+        """Adds a call to the RPC console history and saves the history to file"""
+        entry = {'method': method, 'arguments': args}
+        if entry in self.rpc_history:
+            self.rpc_history.remove(entry)
+        self.rpc_history.append(entry)
+        del self.rpc_history[:-RPC_HISTORY_LENGTH]
+        self.rpc_history_position = len(self.rpc_history)
+        try:
+            with open(global_variables.rpc_history_file, 'w') as hFile:
+                hFile.write(json.dumps(self.rpc_history))
+        except (IOError, OSError) as e:
+            main_logger.warn("Could not save RPC console history: {}".format(e))
+
+    def load_rpc_history(self):
+        """
+        Loads the RPC console history saved by previous sessions
+        :return: list of {'method', 'arguments'} dicts, oldest first
+        """
+        try:
+            with open(global_variables.rpc_history_file) as hFile:
+                history = json.loads(hFile.read())
+            return [entry for entry in history if 'method' in entry and 'arguments' in entry][-RPC_HISTORY_LENGTH:]
+        except (IOError, OSError, ValueError, TypeError):
+            return []
 
     def on_rpcClearButton_clicked(self, object, data=None):
         """ Called by GTK when the RPCClear button has been clicked """
         start_iter = self.RPCbuffer.get_start_iter()
         end_iter = self.RPCbuffer.get_end_iter()
         self.RPCbuffer.delete(start_iter, end_iter)
+        self.rpc_pending_text = ""
+        self.builder.get_object("rpcShowMoreButton").set_sensitive(False)
 
     def on_RPCTextView_size_allocate(self, *args):
         """The GTK Auto Scrolling method used to scroll RPC view when info is added"""
@@ -212,42 +601,83 @@ class MainWindow(object):
 
     def on_ResetMenuItem_activate(self, object, data=None):
         """
-        Attempts to call the reset action on the wallet API.
-        On success, shows success message to user.
-        On error, shows error message to user.
+        Asks where to rescan the wallet from, then calls the reset action on the wallet API
+        with that scan height on a background thread. The known transactions stay listed
+        until the rescan reaches them.
         :param object: unused
         :param data: unused
         :return:
         """
-        try:
-            global_variables.wallet_connection.request("reset")
-
-            # Re-initialize wallet data so the UI doesn't refresh with outdated data
-            self.balances = []
-            self.addresses = []
-            self.status = []
-            self.blocks = []
-
-            # Clear/reset UI fields immediately rather than waiting for refresh UI task
-            self.builder.get_object("AvailableBalanceAmountLabel").set_label("{:,.2f}".format(0))
-            self.builder.get_object("LockedBalanceAmountLabel").set_label("{:,.2f}".format(0))
-            self.transactions_list_store.clear()
-            self.builder.get_object("MainStatusLabel").set_markup("<b>Loading...</b>")
-            self.builder.get_object("SendTRTLSubBox").hide()
-            self.builder.get_object("SendTRTLMessageLabel").show()
-
-            dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.INFO, Gtk.ButtonsType.OK, "Wallet Reset")
-            dialog.format_secondary_text(global_variables.message_dict["SUCCESS_WALLET_RESET"])
-            main_logger.info(global_variables.message_dict["SUCCESS_WALLET_RESET"])
-            dialog.run()
-            dialog.destroy()
+        dialog = Gtk.Dialog("Rescan Wallet", self.window, Gtk.DialogFlags.MODAL | Gtk.DialogFlags.DESTROY_WITH_PARENT,
+                            (Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL, Gtk.STOCK_OK, Gtk.ResponseType.OK))
+        dialog_box = dialog.get_content_area()
+        rescan_label = Gtk.Label(margin=10)
+        rescan_label.set_markup("<b>Rescan from (block height or date as YYYY-MM-DD):</b>\n"
+                                "Leave blank to rescan the whole blockchain, which can take hours.\n"
+                                "Transactions before the starting point are not found again by the rescan.")
+        rescan_entry = Gtk.Entry(margin=10)
+        rescan_entry.set_placeholder_text("(Optional)")
+        rescan_entry.connect("activate", lambda w: dialog.response(Gtk.ResponseType.OK))
+        dialog_box.pack_start(rescan_label, False, False, 0)
+        dialog_box.pack_start(rescan_entry, False, False, 0)
+        dialog.show_all()
+        response = dialog.run()
+        rescan_text = rescan_entry.get_text()
+        dialog.destroy()
+        if response != Gtk.ResponseType.OK:
+            return
 
+        try:
+            scan_height = parse_restore_point(rescan_text)
         except ValueError as e:
-            dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.ERROR, Gtk.ButtonsType.CANCEL, "Error resetting")
-            dialog.format_secondary_text(global_variables.message_dict["FAILED_WALLET_RESET"])
-            main_logger.error(global_variables.message_dict["FAILED_WALLET_RESET"])
-            dialog.run()
-            dialog.destroy()
+            self.show_rescan_result(Gtk.MessageType.ERROR, "Error rescanning", str(e))
+            return
+
+        self.builder.get_object("ResetMenuItem").set_sensitive(False)
+        # Snapshots polled once walletd has reset must keep the known transactions listed, even before the
+        # reset returns. Those already being polled may predate the rescan, so only later ones can show it finished.
+        self.rescan_height = scan_height or 0
+        self.rescan_sequence = self.wallet_data.current.sequence + 1
+        rescan_thread = threading.Thread(target=self.rescan_worker, args=(scan_height,), name="Rescan")
+        rescan_thread.daemon = True
+        rescan_thread.start()
+
+    def rescan_worker(self, scan_height):
+        """Asks walletd to rescan away from the GTK thread, as the reset can take a while to return"""
+        try:
+            global_variables.wallet_connection.rescan(scan_height)
+        except (ValueError, RequestException) as e:
+            main_logger.error("{} {}".format(global_variables.message_dict["FAILED_WALLET_RESET"], e))
+            GLib.idle_add(self.rescan_failed)
+            return
+        GLib.idle_add(self.rescan_started, scan_height or 0)
+
+    def rescan_failed(self):
+        """Called on the GTK thread when walletd couldn't be asked to rescan"""
+        self.rescan_height = None
+        self.rescan_sequence = 0
+        self.show_rescan_result(Gtk.MessageType.ERROR, "Error rescanning", global_variables.message_dict["FAILED_WALLET_RESET"])
+        return False
+
+    def rescan_started(self, scan_height):
+        """Called on the GTK thread once walletd has started rescanning"""
+        global_variables.sync_tracker.reset()
+        self.builder.get_object("MainStatusLabel").set_markup("<b>Rescanning...</b>")
+        self.builder.get_object("SendTRTLSubBox").hide()
+        self.builder.get_object("SendTRTLMessageLabel").show()
+        message = global_variables.message_dict["SUCCESS_WALLET_RESCAN"].format(scan_height)
+        main_logger.info(message)
+        self.show_rescan_result(Gtk.MessageType.INFO, "Wallet Rescan", message)
+        return False
+
+    def show_rescan_result(self, message_type, title, message):
+        """Shows the outcome of asking walletd to rescan"""
+        self.builder.get_object("ResetMenuItem").set_sensitive(True)
+        dialog = Gtk.MessageDialog(self.window, 0, message_type, Gtk.ButtonsType.OK, title)
+        dialog.format_secondary_text(message)
+        dialog.run()
+        dialog.destroy()
+        return False
 
     def on_ExportKeysMenuItem_activate(self, object, data=None):
         """
@@ -263,7 +693,7 @@ class MainWindow(object):
             view_secret_key = r.get('viewSecretKey', 'N/A')
 
             # Capture the secret spend key for this specific address
-            r = global_variables.wallet_connection.request("getSpendKeys", params={'address': self.addresses[0]})
+            r = global_variables.wallet_connection.request("getSpendKeys", params={'address': self.wallet_data.current.addresses[0]})
             spend_secret_key = r.get('spendSecretKey', 'N/A')
 
             # Show a message box containing the secret keys
@@ -293,45 +723,149 @@ class MainWindow(object):
             dialog.run()
             dialog.destroy()
 
+    def on_ExportTransactionsMenuItem_activate(self, object, data=None):
+        """
+        Asks where to export the transaction history to, then streams it from walletd
+        into the file on a background thread, showing the progress in a dialog.
+        :param object: unused
+        :param data: unused
+        :return:
+        """
+        snapshot = self.wallet_data.current
+        if not snapshot.addresses or not snapshot.status:
+            self.MainWindow_generic_dialog("The wallet has not loaded yet, try again shortly", "Export Transactions")
+            return
+
+        chooser = Gtk.FileChooserDialog("Export Transactions", self.window, Gtk.FileChooserAction.SAVE,
+                                        (Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL, Gtk.STOCK_SAVE, Gtk.ResponseType.OK))
+        chooser.set_do_overwrite_confirmation(True)
+        chooser.set_current_name("transactions.csv")
+        for name, pattern in (("CSV (*.csv)", "*.csv"), ("JSON Lines (*.jsonl)", "*.jsonl"), ("Parquet (*.parquet)", "*.parquet")):
+            file_filter = Gtk.FileFilter()
+            file_filter.set_name(name)
+            file_filter.add_pattern(pattern)
+            chooser.add_filter(file_filter)
+        row_type_combo = Gtk.ComboBoxText()
+        row_type_combo.append('transactions', "One row per transaction")
+        row_type_combo.append('transfers', "One row per transfer")
+        row_type_combo.set_active_id('transactions')
+        chooser.set_extra_widget(row_type_combo)
+        response = chooser.run()
+        path = chooser.get_filename()
+        row_type = row_type_combo.get_active_id()
+        chooser.destroy()
+        if response != Gtk.ResponseType.OK or not path:
+            return
+
+        # The dialog only shows progress, the export itself runs on its own thread
+        cancel_event = threading.Event()
+        progress_dialog = Gtk.Dialog("Export Transactions", self.window, 0, (Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL))
+        progress_bar = Gtk.ProgressBar(show_text=True)
+        progress_bar.set_text("Exporting to {}".format(path))
+        progress_dialog.get_content_area().pack_start(progress_bar, True, True, 10)
+        progress_dialog.connect("response", lambda dialog, response_id: cancel_event.set())
+        progress_dialog.show_all()
+
+        def update_progress(done, total):
+            GLib.idle_add(progress_bar.set_fraction, float(done) / total if total else 1.0)
+
+        def export_worker():
+            # Whatever goes wrong, the progress dialog must be closed
+            message = "Failed to export transactions"
+            try:
+                blocks = TransactionExport.iter_wallet_blocks(
+                    global_variables.wallet_connection, snapshot.addresses, snapshot.status['blockCount'],
+                    progress=update_progress, cancelled=cancel_event.is_set)
+                row_count = TransactionExport.export_transactions(
+                    path, blocks, snapshot.status['blockCount'], TransactionExport.guess_format(path), row_type,
+                    cancelled=cancel_event.is_set)
+                message = "Export cancelled" if cancel_event.is_set() else "Exported {} rows to {}".format(row_count, path)
+            except (ValueError, IOError, OSError, RequestException) as e:
+                main_logger.error("Failed to export transactions: {}".format(e))
+                message = "Failed to export transactions: {}".format(e)
+            except Exception:
+                main_logger.exception("Failed to export transactions")
+            finally:
+                GLib.idle_add(export_finished, message)
+
+        def export_finished(message):
+            progress_dialog.destroy()
+            self.builder.get_object("MainStatusLabel").set_label(message)
+            return False
+
+        export_thread = threading.Thread(target=export_worker, name="TransactionExport")
+        export_thread.daemon = True
+        export_thread.start()
+
+    def on_DetachedDaemonMenuItem_toggled(self, object, data=None):
+        """Called by GTK when the 'Keep Wallet Daemon Running' menu item is toggled"""
+        global_variables.wallet_config['detachedDaemon'] = object.get_active()
+
+    def on_config_changed(self, key, value):
+        """Called by the config store, on the thread that made the change, whenever a config value changes"""
+        if key == 'detachedDaemon':
+            GLib.idle_add(self.builder.get_object("DetachedDaemonMenuItem").set_active, bool(value))
+
     def on_SaveMenuItem_activate(self, object, data=None):
         """
-        Attempts to call the save action on the wallet API.
-        On success, shows success mesage to user.
-        On error, shows error message to user.
+        Calls the save action on the wallet API on a background thread, as saving a large wallet,
+        or waiting for a transaction being sent, can take a while.
         :param object: unused
         :param data: unused
         :return:
         """
+        self.builder.get_object("SaveMenuItem").set_sensitive(False)
+        save_thread = threading.Thread(target=self.save_worker, name="WalletSave")
+        save_thread.daemon = True
+        save_thread.start()
+
+    def save_worker(self):
+        """Saves the wallet away from the GTK thread, then reports the result on it"""
+        saved = False
         try:
-            global_variables.wallet_connection.request("save")
+            saved = self.checkpointer.checkpoint()
+        finally:
+            GLib.idle_add(self.save_finished, saved)
+
+    def save_finished(self, saved):
+        """
+        Called on the GTK thread once the wallet has been saved.
+        On success, shows success mesage to user.
+        On error, shows error message to user.
+        """
+        self.builder.get_object("SaveMenuItem").set_sensitive(True)
+        if saved:
             dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.INFO,Gtk.ButtonsType.OK, "Wallet Saved")
             dialog.format_secondary_text(global_variables.message_dict["SUCCESS_WALLET_SAVE"])
             main_logger.info(global_variables.message_dict["SUCCESS_WALLET_SAVE"])
             dialog.run()
             dialog.destroy()
-        except ValueError as e:
+        else:
             dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.ERROR,Gtk.ButtonsType.CANCEL, "Error saving")
             dialog.format_secondary_text(global_variables.message_dict["FAILED_WALLET_SAVE"])
             main_logger.error(global_variables.message_dict["FAILED_WALLET_SAVE"])
             dialog.run()
             dialog.destroy()
-
+        return False
 
     def on_SendButton_clicked(self, object, data=None):
         """
         Fired when the send button is clicked.
         Attempts to validate inputs and displays label text for erroneous entries.
-        On success, populates label with transaction hash.
+        On success, queues the transaction to be sent; its progress is shown as it is sent.
         :param object:
         :param data:
         :return:
         """
-        # Capture target address and validating
-        target_address = self.builder.get_object("RecipientAddressEntry").get_text()
-        if not target_address.startswith('TRTL') or len(target_address) <= 50:
+        # Capture target address and payment ID and validating, splitting an integrated address into the two
+        target_address = self.builder.get_object("RecipientAddressEntry").get_text().strip()
+        payment_id = self.builder.get_object("PaymentIDEntry").get_text().strip()
+        try:
+            target_address, payment_id = split_integrated_address(target_address, payment_id)
+        except ValueError as e:
             self.builder.get_object("TransactionStatusLabel")\
-                .set_label("The address doesn't look right, are you sure it's a TRTL address?")
-            main_logger.warn("Incorrect TRTL address set on send")
+                .set_label("The address or payment ID doesn't look right: {}".format(e))
+            main_logger.warn("Incorrect TRTL address set on send: {}".format(e))
             return
         source_address = self.builder.get_object("AddressTextBox").get_text()
 
@@ -377,63 +911,122 @@ class MainWindow(object):
 
         # Mixin
         mixin = int(self.builder.get_object("MixinSpinButton").get_text())
-        body = {
-            'anonymity': mixin,
-            'fee': fee,
-            'transfers': [{'amount': amount, 'address': target_address}],
-        }
-        payment_id = self.builder.get_object("PaymentIDEntry").get_text()
-        if payment_id:
-            body['paymentId'] = payment_id
+        body = SendQueue.make_send_params(target_address, amount, fee, mixin, payment_id)
+
+        # The form's key stays the same until the send finishes, so clicking Send twice only sends once
         try:
-            resp = global_variables.wallet_connection.request("sendTransaction", params=body)
-            txHash = resp['transactionHash']
-            self.builder.get_object("TransactionStatusLabel").set_markup("<b>TxID</b>: {}".format(txHash))
-            self.clear_send_ui()
-            main_logger.info("New Send Transaction - Amount: " + str(amount) + ", Mix: " + str(mixin) + ", To_Address: " + str(target_address))
-        except ConnectionError as e:
-            print("Failed to connect to daemon: {}".format(e))
-            self.builder.get_object("TransactionStatusLabel") \
-                .set_label(global_variables.message_dict["FAILED_SEND"])
-            main_logger.error(global_variables.message_dict["FAILED_SEND"])
+            entry = self.send_queue.submit(body, self.send_form_key)
         except ValueError as e:
-            print(global_variables.message_dict["FAILED_SEND_EXCEPTION"].format(e))
-            self.builder.get_object("TransactionStatusLabel") \
-                .set_label("Failed: {}".format(e))
-            main_logger.error(global_variables.message_dict["FAILED_SEND_EXCEPTION"].format(e))
+            # The form was changed while its previous send is still being sent or checked
+            main_logger.warn(str(e))
+            self.builder.get_object("TransactionStatusLabel")\
+                .set_label("A previous send is still being sent or checked, wait for it to finish before sending again")
+            return
+        # Show where a repeated submission has got to
+        self.show_send_status(entry)
+        main_logger.info("New Send Transaction - Amount: " + str(amount) + ", Mix: " + str(mixin) + ", To_Address: " + str(target_address))
 
-    def on_HomeTransactionsTreeView_row_activated(self, iter, path, user_data=None):
+    def on_send_status_changed(self, entry):
+        """Called on the send queue's thread whenever a send request's status changes"""
+        GLib.idle_add(self.show_send_status, entry)
+
+    def on_payout_status_changed(self, entry):
+        """Called on the delayed transaction pool's thread whenever a scheduled payout's status changes"""
+        if entry['status'] in (DelayedTransactions.SENT, DelayedTransactions.FAILED):
+            GLib.idle_add(self.show_payout_status, entry)
+
+    def show_payout_status(self, entry):
+        """
+        Shows that a scheduled payout has been sent or has failed
+        :param entry: copy of the scheduled payout entry
+        """
+        status_label = self.builder.get_object("TransactionStatusLabel")
+        if entry['status'] == DelayedTransactions.SENT:
+            status_label.set_markup("<b>Scheduled payout sent</b>, <b>TxID</b>: {}".format(entry['transactionHash']))
+            self.pending_tracker.poke()
+        else:
+            status_label.set_label("Scheduled payout failed: {}".format(entry['error']))
+        return False
+
+    def is_wallet_quiet(self):
+        """
+        :return: True if walletd is synchronized and not sending, so a scheduled payout can be built ahead of time
+        """
+        status = self.wallet_data.current.status
+        return bool(status) and status['blockCount'] + 1 >= status['knownBlockCount'] \
+            and not global_variables.wallet_connection.send_lock.locked()
+
+    def show_send_status(self, entry):
+        """
+        Shows the progress of a send request under the send form
+        :param entry: copy of the send queue entry
+        """
+        status_label = self.builder.get_object("TransactionStatusLabel")
+        if entry['status'] == SendQueue.QUEUED:
+            status_label.set_markup("<b>Queued</b>, waiting to be sent...")
+        elif entry['status'] == SendQueue.BUILDING:
+            status_label.set_markup("<b>Building transaction</b>, this can take a while...")
+        elif entry['status'] == SendQueue.SENT:
+            status_label.set_markup("<b>TxID</b>: {}".format(entry['transactionHash']))
+            # List the transaction straight away, rather than once it has been mined
+            self.pending_tracker.poke()
+            if entry['key'] == self.send_form_key:
+                self.clear_send_ui()
+        elif entry['status'] == SendQueue.UNKNOWN:
+            # Keep the form's key, so sending it again can't send the transaction twice
+            status_label.set_markup("<b>No answer from walletd</b>, checking whether the transaction was sent...")
+        elif entry['status'] == SendQueue.FAILED:
+            status_label.set_label("Failed: {}".format(entry['error']))
+            if entry['key'] == self.send_form_key:
+                # Let the form be sent again, as a new request
+                self.send_form_key = SendQueue.new_idempotency_key()
+        return False
+
+    def on_HomeTransactionsTreeView_row_activated(self, tree_view, path, user_data=None):
         """Called by GTK when a row is activated (double clicked) in the transactions treeview
             This shows the transaction details dialog"""
         # Get the dialog from the builder
         transaction_dialog = self.builder.get_object("TransactionDialog")
 
+        # The view shows either the full list store or a filtered one
+        activated_hash = tree_view.get_model()[path][0]
+
         # Retrieve the selected transaction details
         selected_transaction = None
-        for block in self.blocks:
+        for block in self.wallet_data.current.blocks:
             if selected_transaction:
                 break
             for transaction in block['transactions']:
-                if transaction['transactionHash'] == self.transactions_list_store[path][0]:
+                if transaction['transactionHash'] == activated_hash:
                     selected_transaction = transaction
                     block_hash = block['blockHash']
                     break
 
+        if not selected_transaction:
+            # It may still be waiting to be mined
+            selected_transaction = self.pending_tracker.transactions.get(activated_hash)
+            transaction = selected_transaction
+            block_hash = None
+
         if not selected_transaction:
             error_dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.ERROR, Gtk.ButtonsType.OK, "Error")
-            error_dialog.format_secondary_text("Transaction with the following hash no longer exists: %s" % self.transactions_list_store[path][0])
+            error_dialog.format_secondary_text("Transaction with the following hash no longer exists: %s" % activated_hash)
             error_dialog.run()
             error_dialog.destroy()
             return
 
         # Populate the dialog with the transaction details
-        self.builder.get_object("TransactionDateValue").set_text(datetime.fromtimestamp(
-            selected_transaction['timestamp'], tzlocal.get_localzone()).strftime("%Y/%m/%d %H:%M:%S%z (%Z)"))
-        self.builder.get_object("TransactionBlockIndexValue").set_label(str(selected_transaction['blockIndex']))
-        self.builder.get_object("TransactionBlockIndexLink").set_uri("https://blocks.turtle.link/?hash=%s#blockchain_block" % block_hash)
+        direction, amount, date = self.render_cache.render(selected_transaction)
+        self.builder.get_object("TransactionDateValue").set_text(date)
+        if block_hash:
+            self.builder.get_object("TransactionBlockIndexValue").set_label(str(selected_transaction['blockIndex']))
+            self.builder.get_object("TransactionBlockIndexLink").set_uri("https://blocks.turtle.link/?hash=%s#blockchain_block" % block_hash)
+        else:
+            self.builder.get_object("TransactionBlockIndexValue").set_label("Pending")
+            self.builder.get_object("TransactionBlockIndexLink").set_uri("https://blocks.turtle.link/?hash=%s#blockchain_transaction" % selected_transaction['transactionHash'])
         self.builder.get_object("TransactionHashValue").set_label(selected_transaction['transactionHash'])
         self.builder.get_object("TransactionHashLink").set_uri("https://blocks.turtle.link/?hash=%s#blockchain_transaction" % selected_transaction['transactionHash'])
-        self.builder.get_object("TransactionAmountValue").set_text("{:,.2f}".format(transaction['amount']/100.))
+        self.builder.get_object("TransactionAmountValue").set_text(amount)
         self.builder.get_object("TransactionFeeValue").set_text("{:,.2f}".format(transaction['fee']/100.))
         self.builder.get_object("TransactionStateValue").set_text(WalletTransactionState(transaction['state']).name.capitalize())
         self.builder.get_object("TransactionUnlockTimeValue").set_text(str(transaction['unlockTime']))
@@ -462,6 +1055,101 @@ class MainWindow(object):
         # Hide the dialog upon it's closure
         transaction_dialog.hide()
 
+    def on_TransactionFilter_changed(self, object, data=None):
+        """Called by GTK when any of the transaction filter bar inputs change"""
+        self.apply_transaction_filter()
+
+    def on_ClearFilterButton_clicked(self, object, data=None):
+        """Called by GTK when the filter bar's clear button is clicked"""
+        # Block the filter from being re-applied for every input that is reset
+        self.clearing_filter = True
+        for entry_name in ("HashFilterEntry", "MinAmountFilterEntry", "MaxAmountFilterEntry",
+                           "StartDateFilterEntry", "EndDateFilterEntry"):
+            self.builder.get_object(entry_name).set_text("")
+        self.builder.get_object("DirectionFilterComboBox").set_active_id("all")
+        self.builder.get_object("ConfirmedFilterComboBox").set_active_id("all")
+        self.clearing_filter = False
+        self.apply_transaction_filter()
+
+    def parse_filter_entry(self, entry_name, parse):
+        """
+        Parses the text of a filter bar entry, highlighting the entry if the text is invalid
+        :param entry_name: name of the entry in the builder
+        :param parse: callable turning the text into a filter value, raising ValueError if invalid
+        :return: the filter value, or None if the entry is empty or invalid
+        """
+        entry = self.builder.get_object(entry_name)
+        text = entry.get_text().strip()
+        style = entry.get_style_context()
+        style.remove_class("error")
+        if not text:
+            return None
+        try:
+            return parse(text)
+        except ValueError:
+            style.add_class("error")
+            return None
+
+    def get_transaction_filter(self):
+        """
+        Reads the filter bar
+        :return: dict of TransactionIndex.query arguments, empty if no filter is set
+        """
+        def parse_amount(text):
+            return int(round(float(text.replace(',', '')) * 100))
+
+        def parse_date(text):
+            return int(time.mktime(datetime.strptime(text, "%Y-%m-%d").timetuple()))
+
+        filters = {
+            'hash_prefix': self.builder.get_object("HashFilterEntry").get_text().strip() or None,
+            'min_amount': self.parse_filter_entry("MinAmountFilterEntry", parse_amount),
+            'max_amount': self.parse_filter_entry("MaxAmountFilterEntry", parse_amount),
+            'start_time': self.parse_filter_entry("StartDateFilterEntry", parse_date),
+            'end_time': self.parse_filter_entry("EndDateFilterEntry", parse_date),
+        }
+        if filters['end_time'] is not None:
+            # Include the whole of the end date
+            filters['end_time'] += 60 * 60 * 24 - 1
+        direction = self.builder.get_object("DirectionFilterComboBox").get_active_id()
+        if direction in ("In", "Out"):
+            filters['direction'] = direction
+        confirmation = self.builder.get_object("ConfirmedFilterComboBox").get_active_id()
+        if confirmation in ("confirmed", "unconfirmed"):
+            filters['confirmed'] = confirmation == "confirmed"
+        return dict((key, value) for key, value in filters.items() if value is not None)
+
+    def apply_transaction_filter(self):
+        """
+        Shows only the transactions matching the filter bar, using the transaction index
+        so the view updates quickly however many transactions the wallet has.
+        """
+        if self.clearing_filter:
+            return False
+        tree_view = self.builder.get_object("HomeTransactionsTreeView")
+        result_label = self.builder.get_object("TransactionFilterResultLabel")
+        filters = self.get_transaction_filter()
+        if not filters:
+            self.filtered_list_store = None
+            tree_view.set_model(self.transactions_list_store)
+            result_label.hide()
+            return False
+
+        start_time = time.time()
+        matches = self.transaction_index.query(**filters)
+        self.filtered_list_store = Gtk.ListStore(str, str, bool, str, str)
+        for transaction_hash in matches[:FILTER_RESULT_LIMIT]:
+            self.filtered_list_store.append(self.transactions_list_store[self.transaction_rows[transaction_hash]][:])
+        tree_view.set_model(self.filtered_list_store)
+
+        if len(matches) > FILTER_RESULT_LIMIT:
+            result_label.set_text("Showing the newest {} of {} matching transactions".format(FILTER_RESULT_LIMIT, len(matches)))
+        else:
+            result_label.set_text("{} of {} transactions match".format(len(matches), len(self.transaction_index)))
+        result_label.show()
+        main_logger.debug("Filtered {} transactions in {:.1f}ms".format(len(self.transaction_index), (time.time() - start_time) * 1000))
+        return False
+
     def clear_send_ui(self):
         """
         Clear the inputs within the send transaction frame
@@ -471,6 +1159,7 @@ class MainWindow(object):
         self.builder.get_object("MixinSpinButton").set_value(3)
         self.builder.get_object("AmountEntry").set_text('')
         self.builder.get_object("PaymentIDEntry").set_text('')
+        self.send_form_key = SendQueue.new_idempotency_key()
 
     def request_wallet_data_loop(self):
         """
@@ -479,71 +1168,71 @@ class MainWindow(object):
         while not self._stop_update_thread.isSet():
             try:
                 # Request the balance from the wallet
-                self.balances = global_variables.wallet_connection.request("getBalance")
+                balances = global_variables.wallet_connection.request("getBalance", priority=BACKGROUND)
 
                 # Request the addresses from the wallet (looks like you can have multiple?)
-                self.addresses = global_variables.wallet_connection.request("getAddresses")['addresses']
+                addresses = global_variables.wallet_connection.request("getAddresses", priority=BACKGROUND)['addresses']
 
                 # Request the current status from the wallet
-                self.status = global_variables.wallet_connection.request("getStatus")
+                status = global_variables.wallet_connection.request("getStatus", priority=BACKGROUND)
 
                 # Keep track of the known block count and log a warning if it has gone down (it occasionally temporarily drops, not sure why?)
                 # Buffer the block count by 1 due to latency issues - using a remote daemon for example will almost always be behind one block
-                known_block_count = self.status['knownBlockCount']
-                if known_block_count+1 < self.previous_known_block_count:
+                known_block_count = status['knownBlockCount']
+                known_block_count_dropped = known_block_count+1 < self.previous_known_block_count
+                if known_block_count_dropped:
                     main_logger.warning(
                         "Known block height {} has dropped from its previous value {}".format(known_block_count, self.previous_known_block_count))
                 self.previous_known_block_count = known_block_count
 
                 # Check if the block count is above the known block count and log a warning if so
                 # Buffer the block count by 1 due to latency issues - using a remote daemon for example will almost always be behind one block
-                block_count = self.status['blockCount']
+                block_count = status['blockCount']
                 if block_count-1 > known_block_count:
                     main_logger.warning("Current block height {} is above the known block height {}".format(block_count, known_block_count))
+                global_variables.sync_tracker.add_sample(block_count, known_block_count)
 
                 # Request all transactions related to our addresses from the wallet
                 # This returns a list of blocks with only our transactions populated in them
-                self.blocks = global_variables.wallet_connection.request(
-                    "getTransactions", params={
-                        "blockCount": self.status['blockCount'],
-                        "firstBlockIndex": 1,
-                        "addresses": self.addresses})['items']
+                # They are fetched a window at a time, so requests the user is waiting on can go in between
+                blocks = list(TransactionExport.iter_wallet_blocks(
+                    global_variables.wallet_connection, addresses, status['blockCount'],
+                    window=global_variables.wallet_config.get_int('pollBlockWindow', TransactionExport.EXPORT_BLOCK_WINDOW),
+                    cancelled=self._stop_update_thread.is_set, priority=BACKGROUND))
+                if self._stop_update_thread.is_set():
+                    break
 
                 # Retrieve the current price
                 try:
                     api_result = requests.get('https://api.coingecko.com/api/v3/coins/turtlecoin')
                     api_result.raise_for_status()
-                    self.current_price = api_result.json()['market_data']['current_price']
+                    current_price = api_result.json()['market_data']['current_price']
                 except (ValueError, KeyError, HTTPError) as e:
                     main_logger.error("Failed to retrieve current price: {}".format(e))
-                    self.current_price = []
-
-                self.currentTimeout = 0
-                self.currentTry = 0
+                    current_price = {}
 
-            except ConnectionError as e:
-                main_logger.error(str(e))
+                # Publish everything at once so the UI never renders a mix of old and new data
+                self.wallet_data.publish(balances, addresses, status, blocks, current_price, known_block_count_dropped,
+                                         global_variables.sync_tracker.progress())
 
-                # Checks to see if the daemon failed to respond 3 or more times in a row
-                if self.currentTimeout >= self.watchdogTimeout:
-                    # Checks to see if we have restarted the daemon 3 or more times already
-                    if self.currentTry <= self.watchdogMaxTry:
-                        # Restart the daemon if conditions are met
-                        self.restart_Daemon()
-                    else:
-                        # Here means the daemon failed 3 times in a row, and we restarted it 3 times with no successful connection. At this point we must give up.
-                        dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.ERROR, Gtk.ButtonsType.OK, "Walletd daemon could not be recovered!")
-                        dialog.format_secondary_text("Turtle Wallet has tried numerous times to relaunch the needed daemon and has failed. Please relaunch the wallet!")
-                        dialog.run()
-                        dialog.destroy()
-                        Gtk.main_quit()
-                else:
-                    self.currentTimeout += 1
+            except CircuitBreaker.CircuitOpenError:
+                # Walletd is known to be unreachable, keep the status bar's countdown current
+                breaker = global_variables.wallet_connection.breaker
+                GLib.idle_add(self.show_breaker_status, breaker.state, breaker.retry_in())
 
+            except (RequestException, ValueError, KeyError) as e:
+                # A timeout, an RPC error or an unexpected answer mustn't end the poll thread.
+                # Recovering the daemon is left to the wallet supervisor
+                main_logger.error(str(e))
                 main_logger.error(global_variables.message_dict["FAILED_DAEMON_COMM"])
-                self.builder.get_object("MainStatusLabel").set_label(global_variables.message_dict["FAILED_DAEMON_COMM"])
+                GLib.idle_add(self.builder.get_object("MainStatusLabel").set_label, global_variables.message_dict["FAILED_DAEMON_COMM"])
+
+            self._stop_update_thread.wait(5) # Wait 5 seconds before doing it again, unless told to stop
 
-            time.sleep(5) # Wait 5 seconds before doing it again
+    def stop_update_thread(self, timeout):
+        """Stops the wallet data request loop, waiting up to timeout seconds for a request in progress"""
+        self._stop_update_thread.set()
+        self.update_thread.join(timeout)
 
     def MainWindow_generic_dialog(self, title, message):
         """
@@ -567,96 +1256,189 @@ class MainWindow(object):
         else:
             return False
 
-    def restart_Daemon(self):
+    def on_wallet_daemon_given_up(self, reason):
+        """Called by the wallet supervisor (on its own thread) when walletd can't be recovered"""
+        GLib.idle_add(self.show_wallet_daemon_given_up, reason)
+
+    def show_wallet_daemon_given_up(self, reason):
+        """Tells the user the wallet daemon could not be recovered, then exits"""
+        dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.ERROR, Gtk.ButtonsType.OK, "Walletd daemon could not be recovered!")
+        dialog.format_secondary_text("Turtle Wallet has tried numerous times to relaunch the needed daemon and has failed ({}). Please relaunch the wallet!".format(reason))
+        dialog.run()
+        dialog.destroy()
+        Gtk.main_quit()
+        return False
+
+    def on_wallet_data_published(self, snapshot):
+        """Called on the poll thread whenever new wallet data has been published"""
+        # Hand the UI update over to the GTK thread
+        GLib.idle_add(self.refresh_ui)
+
+    def on_breaker_state_changed(self, state, retry_in):
+        """Called on whichever thread made a request when the circuit breaker in front of walletd changes state"""
+        GLib.idle_add(self.show_breaker_status, state, retry_in)
+
+    def show_breaker_status(self, state, retry_in):
+        """Shows in the status bar that walletd is unreachable, until it answers again and the next poll replaces it"""
+        if state == CircuitBreaker.OPEN:
+            self.builder.get_object("MainStatusLabel").set_markup(
+                "<b>Wallet daemon unreachable</b> | Retrying in {:.0f}s".format(retry_in))
+        elif state == CircuitBreaker.HALF_OPEN:
+            self.builder.get_object("MainStatusLabel").set_markup("<b>Reconnecting to wallet daemon...</b>")
+        return False
+
+    def on_pending_transactions_changed(self, transactions, left):
+        """Called on the pending transaction tracker's thread whenever the unconfirmed pool has changed"""
+        GLib.idle_add(self.refresh_pending_transactions, transactions, left)
+
+    def refresh_pending_transactions(self, transactions, left):
         """
-        This function gets called when during the wallet data request cycle, the daemon is found to be possibly dead or hanging.
-        The function simply calls back to the 'start_wallet_daemon' in ConnectionManager, which will restart our
-        daemon for us if needed.
+        Lists the wallet's transactions waiting in the unconfirmed pool as unconfirmed rows,
+        without waiting for the next full history poll
+        :param transactions: dict of hash -> pending transaction
+        :param left: hashes that have left the pool, mined or dropped
         """
-        global_variables.wallet_connection.start_wallet_daemon(global_variables.wallet_connection.wallet_file, global_variables.wallet_connection.password)
-
+        changed = False
+        for transaction_hash, transaction in transactions.items():
+            if self.transaction_index.add_pending(transaction):
+                direction, amount, date = self.render_cache.render(transaction)
+                self.transaction_rows[transaction_hash] = self.transactions_list_store.prepend([
+                    transaction_hash, direction, False, amount, date])
+                changed = True
+        # A transaction that has left the pool is either mined or dropped, which the next snapshots will tell
+        for transaction_hash in left:
+            if self.transaction_index.is_pending(transaction_hash):
+                self.pending_left[transaction_hash] = self.wallet_data.current.sequence
+        if changed and self.filtered_list_store is not None:
+            self.apply_transaction_filter()
+        return False
 
     def refresh_ui(self):
         """
         This method refreshes all the values in the UI to represent the current state of the wallet.
         """
+        # Take the current snapshot once, so everything rendered here comes from the same poll
+        snapshot = self.wallet_data.current
+        if snapshot.sequence == self.rendered_sequence:
+            return False
+        self.rendered_sequence = snapshot.sequence
+
         # Update the balance amounts, formatted as comma seperated with 2 decimal points
-        if self.balances:
-            self.builder.get_object("AvailableBalanceAmountLabel").set_label("{:,.2f}".format(self.balances['availableBalance']/100.))
-            self.builder.get_object("LockedBalanceAmountLabel").set_label("{:,.2f}".format(self.balances['lockedAmount']/100.))
+        if snapshot.balances:
+            self.builder.get_object("AvailableBalanceAmountLabel").set_label("{:,.2f}".format(snapshot.balances['availableBalance']/100.))
+            self.builder.get_object("LockedBalanceAmountLabel").set_label("{:,.2f}".format(snapshot.balances['lockedAmount']/100.))
 
         # Load the first address in for now - TODO: Check if multiple addresses need accounting for
-        if self.addresses:
-            self.builder.get_object("AddressTextBox").set_text(self.addresses[0])
-
-        # Iterate through the blocks and extract the relevant data
-        tx_hash_list = [tx[0] for tx in self.transactions_list_store]
-        for block in self.blocks:
-            if block['transactions']: # Check the block contains any transactions
-                for transaction in block['transactions']: # Loop through each transaction in the block
-                    # Append new transactions to the treeview's backing list store in the correct format
-                    if transaction['transactionHash'] not in tx_hash_list:
-                        self.transactions_list_store.prepend([
-                            transaction['transactionHash'],
-                            # Determine the direction of the transfer (In/Out)
-                            "In" if transaction['amount'] > 0 else "Out",
-                            # Determine if the transaction is confirmed or not - block rewards take 40 blocks to confirm,
-                            # transactions between wallets are marked as confirmed automatically with unlock time 0
-                            transaction['unlockTime'] is 0 or transaction['unlockTime'] <= self.status['blockCount'] - 40,
-                            # Format the amount as comma seperated with 2 decimal points
-                            "{:,.2f}".format(transaction['amount']/100.),
-                            # Format the transaction time for the user's local timezone
-                            datetime.fromtimestamp(transaction['timestamp'], tzlocal.get_localzone()).strftime("%Y/%m/%d %H:%M:%S%z (%Z)"),
-                        ])
-                        tx_hash_list.append(transaction['transactionHash'])
+        if snapshot.addresses:
+            self.builder.get_object("AddressTextBox").set_text(snapshot.addresses[0])
+
+        # While rescanning, keep listing the transactions walletd hasn't reached again yet
+        retain_from = None
+        if self.rescan_height is not None and snapshot.status:
+            if snapshot.sequence > self.rescan_sequence and snapshot.status['blockCount'] + 1 >= snapshot.status['knownBlockCount']:
+                main_logger.info("Rescan from block {} has finished".format(self.rescan_height))
+                self.rescan_height = None
+            else:
+                retain_from = snapshot.status['blockCount']
+
+        # Bring the transaction index up to date, which tells us which rows have changed
+        added, removed, confirmed, mined = self.transaction_index.update(snapshot.blocks, snapshot.status.get('blockCount', 0), retain_from)
+        tree_view = self.builder.get_object("HomeTransactionsTreeView")
+        if len(added) > TRANSACTION_BULK_LOAD_ROWS:
+            # Detach the model while loading lots of rows, so the view doesn't update for every single one
+            tree_view.set_model(None)
+        # Format the new transactions' direction, amount and local date in one pass
+        for transaction, (direction, amount, date) in zip(added, self.render_cache.render_many(added)):
+            # Prepend new transactions to the treeview's backing list store in the correct format
+            self.transaction_rows[transaction['transactionHash']] = self.transactions_list_store.prepend([
+                transaction['transactionHash'],
+                direction,
+                self.transaction_index.is_confirmed(transaction['transactionHash']),
+                amount,
+                date,
+            ])
+        if tree_view.get_model() is None:
+            tree_view.set_model(self.filtered_list_store or self.transactions_list_store)
 
         # Remove any transactions that are no longer valid
         # e.g. in case the daemon has accidentally forked and listed some transactions that are invalid
-        valid_transactions = []
-        for block in self.blocks:
-            for transaction in block['transactions']:
-                valid_transactions.append(transaction['transactionHash'])
-        for transaction in self.transactions_list_store:
-            if transaction[0] not in valid_transactions:
-                self.transactions_list_store.remove(transaction.iter)
+        for transaction_hash in removed:
+            self.transactions_list_store.remove(self.transaction_rows.pop(transaction_hash))
+            self.render_cache.forget(transaction_hash)
+
+        # Mark transactions that have since been confirmed
+        for transaction_hash in confirmed:
+            self.transactions_list_store.set_value(self.transaction_rows[transaction_hash], 2, True)
+
+        # Pending transactions that have been mined keep their row, now showing when they were mined
+        for transaction in mined:
+            transaction_hash = transaction['transactionHash']
+            self.pending_left.pop(transaction_hash, None)
+            self.render_cache.forget(transaction_hash)
+            row = self.transaction_rows[transaction_hash]
+            self.transactions_list_store.set_value(row, 2, self.transaction_index.is_confirmed(transaction_hash))
+            self.transactions_list_store.set_value(row, 4, self.render_cache.render(transaction)[2])
+
+        # Drop pending transactions that left the pool and still weren't mined by a later poll
+        for transaction_hash, sequence in list(self.pending_left.items()):
+            if not self.transaction_index.is_pending(transaction_hash):
+                del self.pending_left[transaction_hash]
+            elif snapshot.sequence > sequence + 1:
+                main_logger.info("Pending transaction {} was dropped from the pool".format(transaction_hash))
+                del self.pending_left[transaction_hash]
+                self.transaction_index.drop_pending(transaction_hash)
+                self.transactions_list_store.remove(self.transaction_rows.pop(transaction_hash))
+                self.render_cache.forget(transaction_hash)
+                removed.append(transaction_hash)
+
+        if self.filtered_list_store is not None and (added or removed or confirmed or mined):
+            self.apply_transaction_filter()
 
         # Update the valuation
-        if self.current_price:
+        if snapshot.current_price:
             monetary_abbreviation = global_variables.wallet_config.get('monetaryAbbreviation', 'usd').lower()
             monetary_symbol = global_variables.wallet_config.get('monetarySymbol', '$')
-            if monetary_abbreviation not in self.current_price:
+            if monetary_abbreviation not in snapshot.current_price:
                 main_logger.debug("Unknown monetaryAbbreviation: {0}; using usd".format(monetary_abbreviation))
-                main_logger.debug("Valid monetaryAbbreviation's: {0}".format(self.current_price.keys()))
+                main_logger.debug("Valid monetaryAbbreviation's: {0}".format(snapshot.current_price.keys()))
                 monetary_abbreviation = global_variables.wallet_config['monetaryAbbreviation'] = "usd"
                 monetary_symbol = global_variables.wallet_config['monetarySymbol'] = "$"
             self.builder.get_object("MonetaryValueSymbolLabel").set_text(monetary_symbol)
             self.builder.get_object("MonetaryValueAmountLabel").set_text("{:,.2f}".format(
-                float(self.current_price[monetary_abbreviation]) * float(self.balances['availableBalance']/100.)))
+                float(snapshot.current_price[monetary_abbreviation]) * float(snapshot.balances['availableBalance']/100.)))
             self.builder.get_object("BTCValueAmountLabel").set_text("{:,.8f}".format(
-                float(self.current_price['btc']) * float(self.balances['availableBalance']/100.)))
+                float(snapshot.current_price['btc']) * float(snapshot.balances['availableBalance']/100.)))
         else:
             self.builder.get_object("MonetaryValueSymbolLabel").set_text("")
             self.builder.get_object("MonetaryValueAmountLabel").set_text("---")
             self.builder.get_object("BTCValueAmountLabel").set_text("---")
 
         # Update the status label in the bottom right with block height, transaction count, peer count, and last refresh time
-        if self.status:
-            block_count = self.status['blockCount']
-            known_block_count = self.status['knownBlockCount']
-            peer_count = self.status['peerCount']
+        if snapshot.status:
+            block_count = snapshot.status['blockCount']
+            known_block_count = snapshot.status['knownBlockCount']
+            peer_count = snapshot.status['peerCount']
             days_behind = ((known_block_count - block_count) * 30) / (60 * 60 * 24)
             percent_synced = int((float(block_count) / float(known_block_count)) * 100)
 
             block_height_string = "<b>Current block height</b> {}".format(block_count)
             # Buffer the block count by 1 due to latency issues
             # Using a remote daemon for example will almost always be behind one block.
-            if known_block_count+1 < self.previous_known_block_count:
+            if snapshot.known_block_count_dropped:
                 # The known block count occasionally temporarily drops
                 # If it has dropped, we don't want to show wrong counts in the status bar
                 block_height_string = "<b>Synchronizing...</b>"
+            elif block_count+1 < known_block_count and self.rescan_height is not None:
+                # Wallet is rescanning, show the progress through the rescanned range
+                percent_rescanned = int(float(max(block_count - self.rescan_height, 0)) / max(known_block_count - self.rescan_height, 1) * 100)
+                block_height_string = "<b>Rescanning...</b>{}% [{} / {}] ({})".format(
+                    percent_rescanned, block_count, known_block_count, snapshot.sync_progress.get('description', ''))
+                self.builder.get_object("SendTRTLSubBox").hide()
+                self.builder.get_object("SendTRTLMessageLabel").show()
             elif block_count+1 < known_block_count:
                 # Wallet is synchronizing (block count is catching up to the known block count)
-                block_height_string = "<b>Synchronizing...</b>{}% [{} / {}] ({} days behind)".format(percent_synced, block_count, known_block_count, days_behind)
+                block_height_string = "<b>Synchronizing...</b>{}% [{} / {}] ({} days behind, {})".format(
+                    percent_synced, block_count, known_block_count, days_behind, snapshot.sync_progress.get('description', ''))
                 self.builder.get_object("SendTRTLSubBox").hide()
                 self.builder.get_object("SendTRTLMessageLabel").show()
             elif block_count-1 > known_block_count:
@@ -666,46 +1448,57 @@ class MainWindow(object):
                 # Wallet is synchronized (block count has caught up with the known block count)
                 self.builder.get_object("SendTRTLSubBox").show()
                 self.builder.get_object("SendTRTLMessageLabel").hide()
+            last_updated = self.render_cache.format_time(snapshot.timestamp)
             status_label = "{0} | <b>Transactions</b> {1} | <b>Peer count</b> {2} | <b>Last updated</b> {3}".format(
-                block_height_string, len(self.transactions_list_store), peer_count, datetime.now(tzlocal.get_localzone()).strftime("%H:%M:%S"))
+                block_height_string, len(self.transactions_list_store), peer_count, last_updated)
             self.builder.get_object("MainStatusLabel").set_markup(status_label)
 
             # Logging here for debug purposes. Sloppy Joe..
             main_logger.debug(
                 "REFRESH STATS:" + "\r\n" +
-                "AvailableBalanceAmountLabel: {:,.2f}".format(self.balances['availableBalance']/100.) + "\r\n" +
-                "LockedBalanceAmountLabel: {:,.2f}".format(self.balances['lockedAmount']/100.) + "\r\n" +
-                "Address: " + str(self.addresses[0]) + "\r\n" +
+                "AvailableBalanceAmountLabel: {:,.2f}".format(snapshot.balances['availableBalance']/100.) + "\r\n" +
+                "LockedBalanceAmountLabel: {:,.2f}".format(snapshot.balances['lockedAmount']/100.) + "\r\n" +
+                "Address: " + str(snapshot.addresses[0]) + "\r\n" +
                 "Status: {0} | Transactions {1} | Peer count {2} | Last updated {3}".format(
-                    block_height_string, len(self.transactions_list_store), peer_count, datetime.now(tzlocal.get_localzone()).strftime("%H:%M:%S")))
+                    block_height_string, len(self.transactions_list_store), peer_count, last_updated))
 
-        # Return True so GLib continues to call this method
-        return True
+        # Return False so GLib doesn't call this method again until new data is published
+        return False
 
     def __init__(self):
         # Initialise the GTK builder and load the glade layout from the file
         self.builder = Gtk.Builder()
         self.builder.add_from_file("MainWindow.glade")
+        # The window is created on the GTK thread, the only one that may touch its widgets
+        self.gtk_thread = threading.current_thread()
 
-        # Init. counters needed for watchdog function
-        self.watchdogTimeout = 3
-        self.watchdogMaxTry = 3
-        self.currentTimeout = 0
-        self.currentTry = 0
+        # Initialize wallet data, which is published by the poll thread and rendered on the GTK thread
+        self.wallet_data = WalletSnapshotHolder()
+        self.wallet_data.subscribe(self.on_wallet_data_published)
+        self.rendered_sequence = 0
 
-        # Initialize wallet data
-        self.balances = []
-        self.addresses = []
-        self.status = []
-        self.blocks = []
+        # Track the synchronization rate, carrying on from the splash screen's samples
+        if global_variables.sync_tracker is None:
+            global_variables.sync_tracker = SyncTracker()
 
-        # Initialize current price data
-        self.current_price = []
         # Keep track of the known block count in order to detect if it goes down (it occasionally temporarily drops)
         self.previous_known_block_count = 0
 
         # Get the transaction treeview's backing list store
         self.transactions_list_store = self.builder.get_object("HomeTransactionsListStore")
+        # Cache the formatted values of the transactions shown
+        self.render_cache = TransactionRenderCache()
+        # Index the transactions for the filter bar, and keep the list store row of each one
+        self.transaction_index = TransactionIndex()
+        self.transaction_rows = {}
+        # List store shown instead of the full one while a filter is active
+        self.filtered_list_store = None
+        self.clearing_filter = False
+        # Pending transactions that have left the unconfirmed pool -> snapshot sequence when they left
+        self.pending_left = {}
+        # Block height walletd is rescanning from, None when not rescanning
+        self.rescan_height = None
+        self.rescan_sequence = 0
 
         # Use the methods defined in this class as signal handlers
         self.builder.connect_signals(self)
@@ -892,10 +1685,22 @@ class MainWindow(object):
         self.RPCbuffer = self.builder.get_object("RPCTextView").get_buffer()
         self.RPCScroller = self.builder.get_object("RPCScrolledWindow")
         self.rpc_method_list_store = self.builder.get_object("RPCMethodListStore")
+        self.rpc_call_id = 0
+        self.rpc_pending_text = ""
+        self.rpc_history = self.load_rpc_history()
+        self.rpc_history_position = len(self.rpc_history)
         for method in sorted(self.RPCCommands.keys()):
             self.rpc_method_list_store.append([method])
         self.builder.get_object("RPCMethodComboBox").set_active(0)
 
+        # Reflect whether the wallet daemon is left running on exit
+        self.builder.get_object("DetachedDaemonMenuItem").set_active(global_variables.wallet_config.get_bool('detachedDaemon'))
+        # Started with --profile
+        self.builder.get_object("ProfilerMenuItem").set_active(global_variables.profiler is not None)
+        # Started with --memory
+        self.builder.get_object("MemoryDiagnosticsMenuItem").set_active(global_variables.memory_diagnostics is not None)
+        global_variables.wallet_config.subscribe(self.on_config_changed)
+
         #Set the default fee amount in the FeeEntry widget
         self.builder.get_object("FeeEntry").set_text(str(float(global_variables.static_fee) / float(100)))
 
@@ -906,12 +1711,7 @@ class MainWindow(object):
         self.builder.get_object("MainStatusLabel").set_markup("<b>Loading...</b>")
 
         #If wallet is different than cached config wallet, Prompt if user would like to set default wallet
-        with open(global_variables.wallet_config_file,) as configFile:
-            try:
-                tmpconfig = json.loads(configFile.read())
-                wallet_path = tmpconfig['walletPath']
-            except ValueError:
-                wallet_path = None
+        wallet_path = global_variables.wallet_config.loaded_value('walletPath')
         if global_variables.wallet_connection.wallet_file != wallet_path:
             if self.MainWindow_generic_dialog("Would you like to default to this wallet on start of Turtle Wallet?", "Default Wallet"):
                 global_variables.wallet_config["walletPath"] = global_variables.wallet_connection.wallet_file
@@ -920,21 +1720,69 @@ class MainWindow(object):
             else:
                 global_variables.wallet_config["walletPath"] = ""
 
-        #save config file
-        try:
-            with open(global_variables.wallet_config_file,'w') as cFile:
-                cFile.write(json.dumps(global_variables.wallet_config))
-        except Exception as e:
-            main_logger.warn("Could not save config file: {}".format(e))
+        # Start supervising the wallet daemon, restarting it if it crashes or hangs
+        global_variables.wallet_supervisor = WalletSupervisor(global_variables.wallet_connection,
+                                                              on_give_up=self.on_wallet_daemon_given_up)
+        global_variables.wallet_supervisor.start()
+
+        # Watch the remote node when it was picked automatically, switching node if it falls behind
+        self.node_monitor = None
+        if global_variables.wallet_config.get_bool('autoSelectNode'):
+            self.node_monitor = NodeMonitor(global_variables.wallet_supervisor)
+            self.node_monitor.start()
+
+        # Save the wallet in the background whenever it has changed, so a crash loses little progress
+        self.checkpointer = Checkpointer(global_variables.wallet_connection,
+                                         min_interval=global_variables.wallet_config.get_int('checkpointInterval', 120))
+        self.wallet_data.subscribe(self.checkpointer.on_snapshot)
+        self.checkpointer.start()
+
+        # List sent and incoming transactions as soon as they reach the unconfirmed pool
+        self.pending_tracker = PendingTransactionTracker(global_variables.wallet_connection,
+                                                         lambda: self.wallet_data.current.addresses,
+                                                         self.on_pending_transactions_changed,
+                                                         global_variables.wallet_config.get_float('pendingPollInterval', 2))
+        self.pending_tracker.start()
+
+        # Send transactions on a worker thread, so the window stays responsive while they are built
+        self.send_form_key = SendQueue.new_idempotency_key()
+        self.send_queue = SendQueue.SendQueue(global_variables.wallet_connection,
+                                              SendQueue.get_send_queue_path(global_variables.wallet_connection.wallet_file),
+                                              self.on_send_status_changed)
+        self.send_queue.start()
+
+        # Build scheduled payouts ahead of time, so they are sent the moment they are due
+        self.delayed_pool = DelayedTransactions.DelayedTransactionPool(
+            global_variables.wallet_connection,
+            DelayedTransactions.get_schedule_path(global_variables.wallet_connection.wallet_file),
+            self.is_wallet_quiet, self.on_payout_status_changed,
+            prebuild_lead=global_variables.wallet_config.get_int('payoutPrebuildLead', DelayedTransactions.PREBUILD_LEAD))
+        self.delayed_pool.start()
+
+        # Show in the status bar when requests are failing fast because walletd is unreachable
+        global_variables.wallet_connection.breaker.subscribe(self.on_breaker_state_changed)
+
+        # Log which handlers freeze the window, and for how long
+        self.stall_detector = StallDetector(global_variables.wallet_config.get_float('stallThreshold', 0.5))
+        self.stall_detector.start()
 
         # Start the wallet data request loop in a new thread
         self._stop_update_thread = threading.Event()
-        self.update_thread = threading.Thread(target=self.request_wallet_data_loop)
+        self.update_thread = threading.Thread(target=self.request_wallet_data_loop, name="WalletDataPoll")
         self.update_thread.daemon = True
         self.update_thread.start()
 
-        # Register a function via Glib that gets called every 5 seconds to refresh the UI
-        GLib.timeout_add_seconds(5, self.refresh_ui)
+        # Stop everything that talks to the daemon before the daemon itself is stopped
+        shutdown_coordinator = global_variables.shutdown_coordinator
+        shutdown_coordinator.add_service("wallet supervisor", global_variables.wallet_supervisor.stop)
+        if self.node_monitor:
+            shutdown_coordinator.add_service("node monitor", self.node_monitor.stop)
+        shutdown_coordinator.add_service("checkpointer", self.checkpointer.stop)
+        shutdown_coordinator.add_service("pending transactions", self.pending_tracker.stop)
+        shutdown_coordinator.add_service("send queue", self.send_queue.stop)
+        shutdown_coordinator.add_service("delayed transactions", self.delayed_pool.stop)
+        shutdown_coordinator.add_service("update thread", self.stop_update_thread)
+        shutdown_coordinator.add_service("stall detector", self.stall_detector.stop)
 
         #These tabs should not be shown, even on show all
         noteBook = self.builder.get_object("MainNotebook")
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+""" MemoryDiagnostics.py
+
+This file represents the memory diagnostics mode, for finding out why
+the memory used by a long-running wallet grows. Allocations are traced
+with tracemalloc, and snapshots are taken periodically and on request.
+Each snapshot is written next to trtl.log with the process's resident
+memory, the sizes of the wallet's main structures, the top allocation
+sites, and how both have grown since the previous and the first
+snapshot. tracemalloc needs Python 3.4 or newer; on older versions only
+the resident memory and the structure sizes are reported.
+"""
+
+import linecache
+import logging
+import os
+import threading
+import time
+
+import psutil
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import Metrics
+
+# Get Logger made in start.py
+memory_logger = logging.getLogger('trtl_log.memory')
+
+# Seconds between periodic snapshots
+SNAPSHOT_INTERVAL = 30 * 60
+# Frames of traceback kept per allocation, more makes the report more precise and tracing slower
+TRACE_FRAMES = 10
+# Number of allocation sites in each table of the report
+REPORT_ROWS = 25
+
+# Files whose allocations are of no interest, besides tracemalloc's own
+IGNORED_FILES = ('<frozen importlib._bootstrap>', '<frozen importlib._bootstrap_external>', '<unknown>')
+
+
+def format_size(size):
+    """
+    :return: a signed byte count in KiB or MiB, such as '+1.5 MiB'
+    """
+    if abs(size) >= 1024 * 1024:
+        return "{:+.1f} MiB".format(size / (1024.0 * 1024))
+    return "{:+.1f} KiB".format(size / 1024.0)
+
+
+class MemoryDiagnostics(object):
+    """
+    This class traces allocations and writes snapshots of the memory used, and its growth, to a report file
+    """
+    def __init__(self, directory, get_counts=None, interval=SNAPSHOT_INTERVAL, frames=TRACE_FRAMES):
+        """
+        :param directory: directory the report is written to
+        :param get_counts: callable returning a dict of structure name -> number of items, such as blocks or
+            log lines, reported with every snapshot. It is called on whichever thread takes the snapshot.
+        :param interval: seconds between periodic snapshots, 0 to only take them on request
+        :param frames: frames of traceback kept per allocation
+        """
+        self.path = os.path.join(directory, time.strftime("trtl-memory-%Y%m%d-%H%M%S.txt"))
+        self.get_counts = get_counts
+        self.interval = interval
+        self.frames = frames
+
+        self.snapshot_count = 0
+        self._first = None  # (allocation sites, rss, counts) of the first snapshot
+        self._previous = None  # and of the previous one
+        self._started_tracing = False
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def tracing(self):
+        return tracemalloc is not None and tracemalloc.is_tracing()
+
+    def start(self):
+        """Starts tracing allocations, and taking snapshots periodically on a background thread"""
+        if tracemalloc is None:
+            memory_logger.warning("tracemalloc needs Python 3.4 or newer, only memory totals will be reported")
+        elif not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.snapshot_loop, name="MemoryDiagnostics")
+        self._thread.daemon = True
+        self._thread.start()
+        memory_logger.info("Memory diagnostics on, snapshots are written to {}".format(self.path))
+
+    def stop(self, timeout=None):
+        """
+        Takes a last snapshot and stops tracing allocations
+        :return: path of the report
+        """
+        self._stop_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self.take_snapshot("final")
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return self.path
+
+    def snapshot_loop(self):
+        """Takes a snapshot every interval seconds, until stopped"""
+        while not self._stop_event.wait(self.interval or None):
+            self.take_snapshot("periodic")
+
+    def get_rss(self):
+        """
+        :return: resident memory of the process in bytes
+        """
+        return psutil.Process(os.getpid()).memory_info().rss
+
+    def take_snapshot(self, label="on request"):
+        """
+        Takes a snapshot and appends it, compared with the previous and the first one, to the report.
+        This takes a few seconds on a large wallet, so shouldn't be called on the GTK thread.
+        :param label: why the snapshot was taken, for the report
+        :return: path of the report
+        """
+        start_time = time.time()
+        with self._lock:
+            sites = None
+            traced = 0
+            if self.tracing:
+                sites = self.get_allocation_sites()
+                traced = tracemalloc.get_traced_memory()[0]
+            counts = {}
+            if self.get_counts:
+                try:
+                    counts = self.get_counts()
+                except Exception as e:
+                    memory_logger.error("Failed to count the wallet's structures: {}".format(e))
+            current = (sites, self.get_rss(), counts)
+            self.snapshot_count += 1
+            lines = self.format_snapshot(label, current, traced, self._previous, self._first)
+            # The source lines read for the report would otherwise show up as growth in the next one
+            linecache.clearcache()
+            if self._first is None:
+                self._first = current
+            self._previous = current
+        try:
+            with open(self.path, 'a') as mFile:
+                mFile.write("\n".join(lines) + "\n\n")
+        except (IOError, OSError) as e:
+            memory_logger.error("Failed to write the memory report: {}".format(e))
+        Metrics.record('memory.rss_bytes', current[1])
+        Metrics.record('memory.snapshot_seconds', time.time() - start_time)
+        memory_logger.info(lines[1])
+        return self.path
+
+    def get_allocation_sites(self):
+        """
+        Takes a tracemalloc snapshot and totals it per source line. Only the totals are kept between
+        snapshots, which is much smaller than the snapshot and, unlike comparing snapshots, quick to diff
+        while tracing is still on.
+        :return: dict of (file name, line number) -> (bytes, blocks) allocated there
+        """
+        sites = {}
+        for stat in tracemalloc.take_snapshot().statistics('lineno'):
+            frame = stat.traceback[0]
+            if frame.filename == tracemalloc.__file__ or frame.filename in IGNORED_FILES:
+                continue
+            sites[(frame.filename, frame.lineno)] = (stat.size, stat.count)
+        return sites
+
+    def format_snapshot(self, label, current, traced, previous, first):
+        """
+        :return: list of report lines for a snapshot, compared with the previous and the first snapshot
+        """
+        sites, rss, counts = current
+        lines = ["Snapshot {} ({}) at {}".format(self.snapshot_count, label, time.strftime("%Y-%m-%d %H:%M:%S"))]
+
+        summary = "RSS {:.1f} MiB".format(rss / (1024.0 * 1024))
+        if first is not None:
+            summary += ", {} since the first snapshot, {} since the previous one".format(
+                format_size(rss - first[1]), format_size(rss - previous[1]))
+        if sites is not None:
+            summary += " | Traced {:.1f} MiB".format(traced / (1024.0 * 1024))
+        lines.append(summary)
+
+        if counts:
+            lines.append("Structures:")
+            for name, count in sorted(counts.items()):
+                line = "  {:<28} {:>10,}".format(name, count)
+                if first is not None and name in first[2]:
+                    line += "  {:+,} since the first snapshot, {:+,} since the previous one".format(
+                        count - first[2][name], count - previous[2].get(name, count))
+                lines.append(line)
+
+        if sites is None:
+            return lines
+        lines.append("Top allocation sites:")
+        for site, (size, count) in sorted(sites.items(), key=lambda item: -item[1][0])[:REPORT_ROWS]:
+            lines.append(self.format_site(site, size, count))
+        for title, other in (("previous", previous), ("first", first)):
+            if other is None or other[0] is None or (title == "first" and other is previous):
+                continue
+            lines.append("Growth since the {} snapshot:".format(title))
+            growth = []
+            for site, (size, count) in sites.items():
+                old_size, old_count = other[0].get(site, (0, 0))
+                if size > old_size:
+                    growth.append((size - old_size, count - old_count, site))
+            for size, count, site in sorted(growth, reverse=True)[:REPORT_ROWS]:
+                lines.append(self.format_site(site, size, count, signed=True))
+        return lines
+
+    def format_site(self, site, size, count, signed=False):
+        """
+        :return: a report line for an allocation site, with the source line allocating
+        """
+        file_name, line_number = site
+        source = linecache.getline(file_name, line_number).strip()
+        if signed:
+            return "  {:>12} {:>+10,} blocks  {}:{}  {}".format(format_size(size), count, file_name, line_number, source)
+        return "  {:>12} {:>10,} blocks  {}:{}  {}".format(format_size(size).lstrip('+'), count, file_name,
+                                                          line_number, source)
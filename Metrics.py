@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+""" Metrics.py
+
+A small in-process registry for runtime metrics (timings, counters, gauges)
+so subsystems can report how they are performing. Every recorded value
+is also written to the log at DEBUG level.
+"""
+
+import threading
+import logging
+
+# Get Logger made in start.py
+metrics_logger = logging.getLogger('trtl_log.metrics')
+
+_lock = threading.Lock()
+_metrics = {}
+
+
+def record(name, value):
+    """
+    Records a sample for a metric, keeping the last, minimum, maximum, count and total
+    :param name: dotted metric name, e.g. 'walletd.recovery_seconds'
+    :param value: numeric sample
+    """
+    with _lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = {'last': value, 'min': value, 'max': value, 'count': 0, 'total': 0}
+        metric['last'] = value
+        metric['min'] = min(metric['min'], value)
+        metric['max'] = max(metric['max'], value)
+        metric['count'] += 1
+        metric['total'] += value
+    metrics_logger.debug("{}={}".format(name, value))
+
+
+def increment(name, amount=1):
+    """Increments a counter metric"""
+    with _lock:
+        metric = _metrics.setdefault(name, {'last': 0, 'min': 0, 'max': 0, 'count': 0, 'total': 0})
+        metric['count'] += amount
+        metric['total'] += amount
+        metric['last'] = metric['max'] = metric['total']
+
+
+def snapshot():
+    """
+    :return: a copy of every metric, keyed by name
+    """
+    with _lock:
+        return dict((name, dict(metric)) for name, metric in _metrics.items())
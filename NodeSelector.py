@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+""" NodeSelector.py
+
+This file represents the logic for choosing which remote node walletd
+syncs from. Candidate nodes are probed concurrently for latency and
+height, the best one is used at startup, and the current node is
+monitored so the wallet can fail over to the next best one.
+"""
+
+import threading
+import time
+import logging
+import requests
+from requests.exceptions import RequestException
+import global_variables
+import Metrics
+
+# Get Logger made in start.py
+node_logger = logging.getLogger('trtl_log.node')
+
+# Thanks to iburnmycd for providing a public daemon service!
+DEFAULT_NODE = "public.turtlenode.io:11898"
+
+
+def get_node_candidates():
+    """
+    :return: the candidate nodes from the config as 'host:port' strings, including the configured remote node
+    """
+    candidates = global_variables.wallet_config.get_list('remoteDaemonCandidates', [DEFAULT_NODE])
+    remote_daemon_address = global_variables.wallet_config.get('remoteDaemonAddress', None)
+    remote_daemon_port = global_variables.wallet_config.get('remoteDaemonPort', None)
+    if remote_daemon_address and remote_daemon_port:
+        current = "{}:{}".format(remote_daemon_address, remote_daemon_port)
+        if current not in candidates:
+            candidates.append(current)
+    return candidates
+
+
+def get_current_node():
+    """
+    :return: the remote node walletd is configured to use as 'host:port', or None when using a local node
+    """
+    remote_daemon_address = global_variables.wallet_config.get('remoteDaemonAddress', None)
+    remote_daemon_port = global_variables.wallet_config.get('remoteDaemonPort', None)
+    if not global_variables.wallet_config.get_bool('remoteDaemon') or not remote_daemon_address:
+        return None
+    return "{}:{}".format(remote_daemon_address, remote_daemon_port)
+
+
+def use_node(node):
+    """Configures walletd to use the given 'host:port' node the next time it is started"""
+    remote_daemon_address, remote_daemon_port = node.rsplit(':', 1)
+    global_variables.wallet_config['remoteDaemon'] = True
+    global_variables.wallet_config['remoteDaemonAddress'] = remote_daemon_address
+    global_variables.wallet_config['remoteDaemonPort'] = remote_daemon_port
+
+
+def merge_rankings(results):
+    """
+    Saves new probe results to the cached rankings in the config. Nodes that weren't probed this time,
+    such as the current node when failing over from it, keep their earlier results after the new ones.
+    :param results: ranked list of probe results
+    """
+    probed = set(r['node'] for r in results)
+    previous = [r for r in global_variables.wallet_config.get_list('nodeRankings') if r.get('node') not in probed]
+    global_variables.wallet_config['nodeRankings'] = list(results) + previous
+
+
+class NodeSelector(object):
+    """
+    This class probes candidate nodes and ranks them
+    """
+    def __init__(self, candidates, timeout=3, max_lag=2):
+        """
+        :param candidates: list of 'host:port' nodes
+        :param timeout: seconds to wait for a node to answer a probe
+        :param max_lag: blocks a node may be behind the highest candidate before it is considered stale
+        """
+        self.candidates = candidates
+        self.timeout = timeout
+        self.max_lag = max_lag
+
+    def probe(self, node):
+        """
+        Asks a node for its height, timing how long it takes to answer
+        :return: dict describing the node's latency and height
+        """
+        url = node if "://" in node else "http://" + node
+        result = {'node': node, 'reachable': False, 'latency': None, 'height': 0, 'checked': time.time()}
+        start_time = time.time()
+        try:
+            response = requests.get(url.rstrip('/') + "/getinfo", timeout=self.timeout)
+            response.raise_for_status()
+            info = response.json()
+            result['latency'] = time.time() - start_time
+            result['height'] = info['height']
+            result['reachable'] = True
+        except (RequestException, ValueError, KeyError) as e:
+            node_logger.debug("Node {} failed to answer: {}".format(node, e))
+        return result
+
+    def probe_all(self):
+        """
+        Probes every candidate at the same time
+        :return: list of probe results, best node first
+        """
+        results = []
+        threads = []
+        for node in self.candidates:
+            thread = threading.Thread(target=lambda n=node: results.append(self.probe(n)))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join(self.timeout + 1)
+        return self.rank(list(results))
+
+    def rank(self, results):
+        """
+        Orders probe results: reachable nodes that are up to date first, each group by latency
+        :return: sorted list of probe results
+        """
+        best_height = max([r['height'] for r in results if r['reachable']] or [0])
+
+        def sort_key(result):
+            if not result['reachable']:
+                return (2, 0)
+            stale = best_height - result['height'] > self.max_lag
+            return (1 if stale else 0, result['latency'])
+        return sorted(results, key=sort_key)
+
+    def select_best(self):
+        """
+        Probes the candidates and picks the best node, falling back to the rankings cached
+        by a previous run if none of them answer. The new rankings are saved to the config.
+        :return: the best 'host:port' node, or None if there is no usable node
+        """
+        rankings = self.probe_all()
+        for result in rankings:
+            if result['reachable']:
+                node_logger.info("Node {} answered in {:.0f}ms at height {}".format(
+                    result['node'], result['latency'] * 1000, result['height']))
+            else:
+                node_logger.info("Node {} did not answer".format(result['node']))
+
+        reachable = [r for r in rankings if r['reachable']]
+        if reachable:
+            merge_rankings(rankings)
+            Metrics.record('node.latency_seconds', reachable[0]['latency'])
+            return reachable[0]['node']
+
+        cached = [r['node'] for r in global_variables.wallet_config.get_list('nodeRankings')
+                  if r['reachable'] and r['node'] in self.candidates]
+        if cached:
+            node_logger.warning("No node answered, using {} from the cached rankings".format(cached[0]))
+            return cached[0]
+        return None
+
+
+class NodeMonitor(object):
+    """
+    This class watches the node walletd is using and switches to the next best node
+    when it falls behind the network or stops answering
+    """
+    def __init__(self, wallet_supervisor, check_interval=30, max_failures=3, max_lag=5):
+        """
+        :param wallet_supervisor: the WalletSupervisor used to restart walletd on the new node
+        :param check_interval: seconds between checks of the current node
+        :param max_failures: consecutive failed checks before switching node
+        :param max_lag: blocks the node may be behind the highest other candidate before switching node
+        """
+        self.wallet_supervisor = wallet_supervisor
+        self.check_interval = check_interval
+        self.max_failures = max_failures
+        self.max_lag = max_lag
+        self.failures = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts monitoring on a background thread"""
+        self._thread = threading.Thread(target=self.monitor_loop, name="NodeMonitor")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stops monitoring, waiting up to timeout seconds for a check in progress to finish"""
+        self._stop_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def monitor_loop(self):
+        """Checks the current node every check_interval seconds until stopped"""
+        while not self._stop_event.wait(self.check_interval):
+            try:
+                self.check_node()
+            except Exception as e:
+                node_logger.error("Node check failed: {}".format(e))
+
+    def check_node(self):
+        """
+        Checks the current node, switching to another one once it has failed too many checks.
+        walletd's known block count comes from the node itself, so the node's height is compared
+        with the highest of the other candidates, probed alongside it.
+        """
+        node = get_current_node()
+        if not node:
+            return
+        candidates = get_node_candidates()
+        if node not in candidates:
+            candidates.append(node)
+        results = NodeSelector(candidates).probe_all()
+        result = next((r for r in results if r['node'] == node), None)
+        best_height = max([r['height'] for r in results if r['reachable'] and r['node'] != node] or [0])
+        if result is None or not result['reachable']:
+            self.failures += 1
+            node_logger.warning("Node {} is not answering ({}/{})".format(node, self.failures, self.max_failures))
+        elif best_height - result['height'] > self.max_lag:
+            self.failures += 1
+            node_logger.warning("Node {} is at height {}, behind another node at {} ({}/{})".format(
+                node, result['height'], best_height, self.failures, self.max_failures))
+        else:
+            self.failures = 0
+            Metrics.record('node.latency_seconds', result['latency'])
+            return
+
+        if self.failures >= self.max_failures:
+            self.failures = 0
+            self.fail_over(node)
+
+    def fail_over(self, current_node):
+        """Switches walletd to the best node other than the current one"""
+        candidates = [n for n in get_node_candidates() if n != current_node]
+        new_node = NodeSelector(candidates).select_best() if candidates else None
+        if not new_node:
+            node_logger.error("No other node available to replace {}".format(current_node))
+            return
+        node_logger.warning("Switching from node {} to {}".format(current_node, new_node))
+        use_node(new_node)
+        Metrics.increment('node.failovers')
+        self.wallet_supervisor.restart("switching to node {}".format(new_node))
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+""" PendingTransactions.py
+
+This file represents the tracking of the wallet's transactions that are
+waiting in the unconfirmed pool. walletd only lists a transaction in
+getTransactions once it has been mined, so sent and incoming
+transactions are picked up from getUnconfirmedTransactionHashes instead,
+which is cheap to poll. Only transactions not seen before are fetched,
+and a transaction leaving the pool is reported so it can be shown as
+mined or dropped.
+"""
+
+import threading
+import time
+import logging
+from requests.exceptions import RequestException
+from ConnectionManager import BACKGROUND
+import Metrics
+
+# Get Logger made in start.py
+pending_logger = logging.getLogger('trtl_log.pending')
+
+
+class PendingTransactionTracker(object):
+    """
+    This class polls walletd's unconfirmed pool for the wallet's addresses on a background thread
+    """
+    def __init__(self, wallet_connection, get_addresses, on_change, poll_interval=2):
+        """
+        :param wallet_connection: the WalletConnection to poll
+        :param get_addresses: callable returning the wallet's addresses
+        :param on_change: called on the polling thread with (dict of hash -> pending transaction,
+            list of hashes that have left the pool) whenever the pool changes
+        :param poll_interval: seconds between polls
+        """
+        self.wallet_connection = wallet_connection
+        self.get_addresses = get_addresses
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+
+        # hash -> transaction, replaced rather than changed so it can be read from any thread
+        self.transactions = {}
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts polling on a background thread"""
+        self._thread = threading.Thread(target=self.poll_loop, name="PendingTransactions")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stops polling, waiting up to timeout seconds for a poll in progress to finish"""
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def poke(self):
+        """Polls straight away, e.g. after a transaction has been sent"""
+        self._wake_event.set()
+
+    def poll_loop(self):
+        """Polls every poll_interval seconds, or when poked, until stopped"""
+        while not self._stop_event.is_set():
+            try:
+                self.poll()
+            except (RequestException, ValueError) as e:
+                pending_logger.debug("Failed to poll the unconfirmed transactions: {}".format(e))
+            self._wake_event.wait(self.poll_interval)
+            self._wake_event.clear()
+
+    def poll(self):
+        """
+        Checks the unconfirmed pool, fetching any transactions not seen before
+        :return: tuple of (dict of hash -> pending transaction, list of hashes that have left the pool)
+        """
+        addresses = self.get_addresses()
+        if not addresses:
+            return self.transactions, []
+        start_time = time.time()
+        hashes = self.wallet_connection.request("getUnconfirmedTransactionHashes",
+                                                params={"addresses": addresses},
+                                                priority=BACKGROUND)['transactionHashes']
+
+        transactions = {}
+        for transaction_hash in hashes:
+            transaction = self.transactions.get(transaction_hash)
+            if transaction is None:
+                try:
+                    transaction = dict(self.wallet_connection.request(
+                        "getTransaction", params={"transactionHash": transaction_hash}, priority=BACKGROUND)['transaction'])
+                except ValueError as e:
+                    # It may have been mined or dropped since the hashes were listed
+                    pending_logger.debug("Failed to fetch pending transaction {}: {}".format(transaction_hash, e))
+                    continue
+                if not transaction['timestamp']:
+                    # walletd doesn't time unconfirmed transactions, show when it was first seen instead
+                    transaction['timestamp'] = int(time.time())
+                pending_logger.info("Transaction {} is pending, amount {}".format(transaction_hash, transaction['amount']))
+            transactions[transaction_hash] = transaction
+        left = [transaction_hash for transaction_hash in self.transactions if transaction_hash not in transactions]
+        changed = left or any(transaction_hash not in self.transactions for transaction_hash in transactions)
+
+        self.transactions = transactions
+        Metrics.record('pending.poll_seconds', time.time() - start_time)
+        if changed:
+            Metrics.record('pending.transactions', len(transactions))
+            self.on_change(transactions, left)
+        return transactions, left
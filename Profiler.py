@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+""" Profiler.py
+
+This file represents the built-in CPU profiler, for collecting evidence
+of where the running wallet spends its time without attaching external
+tools. A background thread samples the Python stack of every thread,
+the GTK main thread and the wallet data poll thread included, at a
+fixed interval, which costs little enough to leave running for a whole
+session. The samples are written out periodically and when profiling
+stops as a report of the hottest functions and call edges, and as a
+collapsed-stack file that flame graph tools read. Optionally the thread
+that starts the profiler, normally the GTK main thread, is also traced
+with cProfile for exact call counts, at a higher cost.
+"""
+
+import cProfile
+from collections import defaultdict
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+
+# Get Logger made in start.py
+profiler_logger = logging.getLogger('trtl_log.profiler')
+
+# Profiling modes
+SAMPLE = 'sample'
+CPROFILE = 'cprofile'
+PROFILE_MODES = (SAMPLE, CPROFILE)
+# Seconds between stack samples
+SAMPLE_INTERVAL = 0.01
+# Seconds between reports written while profiling
+REPORT_INTERVAL = 300
+# Number of rows in each table of the report
+REPORT_ROWS = 30
+
+
+def get_log_directory():
+    """
+    :return: the directory trtl.log is written to, where reports are written alongside it
+    """
+    for handler in logging.getLogger('trtl_log').handlers:
+        if isinstance(handler, logging.FileHandler):
+            return os.path.dirname(os.path.abspath(handler.baseFilename))
+    return os.getcwd()
+
+
+def frame_key(frame):
+    """
+    :return: (file name, function name) identifying the function a frame is running
+    """
+    code = frame.f_code
+    return os.path.basename(code.co_filename), code.co_name
+
+
+class Profiler(object):
+    """
+    This class samples the stacks of the wallet's threads on a background thread and writes reports of them.
+    Each thread's samples are kept apart, so the GTK main thread and the poll thread can be told apart.
+    """
+    def __init__(self, directory, mode=SAMPLE, sample_interval=SAMPLE_INTERVAL, report_interval=REPORT_INTERVAL):
+        """
+        :param directory: directory reports are written to
+        :param mode: SAMPLE, or CPROFILE to also trace the thread calling start with cProfile
+        :param sample_interval: seconds between stack samples
+        :param report_interval: seconds between reports written while profiling, 0 to only write one when stopped
+        """
+        self.mode = mode
+        self.sample_interval = sample_interval
+        self.report_interval = report_interval
+        self.base_path = os.path.join(directory, time.strftime("trtl-profile-%Y%m%d-%H%M%S"))
+
+        self.stacks = defaultdict(int)  # (thread name, frame keys outermost first) -> samples
+        self.sample_count = 0
+        self.started_at = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._cprofile = None
+        self._cprofile_thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Starts sampling on a background thread, and tracing the calling thread with cProfile if asked to"""
+        self.started_at = time.time()
+        if self.mode == CPROFILE:
+            self._cprofile = cProfile.Profile()
+            self._cprofile_thread = threading.current_thread()
+            self._cprofile.enable()
+        self._thread = threading.Thread(target=self.sample_loop, name="Profiler")
+        self._thread.daemon = True
+        self._thread.start()
+        profiler_logger.info("Profiling every {}ms, reports are written to {}.*".format(
+            int(self.sample_interval * 1000), self.base_path))
+
+    def stop(self, timeout=None):
+        """
+        Stops profiling and writes the final report. cProfile tracing can only be stopped by the thread
+        that started it, so stop should be called from that thread.
+        :return: list of the report files written
+        """
+        self._stop_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        if self._cprofile is not None and self._cprofile_thread is threading.current_thread():
+            self._cprofile.disable()
+        return self.write_reports()
+
+    def sample_loop(self):
+        """Samples the stacks every sample_interval seconds and writes a report every report_interval, until stopped"""
+        last_report = time.time()
+        while not self._stop_event.wait(self.sample_interval):
+            self.sample()
+            if self.report_interval and time.time() - last_report >= self.report_interval:
+                self.write_reports()
+                last_report = time.time()
+
+    def sample(self):
+        """Records the current stack of every thread but the profiler's own"""
+        names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+        own_ident = threading.current_thread().ident
+        frames = sys._current_frames()
+        with self._lock:
+            for ident, frame in frames.items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_key(frame))
+                    frame = frame.f_back
+                stack.reverse()
+                self.stacks[(names.get(ident, str(ident)), tuple(stack))] += 1
+            self.sample_count += 1
+
+    def write_reports(self):
+        """
+        Writes the report, the collapsed stacks and, when tracing with cProfile, its stats,
+        replacing those written earlier in the session
+        :return: list of the files written
+        """
+        with self._lock:
+            stacks = dict(self.stacks)
+            sample_count = self.sample_count
+        paths = []
+        try:
+            paths.append(self.write_collapsed(self.base_path + ".collapsed", stacks))
+            paths.append(self.write_summary(self.base_path + ".txt", stacks, sample_count))
+            if self._cprofile is not None and not self.running:
+                paths.append(self.write_cprofile(self.base_path + ".pstats"))
+        except (IOError, OSError) as e:
+            profiler_logger.error("Failed to write the profile: {}".format(e))
+        return paths
+
+    def write_collapsed(self, path, stacks):
+        """
+        Writes the samples in the collapsed-stack format read by flame graph tools,
+        one 'thread;outermost;...;innermost count' line per distinct stack
+        """
+        with open(path, 'w') as pFile:
+            for (thread_name, stack), count in sorted(stacks.items()):
+                frames = [thread_name] + ["{}:{}".format(file_name, function) for file_name, function in stack]
+                pFile.write("{} {}\n".format(";".join(frame.replace(" ", "_") for frame in frames), count))
+        return path
+
+    def write_summary(self, path, stacks, sample_count):
+        """
+        Writes the hottest functions of each thread, by samples spent in the function itself and in it
+        or anything it called, and the hottest caller -> callee edges
+        """
+        threads = defaultdict(lambda: {'samples': 0, 'self': defaultdict(int), 'total': defaultdict(int),
+                                       'edges': defaultdict(int)})
+        for (thread_name, stack), count in stacks.items():
+            thread = threads[thread_name]
+            thread['samples'] += count
+            if stack:
+                thread['self'][stack[-1]] += count
+            # A recursive function counts once per sample
+            for function in set(stack):
+                thread['total'][function] += count
+            for edge in set(zip(stack, stack[1:])):
+                thread['edges'][edge] += count
+
+        def function_name(function):
+            return "{1} ({0})".format(*function)
+
+        lines = ["Profile of {} samples taken every {}ms over {:.0f}s".format(
+            sample_count, int(self.sample_interval * 1000), time.time() - (self.started_at or time.time()))]
+        for thread_name, thread in sorted(threads.items(), key=lambda item: -item[1]['samples']):
+            lines.append("")
+            lines.append("Thread {} ({} samples)".format(thread_name, thread['samples']))
+            for title, table in (("Self", thread['self']), ("Total", thread['total'])):
+                lines.append("  {:>7} {:>6}  function".format(title, "%"))
+                for function, count in sorted(table.items(), key=lambda item: -item[1])[:REPORT_ROWS]:
+                    lines.append("  {:>7} {:>6.1f}  {}".format(count, 100.0 * count / thread['samples'],
+                                                             function_name(function)))
+            lines.append("  {:>7} {:>6}  caller -> callee".format("Calls", "%"))
+            for (caller, callee), count in sorted(thread['edges'].items(), key=lambda item: -item[1])[:REPORT_ROWS]:
+                lines.append("  {:>7} {:>6.1f}  {} -> {}".format(count, 100.0 * count / thread['samples'],
+                                                              function_name(caller), function_name(callee)))
+        with open(path, 'w') as pFile:
+            pFile.write("\n".join(lines) + "\n")
+        return path
+
+    def write_cprofile(self, path):
+        """Writes the cProfile stats, readable with pstats, with a text report of the callers alongside"""
+        self._cprofile.dump_stats(path)
+        with open(path + ".txt", 'w') as pFile:
+            stats = pstats.Stats(path, stream=pFile)
+            stats.sort_stats('cumulative').print_stats(REPORT_ROWS)
+            stats.print_callers(REPORT_ROWS)
+        return path
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+""" RenderCache.py
+
+This file represents the caching of formatted transaction values for
+display. The local timezone is resolved once and only looked up again
+when it appears to have changed, and the formatted direction, amount
+and date of each transaction are remembered in a bounded LRU cache.
+"""
+
+from collections import OrderedDict
+from datetime import datetime
+import logging
+import os
+import threading
+import time
+import tzlocal
+
+# Get Logger made in start.py
+render_logger = logging.getLogger('trtl_log.render')
+
+# Number of transactions whose formatted values are remembered
+RENDER_CACHE_SIZE = 200000
+# Seconds between checks for a change of the local timezone
+ZONE_CHECK_INTERVAL = 60
+# File the local timezone is read from on most unix systems
+LOCALTIME_FILE = '/etc/localtime'
+
+DATE_FORMAT = "%Y/%m/%d %H:%M:%S%z (%Z)"
+
+
+class LocalZone(object):
+    """
+    This class resolves the local timezone once and re-resolves it only when the
+    TZ environment variable, the C library's idea of the zone, or /etc/localtime changes
+    """
+    def __init__(self, check_interval=ZONE_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.zone = None
+        self.generation = 0
+        self._fingerprint = None
+        self._last_check = 0
+        self._lock = threading.Lock()
+
+    def _get_fingerprint(self):
+        try:
+            localtime = os.path.realpath(LOCALTIME_FILE), os.stat(LOCALTIME_FILE).st_mtime
+        except OSError:
+            localtime = None
+        return os.environ.get('TZ'), time.timezone, time.altzone, localtime
+
+    def get(self):
+        """
+        :return: the local timezone, as returned by tzlocal
+        """
+        now = time.time()
+        if self.zone is not None and now - self._last_check < self.check_interval:
+            return self.zone
+        with self._lock:
+            self._last_check = now
+            fingerprint = self._get_fingerprint()
+            if self.zone is None or fingerprint != self._fingerprint:
+                if self.zone is not None:
+                    render_logger.info("Local timezone has changed, reloading it")
+                    if hasattr(tzlocal, 'reload_localzone'):
+                        tzlocal.reload_localzone()
+                    self.generation += 1
+                self._fingerprint = fingerprint
+                self.zone = tzlocal.get_localzone()
+        return self.zone
+
+
+# The local zone shared by everything that displays times
+local_zone = LocalZone()
+
+
+class TransactionRenderCache(object):
+    """
+    This class formats transactions for the transactions view and details dialog,
+    remembering the results per transaction hash in a bounded LRU cache
+    """
+    def __init__(self, max_entries=RENDER_CACHE_SIZE, zone=None):
+        """
+        :param max_entries: number of transactions whose formatted values are remembered
+        :param zone: LocalZone to format dates in, defaults to the shared one
+        """
+        self.max_entries = max_entries
+        self.zone = zone or local_zone
+        self._cache = OrderedDict()
+        self._zone_generation = None
+        # UTC day -> (UTC offset in seconds, offset and zone name text), for days without an offset change
+        self._day_offsets = {}
+        # Local day -> formatted date
+        self._local_dates = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _check_zone(self):
+        """Forgets everything formatted for a previous timezone"""
+        tz = self.zone.get()
+        if self.zone.generation != self._zone_generation:
+            self._zone_generation = self.zone.generation
+            self._cache.clear()
+            self._day_offsets.clear()
+            self._local_dates.clear()
+        return tz
+
+    def _day_offset(self, timestamp, tz):
+        """
+        :return: tuple of (UTC offset in seconds, ' +HHMM (ZONE)' suffix) for the day containing timestamp,
+            or None if the offset changes during that day
+        """
+        day = timestamp // 86400
+        if day not in self._day_offsets:
+            start = datetime.fromtimestamp(day * 86400, tz)
+            end = datetime.fromtimestamp(day * 86400 + 86399, tz)
+            if start.utcoffset() != end.utcoffset():
+                self._day_offsets[day] = None
+            else:
+                offset = start.utcoffset()
+                self._day_offsets[day] = (offset.days * 86400 + offset.seconds, start.strftime("%z (%Z)"))
+        return self._day_offsets[day]
+
+    def _format_date(self, timestamp, tz):
+        offset = self._day_offset(timestamp, tz)
+        if offset is None:
+            # The clocks change on this day, let datetime work it out
+            return datetime.fromtimestamp(timestamp, tz).strftime(DATE_FORMAT)
+        local_time = timestamp + offset[0]
+        local_day = local_time // 86400
+        date_text = self._local_dates.get(local_day)
+        if date_text is None:
+            date_text = self._local_dates[local_day] = time.strftime("%Y/%m/%d ", time.gmtime(local_day * 86400))
+        seconds = local_time % 86400
+        return "%s%02d:%02d:%02d%s" % (date_text, seconds // 3600, seconds // 60 % 60, seconds % 60, offset[1])
+
+    def format_date(self, timestamp):
+        """
+        :return: timestamp formatted as a date and time in the local timezone
+        """
+        return self._format_date(int(timestamp), self._check_zone())
+
+    def format_time(self, timestamp):
+        """
+        :return: timestamp formatted as a time of day in the local timezone
+        """
+        return self.format_date(timestamp)[11:19]
+
+    def _render(self, transaction, tz):
+        transaction_hash = transaction['transactionHash']
+        rendered = self._cache.pop(transaction_hash, None)
+        if rendered is None:
+            self.misses += 1
+            amount = transaction['amount']
+            rendered = (
+                # Determine the direction of the transfer (In/Out)
+                "In" if amount > 0 else "Out",
+                # Format the amount as comma seperated with 2 decimal points
+                "{:,.2f}".format(amount/100.),
+                # Format the transaction time for the user's local timezone
+                self._format_date(transaction['timestamp'], tz)
+            )
+            if len(self._cache) >= self.max_entries:
+                self._cache.popitem(last=False)
+        else:
+            self.hits += 1
+        # Re-inserting moves the entry to the most recently used end
+        self._cache[transaction_hash] = rendered
+        return rendered
+
+    def render(self, transaction):
+        """
+        :param transaction: a transaction from getTransactions
+        :return: tuple of the formatted (direction, amount, date)
+        """
+        return self._render(transaction, self._check_zone())
+
+    def render_many(self, transactions):
+        """
+        Formats a batch of transactions in one pass, e.g. when the wallet is first loaded
+        :param transactions: list of transactions from getTransactions
+        :return: list of (direction, amount, date) tuples in the same order
+        """
+        tz = self._check_zone()
+        render = self._render
+        rendered = [render(transaction, tz) for transaction in transactions]
+        render_logger.debug("Formatted {} transactions, cache hits {} misses {}".format(
+            len(rendered), self.hits, self.misses))
+        return rendered
+
+    def forget(self, transaction_hash):
+        """Drops a transaction from the cache, e.g. when it has been removed from the wallet"""
+        self._cache.pop(transaction_hash, None)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+""" RequestCoalescer.py
+
+This file represents the sharing of read-only walletd requests. The poll
+loop, the RPC console, the splash screen and the menus often ask walletd
+the same thing at the same time, so identical requests made while one
+is already in flight wait for its result rather than being sent again,
+and results are cached for a short time per method. Requests that change
+the wallet drop the cached results they affect.
+"""
+
+import json
+import logging
+import threading
+import time
+
+import Metrics
+
+# Get Logger made in start.py
+coalescer_logger = logging.getLogger('trtl_log.coalescer')
+
+# Read-only methods and the seconds their results are cached for. Identical concurrent requests
+# for any of these share one call to walletd, even those with no caching.
+METHOD_TTLS = {
+    'getStatus': 1,
+    'getBalance': 1,
+    'getAddresses': 30,
+    'getUnconfirmedTransactionHashes': 1,
+    'getDelayedTransactionHashes': 1,
+    'getTransactions': 0,
+    'getTransactionHashes': 0,
+    'getTransaction': 0,
+    'getViewKey': 0,
+    'getSpendKeys': 0,
+    'getMnemonicSeed': 0,
+}
+
+# Methods that change the wallet and the cached methods whose results they make stale.
+# A method that is neither listed here nor read-only drops everything that is cached.
+INVALIDATES = {
+    'sendTransaction': ('getBalance', 'getUnconfirmedTransactionHashes', 'getStatus'),
+    'sendFusionTransaction': ('getBalance', 'getUnconfirmedTransactionHashes', 'getStatus'),
+    'createDelayedTransaction': ('getBalance', 'getDelayedTransactionHashes'),
+    'sendDelayedTransaction': ('getBalance', 'getDelayedTransactionHashes', 'getUnconfirmedTransactionHashes'),
+    'deleteDelayedTransaction': ('getBalance', 'getDelayedTransactionHashes'),
+    'createAddress': ('getAddresses', 'getBalance', 'getStatus'),
+    'deleteAddress': ('getAddresses', 'getBalance', 'getStatus'),
+    'save': ('getStatus',),
+}
+
+
+class _Call(object):
+    """A request in flight, which other identical requests wait on"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class RequestCoalescer(object):
+    """
+    This class runs read-only requests through a shared in-flight table and a per-method TTL cache.
+    Cached results are shared between callers and must be treated as read-only.
+    """
+    def __init__(self, ttls=None):
+        """
+        :param ttls: dict of read-only method -> seconds its results are cached for, defaults to METHOD_TTLS
+        """
+        self.ttls = ttls if ttls is not None else METHOD_TTLS
+        self._lock = threading.Lock()
+        self._cache = {}  # (method, params) -> (expiry time, result)
+        self._in_flight = {}  # (method, params) -> _Call
+        # Increases whenever results are invalidated, so a call that was in flight at the time isn't cached
+        self._generation = 0
+        self.stats = {}  # method -> {'hits', 'coalesced', 'misses'}
+
+    def is_read_only(self, method):
+        return method in self.ttls
+
+    def _count(self, method, outcome):
+        self.stats.setdefault(method, {'hits': 0, 'coalesced': 0, 'misses': 0})[outcome] += 1
+        Metrics.increment('rpc.{}.{}'.format(method, outcome))
+
+    def request(self, method, params, make_request):
+        """
+        Makes a request, sharing the result of an identical request in flight or cached if read-only
+        :param method: walletd method
+        :param params: method parameters
+        :param make_request: function making the request to walletd and returning its result
+        :return: the result
+        """
+        if not self.is_read_only(method):
+            try:
+                return make_request()
+            finally:
+                self.invalidate(INVALIDATES.get(method))
+
+        key = (method, json.dumps(params, sort_keys=True))
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] > time.time():
+                self._count(method, 'hits')
+                return cached[1]
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _Call()
+                generation = self._generation
+                self._count(method, 'misses')
+            else:
+                self._count(method, 'coalesced')
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = make_request()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                ttl = self.ttls[method]
+                if call.error is None and ttl > 0 and generation == self._generation:
+                    self._cache[key] = (time.time() + ttl, call.result)
+            call.done.set()
+
+    def invalidate(self, methods=None):
+        """
+        Drops cached results
+        :param methods: methods whose results are dropped, or None for all of them
+        """
+        with self._lock:
+            self._generation += 1
+            if methods is None:
+                self._cache.clear()
+            else:
+                for key in [key for key in self._cache if key[0] in methods]:
+                    del self._cache[key]
+        coalescer_logger.debug("Invalidated cached results of {}".format(", ".join(methods) if methods else "every method"))
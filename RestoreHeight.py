@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+""" RestoreHeight.py
+
+This file represents the conversion of dates to block heights, used to
+tell walletd where to start scanning when a wallet is restored. Heights
+are interpolated from a table of (timestamp, height) samples, starting
+from an approximate genesis anchor and refined with heights the wallet
+has observed, then moved back by a safety margin so no transactions
+are missed.
+"""
+
+from bisect import bisect_left
+from datetime import datetime
+import logging
+import time
+
+import global_variables
+
+# Get Logger made in start.py
+restore_logger = logging.getLogger('trtl_log.restore')
+
+# Target time between blocks, in seconds
+BLOCK_TARGET_SECONDS = 30
+# Approximate time of the genesis block, the anchor used before any heights have been observed
+GENESIS_TIMESTAMP = 1512800692
+# Blocks subtracted from an estimated height, so a restore starts safely before the given date
+SAFETY_MARGIN_BLOCKS = 2880
+# Additional fraction of the distance from the nearest sample subtracted, covering drift in block times
+SAFETY_MARGIN_FRACTION = 0.02
+# Maximum number of observed samples kept in the config
+MAX_SAMPLES = 100
+# Minimum seconds between two observed samples worth keeping
+MIN_SAMPLE_SPACING = 60 * 60 * 24
+
+
+class HeightTable(object):
+    """
+    This class estimates the block height at a given time from (timestamp, height) samples
+    """
+    def __init__(self, samples=None):
+        """
+        :param samples: list of (timestamp, height) pairs
+        """
+        self.samples = sorted(set([(GENESIS_TIMESTAMP, 0)] + [tuple(sample) for sample in samples or []]))
+
+    def add_sample(self, timestamp, height):
+        """
+        Adds an observed height, ignoring samples too close to an existing one
+        :return: True if the sample was added
+        """
+        position = bisect_left(self.samples, (timestamp, height))
+        neighbours = self.samples[max(position - 1, 0):position + 1]
+        if any(abs(timestamp - sample[0]) < MIN_SAMPLE_SPACING for sample in neighbours):
+            return False
+        self.samples.insert(position, (timestamp, height))
+        if len(self.samples) > MAX_SAMPLES + 1:
+            # Thin out the oldest observations, always keeping the genesis anchor
+            del self.samples[1]
+        return True
+
+    def height_at(self, timestamp):
+        """
+        :return: the estimated block height at the given time
+        """
+        position = bisect_left(self.samples, (timestamp,))
+        if position == 0:
+            return 0
+        if position == len(self.samples):
+            # Past the newest sample, carry on at the target block time
+            last_time, last_height = self.samples[-1]
+            return last_height + int((timestamp - last_time) // BLOCK_TARGET_SECONDS)
+        (before_time, before_height), (after_time, after_height) = self.samples[position - 1], self.samples[position]
+        fraction = float(timestamp - before_time) / (after_time - before_time)
+        return before_height + int(fraction * (after_height - before_height))
+
+    def restore_height(self, timestamp):
+        """
+        :return: a height safely before the first block at the given time, to scan a restored wallet from
+        """
+        position = bisect_left(self.samples, (timestamp,))
+        nearest = min(self.samples[max(position - 1, 0):position + 1], key=lambda sample: abs(timestamp - sample[0]))
+        drift = int(abs(timestamp - nearest[0]) / BLOCK_TARGET_SECONDS * SAFETY_MARGIN_FRACTION)
+        return max(self.height_at(timestamp) - SAFETY_MARGIN_BLOCKS - drift, 0)
+
+
+def load_height_table():
+    """
+    :return: HeightTable holding the samples observed so far
+    """
+    return HeightTable(global_variables.wallet_config.get_list('heightSamples'))
+
+
+def record_height_sample(height, timestamp=None):
+    """
+    Remembers the current network height, refining future date to height conversions
+    :param height: the network's block height
+    :param timestamp: time the height was seen, defaults to now
+    """
+    if not height:
+        return
+    table = load_height_table()
+    if table.add_sample(int(timestamp if timestamp is not None else time.time()), height):
+        global_variables.wallet_config['heightSamples'] = [list(sample) for sample in table.samples[1:]]
+        restore_logger.debug("Recorded height {} as a restore height sample".format(height))
+
+
+def parse_restore_point(text):
+    """
+    Turns what the user entered as a restore point into a scan height
+    :param text: a block height, or a date as YYYY-MM-DD
+    :return: the height to scan from, or None if text is empty
+    """
+    text = text.strip()
+    if not text:
+        return None
+    if text.isdigit():
+        return int(text)
+    try:
+        date = datetime.strptime(text, "%Y-%m-%d")
+    except ValueError:
+        raise ValueError("Restore point must be a block height or a date as YYYY-MM-DD")
+    height = load_height_table().restore_height(int(time.mktime(date.timetuple())))
+    restore_logger.info("Restoring from {} is estimated to start at block {}".format(text, height))
+    return height
@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+""" SendQueue.py
+
+This file represents the queue transactions are sent through. Building
+a transaction can take walletd several seconds, so send requests from
+the send form, the command line or payout jobs are queued and sent one
+at a time on a worker thread. Every request carries an idempotency key,
+so submitting the same request twice only sends it once, and the queue
+is kept on disk next to the wallet. A transaction whose send walletd
+didn't answer, or that was being sent when the wallet stopped, may have
+been sent all the same, so it is never sent again. It is looked for in
+the wallet's unconfirmed and recent transactions instead, and only
+marked as failed, letting it be sent again, once it isn't found there.
+"""
+
+from collections import OrderedDict
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+import psutil
+from requests.exceptions import RequestException
+
+from CircuitBreaker import CircuitOpenError
+from ConfigStore import atomic_write_json
+from ConnectionManager import MAINTENANCE
+import Metrics
+import TransactionExport
+from WalletTypes import WalletTransactionState
+
+# Get Logger made in start.py
+send_logger = logging.getLogger('trtl_log.send')
+
+# Statuses of a send request
+QUEUED = 'queued'
+BUILDING = 'building'
+SENT = 'sent'
+FAILED = 'failed'
+# walletd didn't answer the send, so it may or may not have been sent
+UNKNOWN = 'unknown'
+# Number of finished send requests remembered, so a repeated submission isn't sent again
+MAX_FINISHED = 100
+# Seconds between looks for transactions whose send walletd didn't answer
+CHECK_INTERVAL = 30
+# Seconds a transaction must have gone unfound before it is taken as not sent, giving walletd time
+# to finish a send it was still working on
+SETTLE_TIME = 60
+# Seconds block timestamps may be behind the time a transaction was submitted
+BLOCK_TIME_DRIFT = 2 * 60 * 60
+# Target seconds between blocks, for working out how far back to look for a transaction
+BLOCK_TARGET_TIME = 30
+
+INTERRUPTED_ERROR = "Interrupted while being sent, checking whether it was sent"
+KEY_IN_USE_ERROR = "Key {} is already used by a different send request, which is {}"
+NOT_SENT_ERROR = "walletd didn't answer and the transaction isn't in the wallet, so it wasn't sent: {}"
+
+
+def get_send_queue_path(wallet_file):
+    """
+    :return: path of the file holding the send queue of wallet_file
+    """
+    return os.path.abspath(wallet_file) + ".sendqueue"
+
+
+def new_idempotency_key():
+    """
+    :return: a new random idempotency key for a send request
+    """
+    return uuid.uuid4().hex
+
+
+def matches_send_params(transaction, params, state=WalletTransactionState.succeeded):
+    """
+    :param transaction: a transaction from getTransaction or getTransactions
+    :param params: sendTransaction parameters
+    :param state: state the transaction must be in, succeeded for one walletd has sent
+    :return: True if the transaction was made by walletd with the given parameters
+    """
+    if transaction['state'] != state or transaction['fee'] != params['fee'] \
+            or (transaction['paymentId'] or None) != (params.get('paymentId') or None):
+        return False
+    transfers = [(transfer['address'], abs(transfer['amount'])) for transfer in transaction['transfers']]
+    for transfer in params['transfers']:
+        if (transfer['address'], transfer['amount']) not in transfers:
+            return False
+        transfers.remove((transfer['address'], transfer['amount']))
+    return True
+
+
+def make_send_params(address, amount, fee, anonymity, payment_id=None):
+    """
+    Builds the sendTransaction parameters for a single transfer
+    :param address: address to send to
+    :param amount: amount in atomic units
+    :param fee: fee in atomic units
+    :param anonymity: mixin
+    :param payment_id: payment ID, if any
+    :return: dict of sendTransaction parameters
+    """
+    params = {
+        'anonymity': anonymity,
+        'fee': fee,
+        'transfers': [{'amount': amount, 'address': address}],
+    }
+    if payment_id:
+        params['paymentId'] = payment_id
+    return params
+
+
+class SendQueue(object):
+    """
+    This class sends queued sendTransaction requests in order on a worker thread.
+    Entries are dicts with the 'key', 'params', 'status', 'transactionHash', 'error',
+    'created' and 'updated' of a send request, and the 'pid' of the process that submitted or is
+    sending it. The queue file is shared with the command line, so it is re-read when another
+    process changes it, and each entry is only sent by its own process while that is running.
+    """
+    def __init__(self, wallet_connection, path, on_status=None, check_interval=CHECK_INTERVAL, settle_time=SETTLE_TIME):
+        """
+        :param wallet_connection: the WalletConnection to send through
+        :param path: file the queue is kept in
+        :param on_status: called on the sending thread with a copy of an entry whenever its status changes
+        :param check_interval: seconds between looks for transactions whose send walletd didn't answer
+        :param settle_time: seconds such a transaction must have gone unfound before it is taken as not sent
+        """
+        self.wallet_connection = wallet_connection
+        self.path = path
+        self.on_status = on_status
+        self.check_interval = check_interval
+        self.settle_time = settle_time
+
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._file_mtime = None
+        self._work_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.load()
+
+    def load(self):
+        """Reads the queue from its file, taking whichever copy of each entry was updated last"""
+        try:
+            self._file_mtime = os.stat(self.path).st_mtime
+            with open(self.path) as qFile:
+                entries = json.load(qFile)
+        except (IOError, OSError):
+            return
+        except ValueError as e:
+            send_logger.error("Could not read the send queue {}: {}".format(self.path, e))
+            return
+        with self._lock:
+            for entry in entries:
+                known = self.entries.get(entry['key'])
+                if known is None:
+                    self.entries[entry['key']] = entry
+                elif entry['updated'] > known['updated']:
+                    known.update(entry)
+
+    def reload_if_changed(self):
+        """Re-reads the queue file if another process has changed it since it was last read or written"""
+        try:
+            changed = os.stat(self.path).st_mtime != self._file_mtime
+        except (IOError, OSError):
+            return
+        if changed:
+            self.load()
+
+    def save(self):
+        """
+        Writes the queue to its file, forgetting the oldest finished entries. Changes another process
+        has made to the file are merged in first, so they aren't overwritten.
+        """
+        self.reload_if_changed()
+        with self._lock:
+            finished = [key for key, entry in self.entries.items() if entry['status'] in (SENT, FAILED)]
+            for key in finished[:max(len(finished) - MAX_FINISHED, 0)]:
+                del self.entries[key]
+            entries = [dict(entry) for entry in self.entries.values()]
+        try:
+            atomic_write_json(self.path, entries)
+            self._file_mtime = os.stat(self.path).st_mtime
+        except (IOError, OSError) as e:
+            send_logger.error("Could not save the send queue {}: {}".format(self.path, e))
+
+    def is_owned_elsewhere(self, entry):
+        """
+        :return: True if the entry belongs to another process that is still running, which sends it itself
+        """
+        pid = entry.get('pid')
+        return bool(pid) and pid != os.getpid() and psutil.pid_exists(pid)
+
+    def get(self, key):
+        """
+        :return: a copy of the entry with the given key, or None
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            return dict(entry) if entry else None
+
+    def submit(self, params, key=None):
+        """
+        Queues a transaction to be sent. A request with a key that has been submitted before
+        isn't queued again, and the existing entry is returned instead.
+        :param params: sendTransaction parameters
+        :param key: idempotency key, a new one is made if not given
+        :return: a copy of the request's entry
+        :raises ValueError: if the key has been submitted before with different parameters
+        """
+        key = key or new_idempotency_key()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry['params'] != params:
+                    send_logger.warning(KEY_IN_USE_ERROR.format(key, entry['status']))
+                    raise ValueError(KEY_IN_USE_ERROR.format(key, entry['status']))
+                send_logger.info("Send request {} has already been submitted, it is {}".format(key, entry['status']))
+                return dict(entry)
+            now = time.time()
+            entry = self.entries[key] = {'key': key, 'params': params, 'status': QUEUED, 'transactionHash': None,
+                                         'error': None, 'created': now, 'updated': now, 'pid': os.getpid()}
+            entry = dict(entry)
+        self.save()
+        self._notify(entry)
+        self._work_event.set()
+        return entry
+
+    def start(self):
+        """
+        Starts sending on a background thread. Anything that was being sent when the queue was last
+        stopped may already have been sent, so it is looked for rather than sent again.
+        """
+        self.recover_interrupted()
+        self._thread = threading.Thread(target=self.worker_loop, name="SendQueue")
+        self._thread.daemon = True
+        self._thread.start()
+        self._work_event.set()
+
+    def stop(self, timeout=None):
+        """Stops sending, waiting up to timeout seconds for a transaction being sent"""
+        self._stop_event.set()
+        self._work_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def worker_loop(self):
+        """
+        Sends queued transactions as they are submitted, and looks for those whose send walletd
+        didn't answer every check_interval seconds, until stopped
+        """
+        while not self._stop_event.is_set():
+            self._work_event.wait(self.check_interval)
+            self._work_event.clear()
+            self.reload_if_changed()
+            self.recover_interrupted()
+            self.resolve_unknown()
+            self.process_queued()
+
+    def recover_interrupted(self):
+        """
+        Marks the requests whose process stopped while sending them as unknown, since they may already have
+        been sent. Must not be called while this queue is sending.
+        """
+        with self._lock:
+            interrupted = [entry for entry in self.entries.values()
+                           if entry['status'] == BUILDING and not self.is_owned_elsewhere(entry)]
+        for entry in interrupted:
+            send_logger.warning("Send request {} was interrupted while being sent".format(entry['key']))
+            self._set_status(entry, UNKNOWN, error=INTERRUPTED_ERROR)
+
+    def resolve_unknown(self):
+        """Looks for the transactions whose send walletd didn't answer"""
+        with self._lock:
+            unknown = [entry for entry in self.entries.values() if entry['status'] == UNKNOWN]
+        for entry in unknown:
+            if self._stop_event.is_set():
+                return
+            try:
+                self.resolve(entry)
+            except (RequestException, ValueError) as e:
+                send_logger.warning("Could not check whether send request {} was sent: {}".format(entry['key'], e))
+
+    def resolve(self, entry):
+        """
+        Looks for a transaction whose send walletd didn't answer among the wallet's unconfirmed and recent
+        transactions. It is marked as sent if it is found, and as failed, so it can be sent again, if it isn't
+        found settle_time seconds after walletd failed to answer. walletd must be synchronized by then, as a
+        rescan may not have found the sent transaction yet.
+        :param entry: the queue's own entry, not a copy
+        :raises RequestException, ValueError: if walletd can't be asked
+        """
+        transaction_hash, synchronized = self.find_sent_transaction(entry)
+        if transaction_hash:
+            send_logger.info("Send request {} was sent as transaction {}".format(entry['key'], transaction_hash))
+            self._set_status(entry, SENT, transactionHash=transaction_hash, error=None)
+        elif not synchronized:
+            send_logger.info("Send request {} not found yet, walletd is still synchronizing".format(entry['key']))
+        elif time.time() - entry['updated'] >= self.settle_time:
+            send_logger.warning("Send request {} was not sent".format(entry['key']))
+            self._set_status(entry, FAILED, error=NOT_SENT_ERROR.format(entry['error']))
+
+    def find_sent_transaction(self, entry):
+        """
+        :param entry: a send request entry
+        :return: tuple of (hash of a transaction in the wallet matching the send request, and not already
+            taken by another send request, or None if there is none, True if walletd is synchronized)
+        """
+        with self._lock:
+            taken = set(other['transactionHash'] for other in self.entries.values() if other['transactionHash'])
+        params = entry['params']
+        hashes = self.wallet_connection.request("getUnconfirmedTransactionHashes", params={'addresses': []},
+                                                priority=MAINTENANCE)['transactionHashes']
+        for transaction_hash in hashes:
+            if transaction_hash in taken:
+                continue
+            transaction = self.wallet_connection.request("getTransaction", params={'transactionHash': transaction_hash},
+                                                         priority=MAINTENANCE)['transaction']
+            if matches_send_params(transaction, params):
+                return transaction_hash, True
+
+        # It may have been mined already, so look through the blocks since it was submitted
+        status = self.wallet_connection.request("getStatus", priority=MAINTENANCE)
+        block_count = status['blockCount']
+        synchronized = block_count + 1 >= status['knownBlockCount']
+        lookback = int((time.time() - entry['created'] + BLOCK_TIME_DRIFT) / BLOCK_TARGET_TIME) + 1
+        for block in TransactionExport.iter_wallet_blocks(self.wallet_connection, [], block_count,
+                                                          first_block_index=max(block_count - lookback, 1)):
+            for transaction in block['transactions']:
+                if transaction['transactionHash'] not in taken and matches_send_params(transaction, params):
+                    return transaction['transactionHash'], synchronized
+        return None, synchronized
+
+    def process_queued(self):
+        """Sends every queued transaction in the order they were submitted"""
+        while not self._stop_event.is_set():
+            with self._lock:
+                entry = next((entry for entry in self.entries.values()
+                              if entry['status'] == QUEUED and not self.is_owned_elsewhere(entry)), None)
+            if entry is None:
+                return
+            self.send(entry)
+
+    def send(self, entry):
+        """
+        Sends a queued transaction. If walletd refuses it, it is marked as failed. If walletd doesn't answer,
+        it may have been sent all the same, so it is marked as unknown until it has been looked for.
+        :param entry: the queue's own entry, not a copy
+        """
+        self._set_status(entry, BUILDING, pid=os.getpid())
+        start_time = time.time()
+        try:
+            # Don't let a background save run while the transaction is being sent
+            with self.wallet_connection.send_lock:
+                response = self.wallet_connection.request("sendTransaction", params=entry['params'])
+        except (ValueError, CircuitOpenError) as e:
+            # Refused by walletd, or never sent to it
+            send_logger.error("Send request {} failed: {}".format(entry['key'], e))
+            self._set_status(entry, FAILED, error=str(e))
+            return
+        except RequestException as e:
+            send_logger.error("Send request {} may not have been sent: {}".format(entry['key'], e))
+            self._set_status(entry, UNKNOWN, error=str(e))
+            return
+        Metrics.record('send.build_seconds', time.time() - start_time)
+        send_logger.info("Send request {} sent as transaction {}".format(entry['key'], response['transactionHash']))
+        self._set_status(entry, SENT, transactionHash=response['transactionHash'])
+
+    def _set_status(self, entry, status, **fields):
+        with self._lock:
+            entry.update(fields, status=status, updated=time.time())
+            entry = dict(entry)
+        self.save()
+        self._notify(entry)
+
+    def _notify(self, entry):
+        if self.on_status:
+            try:
+                self.on_status(entry)
+            except Exception as e:
+                send_logger.error("Send status subscriber failed: {}".format(e))
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+""" ShutdownCoordinator.py
+
+This file represents the shutdown of the wallet once its window has
+closed. The background services are stopped, the wallet is saved, and
+the wallet daemon is terminated and then killed if it doesn't exit,
+each phase with its own deadline, so closing the wallet takes a
+predictable few seconds even when walletd has stopped responding.
+"""
+
+import logging
+import time
+
+import global_variables
+import Metrics
+
+# Get Logger made in start.py
+shutdown_logger = logging.getLogger('trtl_log.shutdown')
+
+# Default seconds allowed for each phase, overridable in the config
+SERVICE_TIMEOUT = 3
+SAVE_TIMEOUT = 10
+TERMINATE_TIMEOUT = 5
+KILL_TIMEOUT = 3
+
+
+class ShutdownCoordinator(object):
+    """
+    This class stops the background services and the wallet daemon in order, with a deadline for each phase
+    """
+    def __init__(self):
+        # List of (name, stop) pairs, stop is called with the seconds it may take
+        self.services = []
+        self.phase_durations = {}
+
+    def add_service(self, name, stop):
+        """
+        Registers a background service to be stopped before the wallet daemon
+        :param name: name of the service, for the log
+        :param stop: function called with the number of seconds it may wait for the service to stop
+        """
+        self.services.append((name, stop))
+
+    def run_phase(self, name, function, *args):
+        """
+        Runs a phase of the shutdown, logging how long it took. Errors are logged rather than
+        raised, so one failing phase doesn't stop the others from running.
+        :return: the phase's return value, or None if it failed
+        """
+        start_time = time.time()
+        result = None
+        try:
+            result = function(*args)
+        except Exception as e:
+            shutdown_logger.error("Shutdown phase '{}' failed: {}".format(name, e))
+        duration = time.time() - start_time
+        self.phase_durations[name] = duration
+        Metrics.record('shutdown.{}_seconds'.format(name.replace(' ', '_')), duration)
+        shutdown_logger.info("Shutdown phase '{}' took {:.2f}s".format(name, duration))
+        return result
+
+    def stop_services(self, timeout):
+        """
+        Stops the registered services, sharing timeout seconds between them. A service that fails to
+        stop is logged and skipped, so the services after it are still stopped.
+        """
+        deadline = time.time() + timeout
+        for name, stop in self.services:
+            shutdown_logger.debug("Stopping {}".format(name))
+            try:
+                stop(max(deadline - time.time(), 0))
+            except Exception as e:
+                shutdown_logger.error("Failed to stop {}: {}".format(name, e))
+
+    def shutdown(self):
+        """
+        Stops the services, saves the wallet, stops or releases the wallet daemon and writes the config
+        :return: dict of seconds taken by each phase
+        """
+        config = global_variables.wallet_config
+        save_timeout = config.get_float('shutdownSaveTimeout', SAVE_TIMEOUT)
+        terminate_timeout = config.get_float('shutdownTerminateTimeout', TERMINATE_TIMEOUT)
+        kill_timeout = config.get_float('shutdownKillTimeout', KILL_TIMEOUT)
+        start_time = time.time()
+
+        self.run_phase("services", self.stop_services, config.get_float('shutdownServiceTimeout', SERVICE_TIMEOUT))
+
+        connection = global_variables.wallet_connection
+        if connection and connection.walletd:
+            if connection.detached:
+                self.run_phase("release daemon", connection.release_wallet_daemon, save_timeout)
+            elif connection.walletd.poll() is None:
+                self.run_phase("save", connection.save_wallet, save_timeout)
+                self.run_phase("stop daemon", connection.end_wallet_daemon, terminate_timeout, kill_timeout)
+
+        # Write any config changes still waiting to be saved
+        self.run_phase("config", config.flush)
+
+        shutdown_logger.info("Shutdown took {:.2f}s".format(time.time() - start_time))
+        return self.phase_durations
@@ -15,8 +15,10 @@ import global_variables
 from HelperFunctions import get_wallet_daemon_path
 from requests import ConnectionError
 from MainWindow import MainWindow
+from SyncTracker import SyncTracker, format_duration
+from RestoreHeight import parse_restore_point, record_height_sample
+from NodeSelector import NodeSelector, DEFAULT_NODE, get_node_candidates, use_node
 import logging
-import json
 import os
 from subprocess import Popen
 import re
@@ -60,7 +62,17 @@ class SplashScreen(object):
         # If we fail to talk to the server so many times, it's hopeless
         fail_count = 0
         try:
-            global_variables.wallet_connection = WalletConnection(wallet_file, wallet_password)
+            if global_variables.wallet_config.get_bool('autoSelectNode'):
+                GLib.idle_add(self.update_status, "Finding the fastest node...")
+                node = NodeSelector(get_node_candidates()).select_best()
+                if node:
+                    splash_logger.info("Using node {}".format(node))
+                    use_node(node)
+                else:
+                    splash_logger.warning("No node answered, using the configured node")
+
+            global_variables.wallet_connection = WalletConnection(wallet_file, wallet_password,
+                                                                  detached=global_variables.wallet_config.get_bool('detachedDaemon'))
 
             # The RPC server may not be running at this point yet.
             # The daemon may be busy updating the database (importing blocks from blockchain storage).
@@ -78,6 +90,7 @@ class SplashScreen(object):
 
             block_count = 0
             known_block_count = 0
+            global_variables.sync_tracker = SyncTracker()
             # Loop until the block count is greater than or equal to the known block count.
             # This should guarantee us that the daemon is running and synchronized before the main
             # window opens.
@@ -109,14 +122,18 @@ class SplashScreen(object):
 
                     days_behind = ((known_block_count - block_count) * 30) / (60 * 60 * 24)
                     percent_synced = int((float(block_count) / float(known_block_count)) * 100)
+                    global_variables.sync_tracker.add_sample(block_count, known_block_count)
+                    sync_description = global_variables.sync_tracker.describe()
 
-                    GLib.idle_add(self.update_status, "Synchronizing...{}%\n[{} / {}] ({} days behind)".format(percent_synced, block_count, known_block_count, days_behind))
-                    splash_logger.debug("Synchronizing...{}% [{} / {}] ({} days behind)".format(percent_synced, block_count, known_block_count, days_behind))
+                    GLib.idle_add(self.update_status, "Synchronizing...{}%\n[{} / {}] ({} days behind)\n{}".format(percent_synced, block_count, known_block_count, days_behind, sync_description))
+                    splash_logger.debug("Synchronizing...{}% [{} / {}] ({} days behind) {}".format(percent_synced, block_count, known_block_count, days_behind, sync_description))
                     # Even though we check known block count, leaving it in there in case of weird edge cases
                     # Buffer the block count by 1 due to latency issues, remote node will almost always be ahead by one
                     if (known_block_count > 0) and (block_count+1 >= known_block_count):
                         GLib.idle_add(self.update_status, "Wallet is synchronized, opening...")
                         splash_logger.info("Wallet successfully synchronized, opening wallet")
+                        # Remember the height at this time, to better estimate where restored wallets should scan from
+                        record_height_sample(known_block_count)
                         break
                 except ConnectionError as e:
                     fail_count += 1
@@ -135,11 +152,12 @@ class SplashScreen(object):
         # Open the main window using glib
         GLib.idle_add(self.open_main_window)
 
-    def create_wallet(self, name, password, view_key=None, spend_key=None):
+    def create_wallet(self, name, password, view_key=None, spend_key=None, scan_height=None):
         """
         This function is responsible for creating a wallet from the daemon.
         The user gives the name and password (and private keys if importing) on a prompt, which is passed here.
-        :return: Process Object Return Code
+        :param scan_height: block height an imported wallet is scanned from, instead of from the genesis block
+        :return: Process Object of walletd generating the wallet
         """
         walletd_args = [
             get_wallet_daemon_path(),
@@ -151,8 +169,37 @@ class SplashScreen(object):
             walletd_args.extend(['--view-key', view_key])
         if spend_key:
             walletd_args.extend(['--spend-key', spend_key])
-        walletd = Popen(walletd_args)
-        return walletd.wait()
+        if scan_height:
+            walletd_args.extend(['--scan-height', str(scan_height)])
+        return Popen(walletd_args)
+
+    def create_wallet_and_initialise(self, name, password, view_key=None, spend_key=None, scan_height=None):
+        """
+        Creates (or imports) a wallet, then initialises the connection to it.
+        Runs on its own thread so the splash screen stays responsive while walletd generates the wallet.
+        """
+        if view_key:
+            if scan_height:
+                action = "Importing wallet, scanning from block {}".format(scan_height)
+            else:
+                action = "Importing wallet, scanning from the first block"
+        else:
+            action = "Creating wallet"
+        splash_logger.info(action)
+        start_time = time.time()
+        walletd = self.create_wallet(name, password, view_key, spend_key, scan_height)
+        while walletd.poll() is None:
+            GLib.idle_add(self.update_status, "{}... {}".format(action, format_duration(time.time() - start_time)))
+            time.sleep(0.5)
+        if walletd.returncode != 0:
+            message = "walletd failed to create the wallet (exit code {})".format(walletd.returncode)
+            splash_logger.error(message)
+            GLib.idle_add(self.update_status, "Failed: {}".format(message))
+            time.sleep(3)
+            GLib.idle_add(Gtk.main_quit)
+            return
+        splash_logger.info("Wallet created in {}".format(format_duration(time.time() - start_time)))
+        self.initialise(os.path.join(cur_dir, name + ".wallet"), password)
 
     def prompt_wallet_dialog(self):
         """
@@ -319,7 +366,7 @@ class SplashScreen(object):
         Prompt the user to import a wallet, if they selected to import a wallet.
         User enters a name, password, and keys for the wallet.
         The password is checked twice and compared to ensure its correct.
-        :return: Returns a Tuple of Wallet Name, Password, View Key, Spend Key on success, string error on fail, or None on Cancel
+        :return: Returns a Tuple of Wallet Name, Password, View Key, Spend Key, Scan Height on success, string error on fail, or None on Cancel
         """
         dialog = Gtk.MessageDialog(self.window,
                                    Gtk.DialogFlags.MODAL | Gtk.DialogFlags.DESTROY_WITH_PARENT,
@@ -360,11 +407,19 @@ class SplashScreen(object):
         spendKeyEntry.set_visibility(True)
         spendKeyEntry.set_size_request(500, 0)
 
+        restoreLabel = Gtk.Label("Restore From (block height or date as YYYY-MM-DD, blank to scan from the start):")
+        restoreEntry = Gtk.Entry()
+        restoreEntry.set_visibility(True)
+        restoreEntry.set_placeholder_text("(Optional)")
+        restoreEntry.set_size_request(250, 0)
+
         # Trigger the dialog's response when a user hits ENTER on the text box.
         # The lamba here is a wrapper to get around the default arguments
         passEntryConfirm.connect("activate", lambda w: dialog.response(Gtk.ResponseType.OK))
 
         # Pack the back right to left, no expanding, no filling, 0 padding
+        dialog_box.pack_end(restoreEntry, False, False, 0)
+        dialog_box.pack_end(restoreLabel, False, False, 0)
         dialog_box.pack_end(spendKeyEntry, False, False, 0)
         dialog_box.pack_end(spendKeyLabel, False, False, 0)
         dialog_box.pack_end(viewKeyEntry, False, False, 0)
@@ -383,6 +438,7 @@ class SplashScreen(object):
         passConfirmText = passEntryConfirm.get_text()
         viewKeyText = viewKeyEntry.get_text()
         spendKeyText = spendKeyEntry.get_text()
+        restoreText = restoreEntry.get_text()
         dialog.destroy()
         if response == Gtk.ResponseType.OK:
             if nameText == "":
@@ -392,8 +448,12 @@ class SplashScreen(object):
             elif viewKeyText == "" or spendKeyText == "":
                 return "Both view and spend keys must be specified"
             else:
+                try:
+                    scanHeight = parse_restore_point(restoreText)
+                except ValueError as e:
+                    return str(e)
                 #return Tuple of information
-                return (nameText,passText,viewKeyText,spendKeyText)
+                return (nameText,passText,viewKeyText,spendKeyText,scanHeight)
         else:
             return None
 
@@ -456,8 +516,8 @@ class SplashScreen(object):
 
         def on_radio_button_toggled(radio_button, option):
             if radio_button.get_active():
-                if option == "local":
-                    # Local is selected, so disable the remote node text box
+                if option in ("local", "fastest"):
+                    # Local or fastest node is selected, so disable the remote node text box
                     remote_node_address.set_sensitive(False)
                     remote_node_address.get_style_context().remove_class("red")  # Remove any highlighting
                     ok_button.set_sensitive(True)   # Ensure OK is enabled
@@ -471,9 +531,15 @@ class SplashScreen(object):
         remote_node_radio_button = Gtk.RadioButton.new_from_widget(local_node_radio_button)
         remote_node_radio_button.set_label("Remote Node")
         remote_node_radio_button.connect("toggled", on_radio_button_toggled, "remote")
+        fastest_node_radio_button = Gtk.RadioButton.new_from_widget(local_node_radio_button)
+        fastest_node_radio_button.set_label("Fastest Remote Node")
+        fastest_node_radio_button.set_tooltip_text("Picks the fastest up to date node from remoteDaemonCandidates "
+                                                   "in the config, switching node if it falls behind")
+        fastest_node_radio_button.connect("toggled", on_radio_button_toggled, "fastest")
         radio_button_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
         radio_button_box.pack_start(local_node_radio_button, False, False, 0)
         radio_button_box.pack_start(remote_node_radio_button, False, False, 0)
+        radio_button_box.pack_start(fastest_node_radio_button, False, False, 0)
 
         def validate_remote_node_address(entry):
             entry_style_context = entry.get_style_context()
@@ -500,8 +566,10 @@ class SplashScreen(object):
         if remote_daemon_address and remote_daemon_port:
             remote_node_address.set_text("%s:%s" % (remote_daemon_address, remote_daemon_port))
         else:
-            # Thanks to iburnmycd for providing a public daemon service!
-            remote_node_address.set_text("public.turtlenode.io:11898")
+            remote_node_address.set_text(DEFAULT_NODE)
+
+        if global_variables.wallet_config.get_bool('autoSelectNode'):
+            fastest_node_radio_button.set_active(True)
 
         dialog_content.pack_start(label, False, False, 0)
         dialog_content.pack_end(remote_node_address, False, False, 5)
@@ -514,20 +582,19 @@ class SplashScreen(object):
 
         response = dialog.run()
         if response == Gtk.ResponseType.OK:
+            global_variables.wallet_config['autoSelectNode'] = fastest_node_radio_button.get_active()
             if remote_node_address.is_sensitive():
                 # Remote option is selected so parse the address and port
-                remote_daemon_address, remote_daemon_port = remote_node_address.get_text().rsplit(':', 1)
+                use_node(remote_node_address.get_text())
+            elif fastest_node_radio_button.get_active():
+                # The node is chosen when the wallet starts, the remote node is only a fallback
                 global_variables.wallet_config['remoteDaemon'] = True
-                global_variables.wallet_config['remoteDaemonAddress'] = remote_daemon_address
-                global_variables.wallet_config['remoteDaemonPort'] = remote_daemon_port
+                if not global_variables.wallet_config.get('remoteDaemonAddress', None):
+                    use_node(DEFAULT_NODE)
             else:
                 # Local option is selected so disable remote daemon
                 global_variables.wallet_config['remoteDaemon'] = False
 
-            # Save the settings to the config file
-            with open(global_variables.wallet_config_file, 'w') as cFile:
-                cFile.write(json.dumps(global_variables.wallet_config))
-
         dialog.destroy()
 
         return response
@@ -564,21 +631,8 @@ class SplashScreen(object):
         self.window.set_title("TurtleWallet v{0}".format(__version__))
         splash_logger.info("TurtleWallet v{0}".format(__version__))
 
-        #Check for config file
-        if os.path.exists(global_variables.wallet_config_file):
-            with open(global_variables.wallet_config_file) as cFile:
-                try:
-                    global_variables.wallet_config = json.loads(cFile.read())
-                except ValueError:
-                    splash_logger.error("Failed to decode the JSON file, using defaults")
-                    defaults = {"hasWallet": False, "walletPath": ""}
-                    global_variables.wallet_config = defaults
-        else:
-            #No config file, create it
-            with open(global_variables.wallet_config_file, 'w') as cFile:
-                defaults = {"hasWallet": False, "walletPath": ""}
-                global_variables.wallet_config = defaults
-                cFile.write(json.dumps(defaults))
+        #Load the config file, creating it if there isn't one
+        global_variables.wallet_config.load(defaults={"hasWallet": False, "walletPath": ""})
 
         if wallet_file_path:
             global_variables.wallet_config['walletPath'] = wallet_file_path
@@ -597,8 +651,6 @@ class SplashScreen(object):
                     global_variables.wallet_config['cachedWalletPath'] = global_variables.wallet_config['walletPath']
                     global_variables.wallet_config['walletPath'] = ""
                     global_variables.wallet_config['hasWallet'] = False
-                    with open(global_variables.wallet_config_file, 'w') as cFile:
-                        cFile.write(json.dumps(global_variables.wallet_config))
                     self.__init__()
                 elif wallet_password[0]:
                     if "remoteDaemon" not in global_variables.wallet_config:
@@ -627,8 +679,6 @@ class SplashScreen(object):
                         #chose to use different wallet, cache old wallet just in case, rewrite config, and reset
                         global_variables.wallet_config['cachedWalletPath'] = global_variables.wallet_config['walletPath']
                         global_variables.wallet_config['walletPath'] = ""
-                        with open(global_variables.wallet_config_file, 'w') as cFile:
-                            cFile.write(json.dumps(global_variables.wallet_config))
                         self.__init__()
                     elif wallet_password[0]:
                         if "remoteDaemon" not in global_variables.wallet_config:
@@ -647,8 +697,6 @@ class SplashScreen(object):
                 else:
                     splash_logger.warn(global_variables.message_dict["NO_INFO"])
                     global_variables.wallet_config["hasWallet"] = False
-                    with open(global_variables.wallet_config_file, 'w') as cFile:
-                        cFile.write(json.dumps(global_variables.wallet_config))
                     self.startup_cancelled = True
         else:
             #Select or create wallet
@@ -664,14 +712,13 @@ class SplashScreen(object):
                     err_dialog = self.SplashScreen_generic_dialog(createReturn,"Error on wallet create")
                     self.__init__()
                 elif isinstance(createReturn, tuple):
-                    self.create_wallet(createReturn[0],createReturn[1])
                     if "remoteDaemon" not in global_variables.wallet_config:
                         if self.prompt_node() != Gtk.ResponseType.OK:
                             self.startup_cancelled = True
                             return
                     self.window.show()
-                    # Start the wallet initialisation on a new thread
-                    thread = threading.Thread(target=self.initialise, args=(os.path.join(cur_dir,createReturn[0] + ".wallet"), createReturn[1]))
+                    # Create the wallet and start the wallet initialisation on a new thread
+                    thread = threading.Thread(target=self.create_wallet_and_initialise, args=(createReturn[0], createReturn[1]))
                     thread.start()
             elif response == 9:
                 #select wallet
@@ -686,8 +733,6 @@ class SplashScreen(object):
                         #chose to use different wallet, cache old wallet just in case, rewrite config, and reset
                         global_variables.wallet_config['cachedWalletPath'] = global_variables.wallet_config['walletPath']
                         global_variables.wallet_config['walletPath'] = ""
-                        with open(global_variables.wallet_config_file, 'w') as cFile:
-                            cFile.write(json.dumps(global_variables.wallet_config))
                         self.__init__()
                     elif wallet_password[0] == True:
                         if "remoteDaemon" not in global_variables.wallet_config:
@@ -717,10 +762,13 @@ class SplashScreen(object):
                     err_dialog = self.SplashScreen_generic_dialog(importReturn,"Error on wallet import")
                     self.__init__()
                 elif isinstance(importReturn, tuple):
-                    self.create_wallet(importReturn[0],importReturn[1],importReturn[2],importReturn[3])
+                    if "remoteDaemon" not in global_variables.wallet_config:
+                        if self.prompt_node() != Gtk.ResponseType.OK:
+                            self.startup_cancelled = True
+                            return
                     self.window.show()
-                    # Start the wallet initialisation on a new thread
-                    thread = threading.Thread(target=self.initialise, args=(os.path.join(cur_dir,importReturn[0] + ".wallet"), importReturn[1]))
+                    # Import the wallet and start the wallet initialisation on a new thread
+                    thread = threading.Thread(target=self.create_wallet_and_initialise, args=importReturn)
                     thread.start()
             else:
                 self.startup_cancelled = True
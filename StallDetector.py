@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+""" StallDetector.py
+
+This file represents the detection of stalls of the GTK main loop, for
+finding out what makes the wallet freeze. A heartbeat callback on the
+main loop notes the time every few tenths of a second, and a watchdog
+thread checks on it. When the heartbeat is late by more than a
+threshold, the watchdog captures the main thread's Python stack and
+works out which handler is running, and once the main loop is back the
+stall is logged with its duration and counted against that handler.
+"""
+
+from gi.repository import GLib
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+import Metrics
+
+# Get Logger made in start.py
+stall_logger = logging.getLogger('trtl_log.stall')
+
+# Seconds the main loop may go without a heartbeat before it counts as stalled
+STALL_THRESHOLD = 0.5
+# Seconds between heartbeats
+HEARTBEAT_INTERVAL = 0.1
+# Handler a stall is counted against when its stack wasn't captured
+UNKNOWN_HANDLER = "unknown"
+
+# Directory of the wallet's own modules
+app_dir = os.path.dirname(os.path.realpath(__file__))
+
+
+def is_app_function(frame):
+    """
+    :return: True if a frame is running one of the wallet's own functions
+    """
+    code = frame.f_code
+    return code.co_name != '<module>' and os.path.dirname(os.path.realpath(code.co_filename)) == app_dir
+
+
+def find_handler(frame):
+    """
+    Works out which handler a stack is running, i.e. the innermost of the wallet's functions called by
+    GTK rather than by another of the wallet's functions. Handlers running in the nested main loop of a
+    dialog are told apart from the handler that showed the dialog this way.
+    :param frame: innermost frame of the stack
+    :return: 'Module.function' of the handler, or None if no wallet function is running
+    """
+    while frame is not None:
+        if is_app_function(frame) and (frame.f_back is None or not is_app_function(frame.f_back)):
+            module = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+            return "{}.{}".format(module, frame.f_code.co_name)
+        frame = frame.f_back
+    return None
+
+
+class StallDetector(object):
+    """
+    This class watches the GTK main loop for stalls and keeps count of them per handler.
+    start must be called on the GTK main thread.
+    """
+    def __init__(self, threshold=STALL_THRESHOLD, heartbeat_interval=HEARTBEAT_INTERVAL):
+        """
+        :param threshold: seconds the main loop may go without a heartbeat before it counts as stalled
+        :param heartbeat_interval: seconds between heartbeats
+        """
+        self.threshold = threshold
+        self.heartbeat_interval = heartbeat_interval
+
+        self.last_beat = time.time()
+        self.stats = {}  # handler -> {'count', 'total', 'max'}
+        self._stall = None  # The stall the watchdog has caught in progress, if any
+        self._main_ident = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts the heartbeat on the main loop and the watchdog thread"""
+        self._main_ident = threading.current_thread().ident
+        self.last_beat = time.time()
+        GLib.timeout_add(int(self.heartbeat_interval * 1000), self.heartbeat)
+        self._thread = threading.Thread(target=self.watchdog_loop, name="StallDetector")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stops watching the main loop"""
+        self._stop_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def heartbeat(self):
+        """Called on the main loop every heartbeat_interval seconds, notes the beat and records the stall if it was late"""
+        now = time.time()
+        with self._lock:
+            late = now - self.last_beat - self.heartbeat_interval
+            self.last_beat = now
+            stall, self._stall = self._stall, None
+        if late > self.threshold:
+            self.record(stall, late)
+        return not self._stop_event.is_set()
+
+    def watchdog_loop(self):
+        """Checks the heartbeat until stopped, capturing the main thread's stack when it is late"""
+        while not self._stop_event.wait(self.heartbeat_interval):
+            with self._lock:
+                if self._stall is not None or time.time() - self.last_beat - self.heartbeat_interval <= self.threshold:
+                    continue
+                frame = sys._current_frames().get(self._main_ident)
+                if frame is None:
+                    continue
+                self._stall = {'handler': find_handler(frame) or UNKNOWN_HANDLER,
+                               'stack': "".join(traceback.format_stack(frame))}
+                handler = self._stall['handler']
+            stall_logger.warning("Main loop has stalled in {}".format(handler))
+
+    def record(self, stall, duration):
+        """
+        Counts a stall against the handler that caused it, and logs it with the stack captured by the watchdog
+        :param stall: the stall the watchdog caught, or None if it was over before the watchdog noticed
+        :param duration: seconds the main loop was stalled for
+        """
+        handler = stall['handler'] if stall else UNKNOWN_HANDLER
+        with self._lock:
+            stats = self.stats.setdefault(handler, {'count': 0, 'total': 0.0, 'max': 0.0})
+            stats['count'] += 1
+            stats['total'] += duration
+            stats['max'] = max(stats['max'], duration)
+        Metrics.record('ui.stall_seconds', duration)
+        if stall:
+            stall_logger.warning("Main loop stalled for {:.2f}s in {}, at:\n{}".format(duration, handler, stall['stack']))
+        else:
+            stall_logger.warning("Main loop stalled for {:.2f}s".format(duration))
+
+    def snapshot(self):
+        """
+        :return: list of (handler, count, total seconds, longest seconds), the handler that stalled longest in total first
+        """
+        with self._lock:
+            rows = [(handler, stats['count'], stats['total'], stats['max']) for handler, stats in self.stats.items()]
+        return sorted(rows, key=lambda row: -row[2])
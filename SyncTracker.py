@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+""" SyncTracker.py
+
+This file represents the tracking of the wallet's synchronisation
+throughput. It is fed successive getStatus samples and works out a
+smoothed blocks per second rate, an ETA to the top of the chain, and
+whether synchronisation has stalled.
+"""
+
+import math
+import time
+import logging
+import Metrics
+
+# Get Logger made in start.py
+sync_logger = logging.getLogger('trtl_log.sync')
+
+
+def format_duration(seconds):
+    """
+    Formats a number of seconds as a short human readable duration
+    :return: string such as '45s', '12m 5s' or '3h 20m'
+    """
+    seconds = int(seconds)
+    if seconds < 60:
+        return "{}s".format(seconds)
+    if seconds < 3600:
+        return "{}m {}s".format(seconds // 60, seconds % 60)
+    if seconds < 86400:
+        return "{}h {}m".format(seconds // 3600, (seconds % 3600) // 60)
+    return "{}d {}h".format(seconds // 86400, (seconds % 86400) // 3600)
+
+
+class SyncTracker(object):
+    """
+    This class tracks synchronisation throughput from getStatus samples
+    """
+    def __init__(self, smoothing_period=60, stall_seconds=120, log_interval=60):
+        """
+        :param smoothing_period: seconds over which the rate is exponentially smoothed
+        :param stall_seconds: seconds without progress, while behind, before synchronisation counts as stalled
+        :param log_interval: seconds between progress log entries
+        """
+        self.smoothing_period = smoothing_period
+        self.stall_seconds = stall_seconds
+        self.log_interval = log_interval
+
+        self.block_count = 0
+        self.known_block_count = 0
+        self.rate = None
+        self.last_sample_time = None
+        self.last_progress_time = None
+        self.last_log_time = 0
+        self.stalled = False
+
+    @property
+    def blocks_behind(self):
+        return max(self.known_block_count - self.block_count, 0)
+
+    @property
+    def eta(self):
+        """
+        :return: estimated seconds until the wallet is synchronized, or None if unknown
+        """
+        if not self.blocks_behind:
+            return 0
+        if not self.rate:
+            return None
+        return self.blocks_behind / self.rate
+
+    def reset(self):
+        """Forgets the samples so far, e.g. after walletd has been told to rescan"""
+        self.rate = None
+        self.last_sample_time = None
+        self.last_progress_time = None
+        self.stalled = False
+
+    def add_sample(self, block_count, known_block_count, sample_time=None):
+        """
+        Updates the rate, ETA and stall state with a new getStatus sample
+        :param block_count: the wallet's blockCount
+        :param known_block_count: the wallet's knownBlockCount
+        :param sample_time: time of the sample, defaults to now
+        """
+        now = sample_time if sample_time is not None else time.time()
+        if self.last_sample_time is not None and now > self.last_sample_time:
+            elapsed = now - self.last_sample_time
+            progress = max(block_count - self.block_count, 0)
+            instant_rate = progress / elapsed
+            # Weight the new sample by how much time it covers, so irregular polling doesn't skew the rate
+            weight = 1 - math.exp(-elapsed / float(self.smoothing_period))
+            self.rate = instant_rate if self.rate is None else self.rate + weight * (instant_rate - self.rate)
+            if progress:
+                self.last_progress_time = now
+        else:
+            self.last_progress_time = now
+
+        self.last_sample_time = now
+        self.block_count = block_count
+        self.known_block_count = known_block_count
+
+        was_stalled = self.stalled
+        self.stalled = self.blocks_behind > 1 and now - self.last_progress_time >= self.stall_seconds
+        if self.stalled and not was_stalled:
+            sync_logger.warning("Synchronization has stalled at block {} of {}".format(block_count, known_block_count))
+        elif was_stalled and not self.stalled:
+            sync_logger.info("Synchronization has resumed at block {}".format(block_count))
+
+        if self.rate is not None:
+            Metrics.record('sync.blocks_per_second', self.rate)
+            if now - self.last_log_time >= self.log_interval and self.blocks_behind > 1:
+                self.last_log_time = now
+                sync_logger.info("Synchronizing at {:.1f} blocks/s, {} blocks behind, {}".format(
+                    self.rate, self.blocks_behind, self.describe_eta()))
+
+    def describe_eta(self):
+        """
+        :return: a short description of the time left, e.g. '1h 5m left', 'stalled for 3m 0s'
+        """
+        if self.stalled:
+            return "stalled for {}".format(format_duration(self.last_sample_time - self.last_progress_time))
+        eta = self.eta
+        if eta is None:
+            return "estimating time left"
+        return "{} left".format(format_duration(eta))
+
+    def describe(self):
+        """
+        :return: a short description of the rate and time left, e.g. '42.0 blocks/s, 1h 5m left'
+        """
+        if self.rate is None:
+            return self.describe_eta()
+        return "{:.1f} blocks/s, {}".format(self.rate, self.describe_eta())
+
+    def progress(self):
+        """
+        :return: dict of the current synchronisation figures, for display and metrics
+        """
+        return {
+            'blockCount': self.block_count,
+            'knownBlockCount': self.known_block_count,
+            'blocksPerSecond': self.rate,
+            'eta': self.eta,
+            'stalled': self.stalled,
+            'description': self.describe()
+        }
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+""" TransactionExport.py
+
+This file represents the export of the wallet's transaction history to
+CSV, JSON Lines or Parquet files. Transactions are streamed page by
+page, either from walletd or from blocks already held in memory, and
+written out as they arrive, so the memory used does not grow with the
+size of the wallet's history.
+"""
+
+import csv
+from datetime import datetime
+import json
+import logging
+import sys
+
+from ConnectionManager import MAINTENANCE
+from RenderCache import local_zone as cached_local_zone
+from WalletTypes import WalletTransactionState, WalletTransferType
+
+# Get Logger made in start.py
+export_logger = logging.getLogger('trtl_log.export')
+
+# Number of blocks requested from walletd per getTransactions call
+EXPORT_BLOCK_WINDOW = 10000
+# Number of rows buffered before being written as one Parquet row group
+PARQUET_BATCH_SIZE = 10000
+# Blocks a transaction needs on top of it before it counts as confirmed, as shown in the transactions view
+CONFIRMATION_BLOCKS = 40
+
+EXPORT_FORMATS = ('csv', 'jsonl', 'parquet')
+EXPORT_ROW_TYPES = ('transactions', 'transfers')
+
+TRANSACTION_FIELDS = [
+    'transactionHash', 'blockIndex', 'timestamp', 'localTime', 'amount', 'amountTRTL',
+    'fee', 'feeTRTL', 'paymentId', 'state', 'unlockTime', 'confirmed'
+]
+TRANSFER_FIELDS = [
+    'transactionHash', 'blockIndex', 'timestamp', 'localTime', 'transferIndex', 'transferType', 'address',
+    'amount', 'amountTRTL', 'fee', 'feeTRTL', 'paymentId', 'state', 'unlockTime', 'confirmed'
+]
+
+
+def format_trtl(amount):
+    """
+    Formats an amount in atomic units as TRTL without going through a float, so no precision is lost
+    :return: string such as '-1234.05'
+    """
+    sign = '-' if amount < 0 else ''
+    return "{}{}.{:02d}".format(sign, abs(amount) // 100, abs(amount) % 100)
+
+
+def guess_format(path):
+    """
+    :return: the export format matching the file extension of path, defaulting to csv
+    """
+    lower_path = path.lower()
+    if lower_path.endswith('.jsonl') or lower_path.endswith('.json'):
+        return 'jsonl'
+    if lower_path.endswith('.parquet'):
+        return 'parquet'
+    return 'csv'
+
+
+def iter_wallet_blocks(wallet_connection, addresses, block_count, first_block_index=1, window=EXPORT_BLOCK_WINDOW,
+                       progress=None, cancelled=None, priority=MAINTENANCE):
+    """
+    Streams the blocks containing the wallet's transactions from walletd, one window of blocks at a time,
+    so more urgent requests can be made between windows
+    :param wallet_connection: WalletConnection to request the transactions from
+    :param addresses: the wallet addresses to export
+    :param block_count: the wallet's current block count
+    :param first_block_index: first block to export
+    :param window: number of blocks requested per call
+    :param progress: optional callable taking (blocks done, blocks total)
+    :param cancelled: optional callable, no further windows are requested once it returns True
+    :param priority: priority class of the requests
+    """
+    total = max(block_count - first_block_index, 0)
+    index = first_block_index
+    while index < block_count and not (cancelled and cancelled()):
+        count = min(window, block_count - index)
+        blocks = wallet_connection.request("getTransactions", params={
+            "firstBlockIndex": index,
+            "blockCount": count,
+            "addresses": addresses}, priority=priority)['items']
+        for block in blocks:
+            yield block
+        index += count
+        if progress:
+            progress(index - first_block_index, total)
+
+
+def iter_cached_blocks(blocks, progress=None, progress_interval=1000):
+    """
+    Streams blocks already held in memory, such as those in the current wallet snapshot
+    :param blocks: list of blocks from a getTransactions response
+    :param progress: optional callable taking (blocks done, blocks total)
+    """
+    total = len(blocks)
+    for done, block in enumerate(blocks, 1):
+        yield block
+        if progress and (done % progress_interval == 0 or done == total):
+            progress(done, total)
+
+
+def transaction_rows(blocks, block_count):
+    """
+    Turns blocks into one export row per transaction
+    :param blocks: iterable of blocks from getTransactions
+    :param block_count: the wallet's current block count, used for the confirmation state
+    """
+    local_zone = cached_local_zone.get()
+    for block in blocks:
+        for transaction in block['transactions']:
+            yield build_transaction_row(transaction, block_count, local_zone)
+
+
+def transfer_rows(blocks, block_count):
+    """
+    Turns blocks into one export row per transfer within each transaction
+    :param blocks: iterable of blocks from getTransactions
+    :param block_count: the wallet's current block count, used for the confirmation state
+    """
+    local_zone = cached_local_zone.get()
+    for block in blocks:
+        for transaction in block['transactions']:
+            base_row = build_transaction_row(transaction, block_count, local_zone)
+            for transfer_index, transfer in enumerate(transaction['transfers']):
+                row = dict(base_row)
+                row['transferIndex'] = transfer_index
+                row['transferType'] = WalletTransferType(transfer['type']).name
+                row['address'] = transfer['address']
+                row['amount'] = transfer['amount']
+                row['amountTRTL'] = format_trtl(transfer['amount'])
+                yield row
+
+
+def build_transaction_row(transaction, block_count, local_zone):
+    """
+    :return: dict of the export fields of a single transaction
+    """
+    unlock_time = transaction['unlockTime']
+    return {
+        'transactionHash': transaction['transactionHash'],
+        'blockIndex': transaction['blockIndex'],
+        'timestamp': transaction['timestamp'],
+        'localTime': datetime.fromtimestamp(transaction['timestamp'], local_zone).strftime("%Y-%m-%d %H:%M:%S%z"),
+        'amount': transaction['amount'],
+        'amountTRTL': format_trtl(transaction['amount']),
+        'fee': transaction['fee'],
+        'feeTRTL': format_trtl(transaction['fee']),
+        'paymentId': transaction['paymentId'],
+        'state': WalletTransactionState(transaction['state']).name,
+        'unlockTime': unlock_time,
+        'confirmed': unlock_time == 0 or unlock_time <= block_count - CONFIRMATION_BLOCKS
+    }
+
+
+class CSVExportWriter(object):
+    """Writes export rows to a CSV file with a header row"""
+    def __init__(self, path, fields):
+        if sys.version_info[0] < 3:
+            self._file = open(path, 'wb')
+        else:
+            self._file = open(path, 'w', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=fields)
+        self._writer.writeheader()
+
+    def write(self, row):
+        self._writer.writerow(row)
+
+    def close(self):
+        self._file.close()
+
+
+class JSONLinesExportWriter(object):
+    """Writes export rows to a file as one JSON object per line"""
+    def __init__(self, path, fields):
+        self.fields = fields
+        self._file = open(path, 'w')
+
+    def write(self, row):
+        self._file.write(json.dumps(dict((field, row[field]) for field in self.fields)))
+        self._file.write("\n")
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetExportWriter(object):
+    """
+    Writes export rows to a Parquet file, one row group per batch of rows.
+    Requires pyarrow, which is optional.
+    """
+    def __init__(self, path, fields, batch_size=PARQUET_BATCH_SIZE):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError("Exporting to Parquet requires the pyarrow package to be installed")
+        self._pyarrow = pyarrow
+        column_types = {
+            'blockIndex': pyarrow.int64(), 'timestamp': pyarrow.int64(), 'amount': pyarrow.int64(),
+            'fee': pyarrow.int64(), 'unlockTime': pyarrow.int64(), 'transferIndex': pyarrow.int32(),
+            'confirmed': pyarrow.bool_()
+        }
+        self.fields = fields
+        self.batch_size = batch_size
+        self.schema = pyarrow.schema([(field, column_types.get(field, pyarrow.string())) for field in fields])
+        self._writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        self._columns = dict((field, []) for field in fields)
+        self._buffered = 0
+
+    def write(self, row):
+        for field in self.fields:
+            self._columns[field].append(row[field])
+        self._buffered += 1
+        if self._buffered >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered rows as a row group"""
+        if not self._buffered:
+            return
+        arrays = [self._pyarrow.array(self._columns[field], type=self.schema.field(field).type) for field in self.fields]
+        self._writer.write_table(self._pyarrow.Table.from_arrays(arrays, schema=self.schema))
+        self._columns = dict((field, []) for field in self.fields)
+        self._buffered = 0
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+
+EXPORT_WRITERS = {
+    'csv': CSVExportWriter,
+    'jsonl': JSONLinesExportWriter,
+    'parquet': ParquetExportWriter
+}
+
+
+def export_transactions(path, blocks, block_count, export_format='csv', row_type='transactions', cancelled=None):
+    """
+    Writes the transactions in blocks to a file
+    :param path: file to write
+    :param blocks: iterable of blocks, from iter_wallet_blocks or iter_cached_blocks
+    :param block_count: the wallet's current block count, used for the confirmation state
+    :param export_format: one of EXPORT_FORMATS
+    :param row_type: 'transactions' for a row per transaction, 'transfers' for a row per transfer
+    :param cancelled: optional callable, the export stops early when it returns True
+    :return: the number of rows written
+    """
+    if export_format not in EXPORT_WRITERS:
+        raise ValueError("Unknown export format {}".format(export_format))
+    if row_type == 'transactions':
+        fields, rows = TRANSACTION_FIELDS, transaction_rows(blocks, block_count)
+    elif row_type == 'transfers':
+        fields, rows = TRANSFER_FIELDS, transfer_rows(blocks, block_count)
+    else:
+        raise ValueError("Unknown export row type {}".format(row_type))
+
+    writer = EXPORT_WRITERS[export_format](path, fields)
+    row_count = 0
+    try:
+        for row in rows:
+            writer.write(row)
+            row_count += 1
+            if cancelled and row_count % 1000 == 0 and cancelled():
+                export_logger.info("Export to {} cancelled after {} rows".format(path, row_count))
+                break
+    finally:
+        writer.close()
+    export_logger.info("Exported {} {} rows to {}".format(row_count, row_type, path))
+    return row_count
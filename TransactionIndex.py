@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+""" TransactionIndex.py
+
+This file represents the search index behind the transactions view's
+filter bar. Sorted keys are kept for the amount and timestamp so range
+filters are answered with bisect, a sorted list of hashes answers hash
+prefix searches, and sets hold the direction and confirmation state.
+The index is updated incrementally from each published snapshot, and
+also holds pending transactions from the unconfirmed pool until they
+are mined or dropped.
+"""
+
+from bisect import bisect_left, bisect_right, insort
+import logging
+
+# Get Logger made in start.py
+index_logger = logging.getLogger('trtl_log.index')
+
+# Blocks a transaction needs on top of it before it counts as confirmed, as shown in the transactions view
+CONFIRMATION_BLOCKS = 40
+# Number of new transactions above which the sorted keys are rebuilt rather than inserted into
+BULK_INSERT_THRESHOLD = 1000
+# Block index walletd gives transactions that haven't been mined yet
+PENDING_BLOCK_INDEX = 2 ** 32 - 1
+
+
+def is_confirmed(transaction, block_count):
+    """
+    Block rewards take 40 blocks to confirm, transactions between wallets
+    are marked as confirmed automatically with unlock time 0
+    :return: True if the transaction counts as confirmed at the given block count
+    """
+    unlock_time = transaction['unlockTime']
+    return unlock_time == 0 or unlock_time <= block_count - CONFIRMATION_BLOCKS
+
+
+class TransactionIndex(object):
+    """
+    This class indexes the wallet's transactions for fast filtering.
+    Amounts are indexed as absolute atomic units, since the direction is filtered separately.
+    """
+    def __init__(self):
+        self._records = {}  # hash -> (order key, absolute amount, timestamp, direction, unlock time)
+        self._order = []  # sorted (blockIndex, position in block, hash), oldest first
+        self._by_amount = []  # sorted (absolute amount, hash)
+        self._by_timestamp = []  # sorted (timestamp, hash)
+        self._hashes = []  # sorted hashes
+        self._direction = {'In': set(), 'Out': set()}
+        self._confirmed = set()
+        self._unconfirmed = set()
+        self._pending = set()
+        self._pending_count = 0
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, transaction_hash):
+        return transaction_hash in self._records
+
+    def is_confirmed(self, transaction_hash):
+        return transaction_hash in self._confirmed
+
+    def is_pending(self, transaction_hash):
+        return transaction_hash in self._pending
+
+    def add_pending(self, transaction):
+        """
+        Indexes a transaction from the unconfirmed pool, as unconfirmed and newer than every mined one
+        :param transaction: a transaction from getTransaction
+        :return: True if the transaction wasn't already indexed
+        """
+        transaction_hash = transaction['transactionHash']
+        if transaction_hash in self._records:
+            return False
+        self._pending_count += 1
+        self._add(transaction, (PENDING_BLOCK_INDEX, self._pending_count), False)
+        self._pending.add(transaction_hash)
+        self._insert_keys([transaction_hash])
+        return True
+
+    def drop_pending(self, transaction_hash):
+        """
+        Removes a pending transaction that has left the unconfirmed pool without being mined
+        :return: True if the transaction was pending
+        """
+        if transaction_hash not in self._pending:
+            return False
+        self._remove(transaction_hash)
+        return True
+
+    def update(self, blocks, block_count, retain_from=None):
+        """
+        Brings the index in line with a getTransactions block list
+        :param blocks: the blocks from the latest snapshot
+        :param block_count: the wallet's block count, used for the confirmation state
+        :param retain_from: transactions at or above this block index are kept even if missing from blocks,
+            e.g. while walletd is rescanning and hasn't reached them yet
+        :return: tuple of (added transactions oldest first, removed hashes, hashes that have become confirmed,
+            pending transactions that have been mined)
+        """
+        # Only unconfirmed transactions can change state as the chain grows, pending ones once they are mined
+        confirmed = []
+        for transaction_hash in list(self._unconfirmed - self._pending):
+            unlock_time = self._records[transaction_hash][4]
+            if unlock_time == 0 or unlock_time <= block_count - CONFIRMATION_BLOCKS:
+                self._unconfirmed.discard(transaction_hash)
+                self._confirmed.add(transaction_hash)
+                confirmed.append(transaction_hash)
+
+        added = []
+        mined = []
+        seen = set()
+        for block in blocks:
+            for position, transaction in enumerate(block['transactions']):
+                transaction_hash = transaction['transactionHash']
+                seen.add(transaction_hash)
+                if transaction_hash in self._pending:
+                    # Re-index a pending transaction under the block it was mined in
+                    self._remove(transaction_hash)
+                    mined.append(transaction)
+                if transaction_hash not in self._records:
+                    self._add(transaction, (transaction['blockIndex'], position), is_confirmed(transaction, block_count))
+                    added.append(transaction)
+        self._insert_keys([transaction['transactionHash'] for transaction in added])
+        if mined:
+            mined_hashes = set(transaction['transactionHash'] for transaction in mined)
+            added = [transaction for transaction in added if transaction['transactionHash'] not in mined_hashes]
+
+        # Remove any transactions that are no longer valid
+        # e.g. in case the daemon has accidentally forked and listed some transactions that are invalid
+        # Pending transactions aren't in any block yet, they are dropped with drop_pending
+        removed = [transaction_hash for transaction_hash, record in self._records.items()
+                   if transaction_hash not in seen and transaction_hash not in self._pending
+                   and (retain_from is None or record[0][0] < retain_from)]
+        for transaction_hash in removed:
+            self._remove(transaction_hash)
+
+        if added or removed or mined:
+            index_logger.debug("Indexed {} new, {} mined and dropped {} transactions, {} in total".format(
+                len(added), len(mined), len(removed), len(self._records)))
+        return added, removed, [transaction_hash for transaction_hash in confirmed if transaction_hash in self._records], mined
+
+    def _add(self, transaction, order_key, confirmed):
+        transaction_hash = transaction['transactionHash']
+        amount = abs(transaction['amount'])
+        timestamp = transaction['timestamp']
+        direction = "In" if transaction['amount'] > 0 else "Out"
+        self._records[transaction_hash] = (order_key, amount, timestamp, direction, transaction['unlockTime'])
+        self._direction[direction].add(transaction_hash)
+        (self._confirmed if confirmed else self._unconfirmed).add(transaction_hash)
+
+    def _insert_keys(self, transaction_hashes):
+        """Adds the sorted keys of newly recorded transactions"""
+        keys = [(self._order, lambda r, h: r[0] + (h,)),
+                (self._by_amount, lambda r, h: (r[1], h)),
+                (self._by_timestamp, lambda r, h: (r[2], h)),
+                (self._hashes, lambda r, h: h)]
+        if len(transaction_hashes) > BULK_INSERT_THRESHOLD:
+            # Appending and sorting once is much cheaper than inserting a large batch one at a time
+            for sorted_list, make_key in keys:
+                sorted_list.extend(make_key(self._records[h], h) for h in transaction_hashes)
+                sorted_list.sort()
+        else:
+            for sorted_list, make_key in keys:
+                for h in transaction_hashes:
+                    insort(sorted_list, make_key(self._records[h], h))
+
+    def _remove(self, transaction_hash):
+        order_key, amount, timestamp, direction, unlock_time = self._records.pop(transaction_hash)
+        for sorted_list, key in ((self._order, order_key + (transaction_hash,)),
+                                 (self._by_amount, (amount, transaction_hash)),
+                                 (self._by_timestamp, (timestamp, transaction_hash)),
+                                 (self._hashes, transaction_hash)):
+            position = bisect_left(sorted_list, key)
+            if position < len(sorted_list) and sorted_list[position] == key:
+                del sorted_list[position]
+        self._direction[direction].discard(transaction_hash)
+        self._confirmed.discard(transaction_hash)
+        self._unconfirmed.discard(transaction_hash)
+        self._pending.discard(transaction_hash)
+
+    def _range(self, sorted_list, low, high):
+        """
+        :return: set of the hashes whose key lies between low and high inclusive, either bound may be None
+        """
+        start = 0 if low is None else bisect_left(sorted_list, (low,))
+        # (high + 1,) sorts after every (high, hash) pair for whole number keys
+        end = len(sorted_list) if high is None else bisect_right(sorted_list, (high + 1,))
+        return set(transaction_hash for key, transaction_hash in sorted_list[start:end])
+
+    def _prefix(self, prefix):
+        """
+        :return: set of the hashes starting with prefix
+        """
+        start = bisect_left(self._hashes, prefix)
+        end = bisect_left(self._hashes, prefix + u'\uffff')
+        return set(self._hashes[start:end])
+
+    def query(self, hash_prefix=None, direction=None, min_amount=None, max_amount=None,
+              start_time=None, end_time=None, confirmed=None):
+        """
+        Finds the transactions matching every given filter. Filters left as None are not applied.
+        :param hash_prefix: start of the transaction hash, case insensitive
+        :param direction: 'In' or 'Out'
+        :param min_amount: smallest absolute amount in atomic units
+        :param max_amount: largest absolute amount in atomic units
+        :param start_time: earliest timestamp, inclusive
+        :param end_time: latest timestamp, inclusive
+        :param confirmed: True for confirmed transactions only, False for unconfirmed only
+        :return: list of matching hashes, newest first as in the transactions view
+        """
+        candidates = []
+        if hash_prefix:
+            candidates.append(self._prefix(hash_prefix.lower()))
+        if direction:
+            candidates.append(self._direction[direction])
+        if min_amount is not None or max_amount is not None:
+            candidates.append(self._range(self._by_amount, min_amount, max_amount))
+        if start_time is not None or end_time is not None:
+            candidates.append(self._range(self._by_timestamp, start_time, end_time))
+        if confirmed is not None:
+            candidates.append(self._confirmed if confirmed else self._unconfirmed)
+
+        if not candidates:
+            return [key[2] for key in reversed(self._order)]
+
+        # Intersect starting from the smallest set so the work is bounded by the most selective filter
+        candidates.sort(key=len)
+        matches = set(candidates[0])
+        for candidate in candidates[1:]:
+            if not matches:
+                break
+            matches.intersection_update(candidate)
+
+        if len(matches) * 8 < len(self._order):
+            return sorted(matches, key=lambda transaction_hash: self._records[transaction_hash][0], reverse=True)
+        return [key[2] for key in reversed(self._order) if key[2] in matches]
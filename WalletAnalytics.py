@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+""" WalletAnalytics.py
+
+This file represents the wallet's analytics: balance over time, daily
+and monthly inflow and outflow, and fee totals. Transactions are loaded
+into NumPy arrays once and every figure is worked out with vectorised
+operations, so the analytics stay quick for wallets with millions of
+transactions. The recomputed balance is also reconciled against the one
+walletd reports.
+"""
+
+from datetime import datetime
+import logging
+import numpy as np
+
+from RenderCache import local_zone
+from WalletTypes import WalletTransactionState
+
+# Get Logger made in start.py
+analytics_logger = logging.getLogger('trtl_log.analytics')
+
+# Number of points a chart series is reduced to by default
+CHART_POINTS = 500
+
+
+class WalletAnalytics(object):
+    """
+    This class holds the amounts, fees and timestamps of the wallet's successful transactions,
+    sorted by time, and works out the analytics from them. Amounts are in atomic units.
+    """
+    def __init__(self, timestamps, amounts, fees):
+        """
+        :param timestamps: array of transaction timestamps
+        :param amounts: array of the change each transaction made to the balance
+        :param fees: array of transaction fees
+        """
+        order = np.argsort(timestamps, kind='mergesort')
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)[order]
+        self.amounts = np.asarray(amounts, dtype=np.int64)[order]
+        self.fees = np.asarray(fees, dtype=np.int64)[order]
+
+    @classmethod
+    def from_blocks(cls, blocks):
+        """
+        Loads the successful transactions from a getTransactions block list
+        :param blocks: the blocks from a wallet snapshot
+        :return: WalletAnalytics
+        """
+        transactions = [transaction for block in blocks for transaction in block['transactions']
+                        if transaction['state'] == WalletTransactionState.succeeded]
+        count = len(transactions)
+        return cls(np.fromiter((t['timestamp'] for t in transactions), dtype=np.int64, count=count),
+                   np.fromiter((t['amount'] for t in transactions), dtype=np.int64, count=count),
+                   np.fromiter((t['fee'] for t in transactions), dtype=np.int64, count=count))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def balance_series(self):
+        """
+        :return: tuple of (timestamps, balance after each transaction)
+        """
+        return self.timestamps, np.cumsum(self.amounts)
+
+    def totals(self):
+        """
+        :return: dict of the total inflow, outflow and fees paid, in atomic units
+        """
+        incoming = self.amounts > 0
+        return {
+            'transactions': len(self.amounts),
+            'inflow': int(self.amounts[incoming].sum()),
+            'outflow': int(-self.amounts[~incoming].sum()),
+            'fees': int(self.fees[~incoming].sum()),
+            'balance': int(self.amounts.sum())
+        }
+
+    def local_days(self):
+        """
+        Works out the local calendar day of every transaction. The zone's UTC offset is looked up
+        at both ends of each distinct UTC day rather than once per transaction, and only on days
+        when the clocks change is it looked up for each of that day's transactions.
+        :return: array of datetime64[D] local dates
+        """
+        if not len(self.timestamps):
+            return np.array([], dtype='datetime64[D]')
+        tz = local_zone.get()
+        utc_days, inverse = np.unique(self.timestamps // 86400, return_inverse=True)
+        start_offsets = np.array([self._utc_offset(int(day) * 86400, tz) for day in utc_days], dtype=np.int64)
+        end_offsets = np.array([self._utc_offset(int(day) * 86400 + 86399, tz) for day in utc_days], dtype=np.int64)
+        offsets = start_offsets[inverse]
+        for index in np.flatnonzero((start_offsets != end_offsets)[inverse]):
+            offsets[index] = self._utc_offset(int(self.timestamps[index]), tz)
+        return ((self.timestamps + offsets) // 86400).astype('datetime64[D]')
+
+    @staticmethod
+    def _utc_offset(timestamp, tz):
+        """
+        :return: the zone's UTC offset in seconds at the given time
+        """
+        offset = datetime.fromtimestamp(timestamp, tz).utcoffset()
+        return offset.days * 86400 + offset.seconds
+
+    def grouped(self, period='day'):
+        """
+        Totals the transactions per local day or month
+        :param period: 'day' or 'month'
+        :return: dict of arrays: 'period' (datetime64), 'inflow', 'outflow', 'fees', 'transactions' and
+            'balance' (at the end of the period), one element per period with transactions
+        """
+        if period not in ('day', 'month'):
+            raise ValueError("Unknown period {}".format(period))
+        keys = self.local_days()
+        if period == 'month':
+            keys = keys.astype('datetime64[M]')
+        if not len(keys):
+            empty = np.array([], dtype=np.int64)
+            return {'period': keys, 'inflow': empty, 'outflow': empty, 'fees': empty,
+                    'transactions': empty, 'balance': empty}
+
+        # The transactions are sorted by time, so each period is a contiguous run
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        incoming = self.amounts > 0
+        return {
+            'period': keys[starts],
+            'inflow': np.add.reduceat(np.where(incoming, self.amounts, 0), starts),
+            'outflow': -np.add.reduceat(np.where(incoming, 0, self.amounts), starts),
+            'fees': np.add.reduceat(np.where(incoming, 0, self.fees), starts),
+            'transactions': np.diff(np.append(starts, len(keys))),
+            'balance': np.cumsum(self.amounts)[np.append(starts[1:], len(keys)) - 1]
+        }
+
+    def downsample(self, points=CHART_POINTS):
+        """
+        Reduces the balance series to at most the given number of buckets of equal time span for charting.
+        Each bucket keeps its lowest, highest and closing balance, so spikes aren't lost.
+        :return: dict of arrays: 'timestamp' (end of each bucket), 'low', 'high', 'close'
+        """
+        timestamps, balances = self.balance_series()
+        if len(timestamps) <= points:
+            return {'timestamp': timestamps, 'low': balances, 'high': balances, 'close': balances}
+        edges = np.linspace(timestamps[0], timestamps[-1], points + 1)[1:-1]
+        starts = np.concatenate(([0], np.searchsorted(timestamps, edges, side='right')))
+        starts = np.unique(starts[starts < len(timestamps)])
+        ends = np.append(starts[1:], len(timestamps)) - 1
+        return {
+            'timestamp': timestamps[ends],
+            'low': np.minimum.reduceat(balances, starts),
+            'high': np.maximum.reduceat(balances, starts),
+            'close': balances[ends]
+        }
+
+    def reconcile(self, balances):
+        """
+        Compares the balance recomputed from the transactions with the one walletd reports
+        :param balances: getBalance response
+        :return: dict with the 'recomputed' and 'reported' balance, their 'difference', and 'matches'
+        """
+        recomputed = int(self.amounts.sum())
+        reported = balances['availableBalance'] + balances['lockedAmount']
+        result = {
+            'recomputed': recomputed,
+            'reported': reported,
+            'difference': recomputed - reported,
+            'matches': recomputed == reported
+        }
+        if not result['matches']:
+            analytics_logger.warning("Balance recomputed from {} transactions is {:,.2f}, walletd reports {:,.2f}".format(
+                len(self), recomputed / 100., reported / 100.))
+        return result
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+""" WalletSnapshot.py
+
+This file holds the wallet data shared between the thread that polls
+walletd and the GTK thread that renders it. The poll thread builds a
+complete snapshot and publishes it in one go, so readers never see a
+mix of old and new values.
+"""
+
+from collections import namedtuple
+import itertools
+import threading
+import time
+import logging
+
+# Get Logger made in start.py
+snapshot_logger = logging.getLogger('trtl_log.snapshot')
+
+# A complete view of the wallet at one point in time.
+# The values are the decoded walletd responses and must be treated as read-only once published.
+WalletSnapshot = namedtuple('WalletSnapshot', [
+    'sequence',  # Increases by one with every published snapshot
+    'timestamp',  # Time the snapshot was published
+    'balances',  # getBalance response
+    'addresses',  # getAddresses 'addresses' list
+    'status',  # getStatus response
+    'blocks',  # getTransactions 'items' list
+    'current_price',  # coingecko 'current_price' dict
+    'known_block_count_dropped',  # True if the known block count went down since the previous poll
+    'sync_progress'  # SyncTracker.progress() at the time of the poll
+])
+
+
+class WalletSnapshotHolder(object):
+    """
+    Holds the most recently published WalletSnapshot.
+    Publishing swaps a single reference, which is atomic, so readers only ever need
+    to grab `current` once and work from that for a consistent view.
+    """
+    def __init__(self):
+        self._sequence = itertools.count(1)
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self.current = WalletSnapshot(0, 0, {}, [], {}, [], {}, False, {})
+
+    def subscribe(self, callback):
+        """
+        Registers a callback to be called with every newly published snapshot.
+        Callbacks run on the publishing thread, so GTK work must be passed on with GLib.idle_add.
+        """
+        self._subscribers.append(callback)
+
+    def publish(self, balances, addresses, status, blocks, current_price, known_block_count_dropped=False, sync_progress=None):
+        """
+        Builds a snapshot from a complete set of wallet data and makes it the current one
+        :return: the published WalletSnapshot
+        """
+        with self._lock:
+            snapshot = WalletSnapshot(next(self._sequence), time.time(), balances, addresses, status, blocks,
+                                      current_price, known_block_count_dropped, sync_progress or {})
+            self.current = snapshot
+        for callback in self._subscribers:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                snapshot_logger.error("Snapshot subscriber failed: {}".format(e))
+        return snapshot
+
+    def clear(self):
+        """Publishes an empty snapshot, e.g. after the wallet has been reset"""
+        return self.publish({}, [], {}, [], self.current.current_price)
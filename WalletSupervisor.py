@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+""" WalletSupervisor.py
+
+This file represents the supervisor that keeps walletd healthy while the
+wallet is open. It checks the daemon process and its RPC server, detects
+a crashed or hung daemon, and restarts it with backoff, giving up if the
+daemon keeps crashing.
+"""
+
+import threading
+import time
+import logging
+import psutil
+from requests.exceptions import RequestException
+import Metrics
+
+# Get Logger made in start.py
+supervisor_logger = logging.getLogger('trtl_log.supervisor')
+
+
+class WalletSupervisor(object):
+    """
+    This class monitors a WalletConnection on a background thread and recovers its wallet daemon
+    """
+    def __init__(self, wallet_connection, on_give_up=None,
+                 check_interval=5, ping_timeout=10, max_ping_failures=3,
+                 hung_latency=5, max_slow_pings=3,
+                 backoff_initial=2, backoff_max=60,
+                 crash_loop_restarts=3, crash_loop_window=600,
+                 startup_timeout=300):
+        """
+        :param wallet_connection: the WalletConnection to supervise
+        :param on_give_up: called (from the supervisor thread) with the reason when the daemon can't be recovered
+        :param check_interval: seconds between health checks
+        :param ping_timeout: seconds to wait for the RPC ping
+        :param max_ping_failures: consecutive failed pings before the daemon is restarted
+        :param hung_latency: a ping slower than this many seconds counts as slow
+        :param max_slow_pings: consecutive slow pings before the daemon is considered hung
+        :param backoff_initial: seconds to wait before the first restart, doubled for every consecutive restart
+        :param backoff_max: maximum seconds to wait before a restart
+        :param crash_loop_restarts: maximum restarts allowed within crash_loop_window
+        :param crash_loop_window: seconds over which restarts are counted
+        :param startup_timeout: seconds to wait for a restarted daemon to answer RPC requests
+        """
+        self.wallet_connection = wallet_connection
+        self.on_give_up = on_give_up
+        self.check_interval = check_interval
+        self.ping_timeout = ping_timeout
+        self.max_ping_failures = max_ping_failures
+        self.hung_latency = hung_latency
+        self.max_slow_pings = max_slow_pings
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.crash_loop_restarts = crash_loop_restarts
+        self.crash_loop_window = crash_loop_window
+        self.startup_timeout = startup_timeout
+
+        self.ping_failures = 0
+        self.slow_pings = 0
+        self.restart_times = []
+        self.consecutive_restarts = 0
+        self.gave_up = False
+        self._restart_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts supervising on a background thread"""
+        self._thread = threading.Thread(target=self.supervise_loop, name="WalletSupervisor")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stops supervising, waiting up to timeout seconds for the thread to finish"""
+        self._stop_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def supervise_loop(self):
+        """Runs a health check every check_interval seconds until stopped"""
+        while not self._stop_event.wait(self.check_interval):
+            try:
+                self.check_health()
+            except Exception as e:
+                supervisor_logger.error("Wallet daemon health check failed: {}".format(e))
+
+    def check_health(self):
+        """
+        Checks the daemon process is alive and its RPC server answers in good time,
+        restarting the daemon when it is not
+        """
+        walletd = self.wallet_connection.walletd
+        exit_code = walletd.poll()
+        if exit_code is not None:
+            self.recover("wallet daemon exited with code {}".format(exit_code))
+            return
+        try:
+            if psutil.Process(walletd.pid).status() == psutil.STATUS_ZOMBIE:
+                self.recover("wallet daemon is a zombie process")
+                return
+        except psutil.NoSuchProcess:
+            self.recover("wallet daemon process has disappeared")
+            return
+
+        start_time = time.time()
+        try:
+            self.wallet_connection.request("getStatus", timeout=self.ping_timeout, cached=False)
+        except (RequestException, ValueError) as e:
+            self.ping_failures += 1
+            supervisor_logger.warning("Wallet daemon ping failed ({}/{}): {}".format(self.ping_failures, self.max_ping_failures, e))
+            if self.ping_failures >= self.max_ping_failures:
+                self.recover("wallet daemon is not responding")
+            return
+        latency = time.time() - start_time
+        Metrics.record('walletd.ping_seconds', latency)
+        self.ping_failures = 0
+
+        if latency > self.hung_latency:
+            self.slow_pings += 1
+            supervisor_logger.warning("Wallet daemon took {:.1f}s to answer ({}/{})".format(latency, self.slow_pings, self.max_slow_pings))
+            if self.slow_pings >= self.max_slow_pings:
+                self.recover("wallet daemon appears to be hung")
+        else:
+            self.slow_pings = 0
+            self.consecutive_restarts = 0
+
+    def restart(self, reason):
+        """
+        Restarts the daemon on purpose (e.g. to apply new settings), saving the wallet first
+        :return: True if the daemon was restarted and is answering requests
+        """
+        return self.recover(reason, planned=True)
+
+    def recover(self, reason, planned=False):
+        """
+        Restarts the daemon and rebinds the connection, unless it has been restarted too often recently
+        :param reason: why the daemon is being restarted, for the log
+        :param planned: True if the daemon is healthy and being restarted on purpose
+        :return: True if the daemon was restarted and is answering requests
+        """
+        with self._restart_lock:
+            outage_start = time.time()
+            now = outage_start
+            self.restart_times = [t for t in self.restart_times if now - t < self.crash_loop_window]
+            if not planned and len(self.restart_times) >= self.crash_loop_restarts:
+                self.give_up("{} (restarted {} times in the last {} seconds)".format(
+                    reason, len(self.restart_times), self.crash_loop_window))
+                return False
+
+            if not planned:
+                # Back off exponentially while the daemon keeps failing
+                delay = min(self.backoff_initial * (2 ** self.consecutive_restarts), self.backoff_max)
+                self.consecutive_restarts += 1
+                supervisor_logger.warning("Restarting wallet daemon in {}s: {}".format(delay, reason))
+                if self._stop_event.wait(delay):
+                    return False
+                self.restart_times.append(time.time())
+            else:
+                supervisor_logger.info("Restarting wallet daemon: {}".format(reason))
+
+            try:
+                self.wallet_connection.restart_wallet_daemon(save=planned)
+            except ValueError as e:
+                supervisor_logger.error("Failed to restart wallet daemon: {}".format(e))
+                Metrics.increment('walletd.failed_restarts')
+                return False
+
+            if not self.wait_until_ready():
+                supervisor_logger.error("Restarted wallet daemon did not answer within {} seconds".format(self.startup_timeout))
+                Metrics.increment('walletd.failed_restarts')
+                return False
+
+            recovery_time = time.time() - outage_start
+            self.ping_failures = 0
+            self.slow_pings = 0
+            Metrics.record('walletd.recovery_seconds', recovery_time)
+            Metrics.increment('walletd.restarts')
+            supervisor_logger.info("Wallet daemon recovered in {:.1f}s".format(recovery_time))
+            return True
+
+    def wait_until_ready(self):
+        """
+        Waits for the restarted daemon's RPC server to answer
+        :return: True once it answers, False if it exits or doesn't answer in time
+        """
+        deadline = time.time() + self.startup_timeout
+        while time.time() < deadline and not self._stop_event.is_set():
+            if self.wallet_connection.walletd.poll() is not None:
+                return False
+            try:
+                self.wallet_connection.request("getStatus", timeout=self.ping_timeout, cached=False)
+                return True
+            except (RequestException, ValueError):
+                self._stop_event.wait(1)
+        return False
+
+    def give_up(self, reason):
+        """Stops supervising and reports that the daemon could not be recovered"""
+        supervisor_logger.error("Giving up on the wallet daemon: {}".format(reason))
+        self.gave_up = True
+        self._stop_event.set()
+        if self.on_give_up:
+            self.on_give_up(reason)
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+""" WalletTypes.py
+
+This file stores the enumerations used by walletd in its responses.
+"""
+
+from enum import IntEnum
+
+
+class WalletTransactionState(IntEnum):
+    """Defines the possible states for a transaction."""
+    succeeded = 0,
+    failed = 1,
+    cancelled = 2,
+    created = 3,
+    deleted = 4
+
+
+class WalletTransferType(IntEnum):
+    """Defines the possible types of a transfer within a transaction."""
+    usual = 0,
+    donation = 1,
+    change = 2
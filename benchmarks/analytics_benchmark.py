@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+""" analytics_benchmark.py
+
+This file times WalletAnalytics on a synthetic wallet against a plain
+Python loop working out the same figures, and checks that the two agree.
+Dates are worked out in the local timezone, so set TZ to benchmark a
+zone whose clocks change, e.g.
+
+    TZ=America/Sao_Paulo python benchmarks/analytics_benchmark.py --transactions 1000000
+"""
+
+import argparse
+from collections import defaultdict
+from datetime import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from RenderCache import local_zone
+from WalletAnalytics import WalletAnalytics
+from WalletTypes import WalletTransactionState
+
+
+def make_blocks(count, seed):
+    """
+    :return: getTransactions-like block list of count transactions, one in a thousand of them failed
+    """
+    rng = random.Random(seed)
+    blocks = []
+    timestamp = 1500000000
+    for i in range(count):
+        timestamp += rng.randint(1, 120)
+        if rng.random() < 0.6:
+            amount = rng.randint(1, 10 ** 6)
+        else:
+            amount = -rng.randint(1, 10 ** 5)
+        state = WalletTransactionState.failed if i % 1000 == 999 else WalletTransactionState.succeeded
+        blocks.append({'transactions': [{'timestamp': timestamp, 'amount': amount, 'fee': 10, 'state': state}]})
+    return blocks
+
+
+def python_figures(blocks):
+    """
+    Works out the balance series and the daily and monthly totals one transaction at a time
+    :return: tuple of (balances, daily totals, monthly totals), totals as [inflow, outflow, fees, transactions]
+    """
+    tz = local_zone.get()
+    transactions = sorted((t for block in blocks for t in block['transactions']
+                           if t['state'] == WalletTransactionState.succeeded), key=lambda t: t['timestamp'])
+    balance = 0
+    balances = []
+    daily = defaultdict(lambda: [0, 0, 0, 0])
+    monthly = defaultdict(lambda: [0, 0, 0, 0])
+    for transaction in transactions:
+        balance += transaction['amount']
+        balances.append(balance)
+        date = datetime.fromtimestamp(transaction['timestamp'], tz).date()
+        for totals in (daily[date], monthly[(date.year, date.month)]):
+            if transaction['amount'] > 0:
+                totals[0] += transaction['amount']
+            else:
+                totals[1] -= transaction['amount']
+                totals[2] += transaction['fee']
+            totals[3] += 1
+    return balances, daily, monthly
+
+
+def check_figures(analytics, daily, monthly, balances):
+    """Raises AssertionError if the vectorised figures differ from the plain Python ones"""
+    assert int(analytics.balance_series()[1][-1]) == balances[-1]
+    for period, expected in (('day', daily), ('month', monthly)):
+        grouped = analytics.grouped(period)
+        assert len(grouped['period']) == len(expected), period
+        for i, key in enumerate(sorted(expected)):
+            found = [int(grouped[name][i]) for name in ('inflow', 'outflow', 'fees', 'transactions')]
+            assert found == expected[key], (period, key, found, expected[key])
+    downsampled = analytics.downsample()
+    assert int(downsampled['low'].min()) == min(balances) and int(downsampled['high'].max()) == max(balances)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the wallet analytics on a synthetic wallet")
+    parser.add_argument('--transactions', help='Number of transactions', type=int, default=1000000)
+    parser.add_argument('--seed', help='Random seed', type=int, default=3)
+    args = parser.parse_args()
+
+    blocks = make_blocks(args.transactions, args.seed)
+    print("{:,} transactions, timezone {}".format(args.transactions, local_zone.get()))
+
+    start_time = time.time()
+    analytics = WalletAnalytics.from_blocks(blocks)
+    print("Load into arrays:          {:.2f}s".format(time.time() - start_time))
+
+    start_time = time.time()
+    totals = analytics.totals()
+    analytics.balance_series()
+    analytics.grouped('day')
+    analytics.grouped('month')
+    analytics.downsample()
+    analytics.reconcile({'availableBalance': totals['balance'], 'lockedAmount': 0})
+    print("Analytics:                 {:.2f}s".format(time.time() - start_time))
+
+    start_time = time.time()
+    balances, daily, monthly = python_figures(blocks)
+    print("Plain Python equivalent:   {:.2f}s".format(time.time() - start_time))
+
+    check_figures(analytics, daily, monthly, balances)
+    print("Figures match")
+
+
+if __name__ == '__main__':
+    main()
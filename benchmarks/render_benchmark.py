@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+""" render_benchmark.py
+
+This file times formatting a synthetic wallet's transactions for the
+transactions view, the way rows were formatted before the render cache
+(looking up the local zone and calling strftime for every row) against
+TransactionRenderCache.render_many on a cold and on a warm cache, and
+checks that both give the same text. Dates are formatted in the local
+timezone, so set TZ to benchmark a zone whose clocks change, e.g.
+
+    TZ=Europe/London python benchmarks/render_benchmark.py --transactions 100000
+"""
+
+import argparse
+from datetime import datetime
+import os
+import random
+import sys
+import time
+
+import tzlocal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from RenderCache import TransactionRenderCache, DATE_FORMAT
+
+
+def make_transactions(count, seed):
+    """
+    :return: list of getTransactions-like transactions, spread over several years so clock changes are crossed
+    """
+    rng = random.Random(seed)
+    transactions = []
+    timestamp = 1500000000
+    for i in range(count):
+        timestamp += rng.randint(1, 2000)
+        if rng.random() < 0.6:
+            amount = rng.randint(1, 10 ** 6)
+        else:
+            amount = -rng.randint(1, 10 ** 5)
+        transactions.append({'transactionHash': "{:064x}".format(i), 'timestamp': timestamp, 'amount': amount})
+    return transactions
+
+
+def render_per_row(transactions):
+    """
+    Formats the transactions as the transactions view did before the render cache
+    :return: list of (direction, amount, date) tuples
+    """
+    return [("In" if transaction['amount'] > 0 else "Out",
+             "{:,.2f}".format(transaction['amount']/100.),
+             datetime.fromtimestamp(transaction['timestamp'], tzlocal.get_localzone()).strftime(DATE_FORMAT))
+            for transaction in transactions]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark formatting the transactions view's rows")
+    parser.add_argument('--transactions', help='Number of transactions', type=int, default=100000)
+    parser.add_argument('--seed', help='Random seed', type=int, default=3)
+    args = parser.parse_args()
+
+    transactions = make_transactions(args.transactions, args.seed)
+    print("{:,} transactions, timezone {}".format(args.transactions, tzlocal.get_localzone()))
+
+    start_time = time.time()
+    expected = render_per_row(transactions)
+    print("Per row get_localzone + strftime:  {:.2f}s".format(time.time() - start_time))
+
+    cache = TransactionRenderCache(max_entries=max(args.transactions, 1))
+    start_time = time.time()
+    cold = cache.render_many(transactions)
+    print("render_many, cold cache:           {:.2f}s".format(time.time() - start_time))
+
+    start_time = time.time()
+    warm = cache.render_many(transactions)
+    print("render_many, warm cache:           {:.2f}s".format(time.time() - start_time))
+
+    for rows in (cold, warm):
+        mismatches = [i for i, (row, expected_row) in enumerate(zip(rows, expected)) if row != expected_row]
+        assert not mismatches, "Row {} is {} rather than {}".format(mismatches[0], rows[mismatches[0]],
+                                                                    expected[mismatches[0]])
+    print("Rows match")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+""" cli.py
+
+This file provides a command line interface to a wallet whose daemon
+was left running by the GUI in detached mode.
+"""
+
+import argparse
+import getpass
+import logging
+import sys
+import time
+from logging.handlers import RotatingFileHandler
+
+import psutil
+from requests.exceptions import RequestException
+
+import global_variables
+from ConnectionManager import WalletConnection, get_daemon_secret_path, read_daemon_secret
+import TransactionExport
+from RestoreHeight import parse_restore_point
+from SyncTracker import SyncTracker
+import SendQueue
+import DelayedTransactions
+import AddressValidator
+
+# create logger for the command line interface, sharing the wallet's log file
+logger = logging.getLogger('trtl_log')
+logger.setLevel(logging.INFO)
+fh = RotatingFileHandler('trtl.log', maxBytes=20971520, backupCount=5)
+fh.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+logger.addHandler(fh)
+ch = logging.StreamHandler()
+ch.setLevel(logging.WARNING)
+ch.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+logger.addHandler(ch)
+cli_logger = logging.getLogger('trtl_log.cli')
+
+
+def get_wallet_file(args):
+    """
+    :return: the wallet given on the command line, or the GUI's default wallet
+    """
+    wallet_file = args.wallet or global_variables.wallet_config.get('walletPath')
+    if not wallet_file:
+        raise ValueError(global_variables.message_dict["NO_INFO"])
+    return wallet_file
+
+
+def get_password(args):
+    """
+    :return: the wallet password, read from the first line of stdin with --password-stdin, otherwise asked for
+    """
+    if args.password_stdin:
+        return sys.stdin.readline().rstrip('\r\n')
+    return getpass.getpass("Wallet password: ")
+
+
+def attach(args, verify_password=True):
+    """
+    Attaches to the wallet's running daemon
+    :param verify_password: ask for the wallet password and check it, False only to stop the daemon
+    :return: WalletConnection to the daemon
+    """
+    wallet_file = get_wallet_file(args)
+    password = get_password(args) if verify_password else None
+    global_variables.wallet_connection = WalletConnection(wallet_file, password=password, attach_only=True,
+                                                          verify_password=verify_password)
+    return global_variables.wallet_connection
+
+
+def command_status(args):
+    """Prints the status of the wallet daemon"""
+    connection = attach(args)
+    status = connection.request("getStatus")
+    balance = connection.request("getBalance")
+    print("Wallet daemon pid {}".format(connection.walletd.pid))
+    print("Block height {} / {}, peers {}".format(status['blockCount'], status['knownBlockCount'], status['peerCount']))
+    print("Available {:,.2f} TRTL, locked {:,.2f} TRTL".format(balance['availableBalance']/100., balance['lockedAmount']/100.))
+
+
+def command_stop(args):
+    """Saves the wallet and stops its detached daemon. Stopping reveals nothing, so needs no password."""
+    connection = attach(args, verify_password=False)
+    connection.stop_wallet_daemon(force=True)
+    print("Wallet daemon stopped")
+
+
+def command_export(args):
+    """Streams the wallet's transaction history from its daemon into a file"""
+    connection = attach(args)
+    addresses = connection.request("getAddresses")['addresses']
+    block_count = connection.request("getStatus")['blockCount']
+    export_format = args.format or TransactionExport.guess_format(args.output)
+
+    def show_progress(done, total):
+        sys.stderr.write("\rExporting... {:.0%}".format(float(done) / total if total else 1.0))
+        sys.stderr.flush()
+
+    blocks = TransactionExport.iter_wallet_blocks(connection, addresses, block_count, args.first_block,
+                                                  args.window, show_progress)
+    row_count = TransactionExport.export_transactions(args.output, blocks, block_count, export_format, args.rows)
+    sys.stderr.write("\n")
+    print("Exported {} {} rows to {}".format(row_count, args.rows, args.output))
+
+
+def command_rescan(args):
+    """Tells the wallet daemon to rescan from a height or date, optionally following its progress"""
+    scan_height = parse_restore_point(args.height or args.date or "")
+    connection = attach(args)
+    connection.rescan(scan_height)
+    print("Rescanning from block {}".format(scan_height or 0))
+    if not args.wait:
+        return
+
+    sync_tracker = SyncTracker()
+    while True:
+        status = connection.request("getStatus")
+        block_count, known_block_count = status['blockCount'], status['knownBlockCount']
+        sync_tracker.add_sample(block_count, known_block_count)
+        if known_block_count and block_count + 1 >= known_block_count:
+            break
+        scanned = max(block_count - (scan_height or 0), 0)
+        total = max(known_block_count - (scan_height or 0), 1)
+        sys.stderr.write("\rRescanning... {:.0%} [{} / {}] {}    ".format(
+            float(scanned) / total, block_count, known_block_count, sync_tracker.describe()))
+        sys.stderr.flush()
+        time.sleep(5)
+    sys.stderr.write("\n")
+    print("Rescan finished at block {}".format(block_count))
+
+
+def command_send(args):
+    """
+    Sends a transaction through the wallet's send queue. Running the command again with
+    the same --key reports the earlier result instead of sending again, first checking
+    whether a send walletd didn't answer went through.
+    """
+    address, payment_id = AddressValidator.split_integrated_address(args.address, args.payment_id)
+    amount = int(round(float(args.amount) * 100))
+    fee = int(round(float(args.fee) * 100))
+    if amount <= 0 or fee < 0:
+        raise ValueError(global_variables.message_dict["INVALID_AMOUNT"])
+    connection = attach(args)
+    send_queue = SendQueue.SendQueue(connection, SendQueue.get_send_queue_path(connection.wallet_file))
+    entry = send_queue.submit(SendQueue.make_send_params(address, amount, fee, args.mixin, payment_id),
+                              args.key)
+    if entry['status'] == SendQueue.QUEUED:
+        print("Sending {:,.2f} TRTL, key {}".format(amount / 100., entry['key']))
+        send_queue.send(send_queue.entries[entry['key']])
+        entry = send_queue.get(entry['key'])
+    elif entry['status'] == SendQueue.UNKNOWN:
+        send_queue.resolve(send_queue.entries[entry['key']])
+        entry = send_queue.get(entry['key'])
+    if entry['status'] == SendQueue.SENT:
+        print("Sent transaction {}".format(entry['transactionHash']))
+    elif entry['status'] == SendQueue.FAILED:
+        raise ValueError(entry['error'])
+    elif entry['status'] == SendQueue.UNKNOWN:
+        print("walletd didn't answer, so it isn't known yet whether the transaction was sent. "
+              "Run the command again with --key {} to check, it won't be sent twice".format(entry['key']))
+    else:
+        print("Send request {} is {}".format(entry['key'], entry['status']))
+
+
+def command_schedule(args):
+    """Schedules a payout, which the wallet builds ahead of time and sends when due while it is open"""
+    address, payment_id = AddressValidator.split_integrated_address(args.address, args.payment_id)
+    amount = int(round(float(args.amount) * 100))
+    fee = int(round(float(args.fee) * 100))
+    if amount <= 0 or fee < 0:
+        raise ValueError(global_variables.message_dict["INVALID_AMOUNT"])
+    try:
+        due = time.mktime(time.strptime(args.at, "%Y-%m-%d %H:%M"))
+    except ValueError:
+        raise ValueError("Due time must be given as YYYY-MM-DD HH:MM")
+    pool = DelayedTransactions.DelayedTransactionPool(None, DelayedTransactions.get_schedule_path(get_wallet_file(args)))
+    entry = pool.schedule(SendQueue.make_send_params(address, amount, fee, args.mixin, payment_id), due, args.key)
+    print("Payout {} of {:,.2f} TRTL is {}, due {}".format(entry['key'], entry['params']['transfers'][0]['amount'] / 100.,
+                                                           entry['status'], time.strftime("%Y-%m-%d %H:%M", time.localtime(entry['due']))))
+
+
+def command_scheduled(args):
+    """Lists the scheduled payouts, or cancels one"""
+    wallet_file = get_wallet_file(args)
+    if args.cancel:
+        # Cancelling a payout that has been built deletes its delayed transaction from the daemon
+        pool = DelayedTransactions.DelayedTransactionPool(attach(args), DelayedTransactions.get_schedule_path(wallet_file))
+        if not pool.cancel(args.cancel):
+            raise ValueError("No payout waiting to be sent with key {}".format(args.cancel))
+        print("Cancelled payout {}".format(args.cancel))
+        return
+    pool = DelayedTransactions.DelayedTransactionPool(None, DelayedTransactions.get_schedule_path(wallet_file))
+    for entry in pool.entries.values():
+        transfer = entry['params']['transfers'][0]
+        print("{}  {}  {:>9}  {:,.2f} TRTL to {}  {}".format(
+            entry['key'], time.strftime("%Y-%m-%d %H:%M", time.localtime(entry['due'])), entry['status'],
+            transfer['amount'] / 100., transfer['address'], entry['transactionHash'] or entry['error'] or ""))
+
+
+def command_validate(args):
+    """
+    Checks addresses, or a payout list of address[,payment ID] lines, without contacting the daemon
+    :return: 1 if any entry is invalid
+    """
+    if args.file:
+        with (sys.stdin if args.file == '-' else open(args.file)) as pFile:
+            entries = [tuple(part.strip() for part in line.split(',')[:2]) for line in pFile if line.strip()]
+    else:
+        entries = args.addresses
+    start_time = time.time()
+    failures = AddressValidator.validate_bulk(entries)
+    for position, entry, error in failures:
+        print("{}: {} - {}".format(position + 1, entry[0] if isinstance(entry, tuple) else entry, error))
+    print("{} of {} entries valid, checked in {:.2f}s".format(len(entries) - len(failures), len(entries), time.time() - start_time))
+    return 1 if failures else 0
+
+
+def command_idle_stop(args):
+    """
+    Waits for the wallet's detached daemon to be idle (no session attached) for the given time,
+    then stops it. Started by the GUI when it exits leaving the daemon running.
+    """
+    wallet_file = get_wallet_file(args)
+    secret_file = get_daemon_secret_path(wallet_file)
+    info = read_daemon_secret(secret_file)
+    if not info:
+        return
+    daemon_pid = info['pid']
+    while True:
+        info = read_daemon_secret(secret_file)
+        if not info or info['pid'] != daemon_pid:
+            # The daemon has been stopped or replaced, nothing left to watch
+            return
+        session_pid = info.get('sessionPid')
+        if session_pid and psutil.pid_exists(session_pid):
+            # A session has attached, it will start its own watcher when it exits
+            return
+        idle_time = time.time() - info['lastActive']
+        if idle_time >= args.timeout:
+            cli_logger.info("Wallet daemon pid {} idle for {:.0f} seconds, stopping it".format(daemon_pid, idle_time))
+            try:
+                attach(args, verify_password=False).stop_wallet_daemon(force=True)
+            except ValueError as e:
+                cli_logger.warning("Unable to stop idle wallet daemon: {}".format(e))
+            return
+        time.sleep(min(60, args.timeout - idle_time))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Command line interface to a running Turtle Wallet daemon")
+    parser.add_argument('-v', '--verbose', help='Change verbosity to DEBUG', required=False, action='store_true')
+    parser.add_argument('-w', '--wallet', help='Wallet file location (defaults to the GUI default wallet)', required=False, default=None)
+    parser.add_argument('--password-stdin', help='Read the wallet password from the first line of stdin instead of asking for it',
+                        required=False, action='store_true')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    status_parser = subparsers.add_parser('status', help='Show the wallet daemon status and balance')
+    status_parser.set_defaults(func=command_status)
+
+    stop_parser = subparsers.add_parser('stop', help='Save the wallet and stop its wallet daemon')
+    stop_parser.set_defaults(func=command_stop)
+
+    export_parser = subparsers.add_parser('export', help='Export the transaction history to a file')
+    export_parser.add_argument('output', help='File to write')
+    export_parser.add_argument('--format', help='Output format (defaults to the file extension)',
+                               choices=TransactionExport.EXPORT_FORMATS, default=None)
+    export_parser.add_argument('--rows', help='One row per transaction or per transfer',
+                               choices=TransactionExport.EXPORT_ROW_TYPES, default='transactions')
+    export_parser.add_argument('--first-block', help='First block to export', type=int, default=1)
+    export_parser.add_argument('--window', help='Blocks requested from the daemon at a time', type=int,
+                               default=TransactionExport.EXPORT_BLOCK_WINDOW)
+    export_parser.set_defaults(func=command_export)
+
+    rescan_parser = subparsers.add_parser('rescan', help='Rescan the wallet from a block height or date')
+    rescan_point = rescan_parser.add_mutually_exclusive_group()
+    rescan_point.add_argument('--height', help='Block height to rescan from')
+    rescan_point.add_argument('--date', help='Date to rescan from, as YYYY-MM-DD')
+    rescan_parser.add_argument('--wait', help='Show progress until the rescan has finished', action='store_true')
+    rescan_parser.set_defaults(func=command_rescan)
+
+    send_parser = subparsers.add_parser('send', help='Send TRTL to an address')
+    send_parser.add_argument('address', help='Address to send to')
+    send_parser.add_argument('amount', help='Amount of TRTL to send')
+    send_parser.add_argument('--fee', help='Fee in TRTL', default=global_variables.static_fee / 100.)
+    send_parser.add_argument('--mixin', help='Mixin', type=int, default=3)
+    send_parser.add_argument('--payment-id', help='Payment ID', default=None)
+    send_parser.add_argument('--key', help='Idempotency key, a request with the same key is only sent once', default=None)
+    send_parser.set_defaults(func=command_send)
+
+    schedule_parser = subparsers.add_parser('schedule', help='Schedule a payout, sent by the wallet when due')
+    schedule_parser.add_argument('address', help='Address to send to')
+    schedule_parser.add_argument('amount', help='Amount of TRTL to send')
+    schedule_parser.add_argument('--at', help='Time the payout is due, as YYYY-MM-DD HH:MM', required=True)
+    schedule_parser.add_argument('--fee', help='Fee in TRTL', default=global_variables.static_fee / 100.)
+    schedule_parser.add_argument('--mixin', help='Mixin', type=int, default=3)
+    schedule_parser.add_argument('--payment-id', help='Payment ID', default=None)
+    schedule_parser.add_argument('--key', help='Idempotency key, a payout with the same key is only scheduled once', default=None)
+    schedule_parser.set_defaults(func=command_schedule)
+
+    scheduled_parser = subparsers.add_parser('scheduled', help='List the scheduled payouts')
+    scheduled_parser.add_argument('--cancel', help='Key of a payout to cancel', default=None)
+    scheduled_parser.set_defaults(func=command_scheduled)
+
+    validate_parser = subparsers.add_parser('validate', help='Check addresses or a payout list without contacting the daemon')
+    validate_parser.add_argument('addresses', help='Addresses to check', nargs='*')
+    validate_parser.add_argument('--file', help='Payout list of address[,payment ID] lines to check, - for stdin', default=None)
+    validate_parser.set_defaults(func=command_validate)
+
+    idle_stop_parser = subparsers.add_parser('idle-stop', help='Stop the wallet daemon once it has been idle for a while')
+    idle_stop_parser.add_argument('--timeout', help='Idle seconds before stopping', type=float, default=3600)
+    idle_stop_parser.set_defaults(func=command_idle_stop)
+
+    args = parser.parse_args()
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+        ch.setLevel(logging.DEBUG)
+
+    # Use the same settings as the GUI
+    global_variables.wallet_config.load()
+    try:
+        return args.func(args) or 0
+    except (ValueError, IOError, RequestException) as e:
+        print("Error: {}".format(e))
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
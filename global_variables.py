@@ -4,11 +4,31 @@
 This file stores the global variables for the wallet.
 """
 
+import os
+
+from ConfigStore import ConfigStore
+
+# Directory of the wallet's own modules, which the config is kept in whatever directory the wallet is started from
+app_dir = os.path.dirname(os.path.realpath(__file__))
+
 # The main wallet connection object that handles communicating
 # to the wallet daemon process and talking to the RPC server.
 wallet_connection = None
-wallet_config_file = 'trtlconfig.json'
-wallet_config = {}
+# The supervisor that restarts the wallet daemon if it crashes or hangs
+wallet_supervisor = None
+# Stops the background services and the wallet daemon when the wallet closes
+shutdown_coordinator = None
+# The CPU profiler, while profiling is on
+profiler = None
+# The memory diagnostics, while they are on
+memory_diagnostics = None
+# Tracks the synchronization rate, shared by the splash screen and the main window
+sync_tracker = None
+wallet_config_file = os.path.join(app_dir, 'trtlconfig.json')
+# File the RPC console history is kept in between sessions
+rpc_history_file = 'trtlrpchistory.json'
+# The wallet configuration, loaded once by the splash screen and written back in the background
+wallet_config = ConfigStore(wallet_config_file)
 static_fee = 10 #ATOMIC UNITS
 message_dict = {
                     "NO_RPC": "No RPC connection has been established!",
@@ -24,8 +44,12 @@ message_dict = {
                     "NO_COMM_DAEMON" : "Can't communicate with wallet daemon",
                     "FAILED_CONNECT_DAEMON" : "Failed to connect to wallet daemon: {}",
                     "NO_WALLET_FILE" : "Cannot find wallet at location: {}",
+                    "NO_DETACHED_DAEMON" : "No running wallet daemon to attach to for wallet: {}",
+                    "WRONG_PASSWORD" : "The wallet password is incorrect",
+                    "UNVERIFIABLE_DAEMON" : "The running wallet daemon was started by an older version that can't check the wallet password, stop it with 'python cli.py stop' first",
                     "NO_SERVER_COMM" : "Failed to talk to server: %s",
                     "SUCCESS_WALLET_RESET" : "Wallet has been reset successfully",
+                    "SUCCESS_WALLET_RESCAN" : "Wallet is rescanning from block {}. The known transactions stay listed until the rescan reaches them.",
                     "FAILED_WALLET_RESET" : "The wallet failed to reset!",
                     "SUCCESS_WALLET_SAVE" : "Wallet has been saved successfully",
                     "FAILED_WALLET_SAVE" : "The wallet failed to save!",
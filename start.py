@@ -12,6 +12,9 @@ import argparse
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk
 from SplashScreen import SplashScreen
+from ShutdownCoordinator import ShutdownCoordinator
+import Profiler
+from MemoryDiagnostics import MemoryDiagnostics
 import logging
 from logging.handlers import RotatingFileHandler
 
@@ -28,6 +31,10 @@ parser = argparse.ArgumentParser()
 #add verbosity argument
 parser.add_argument('-v', '--verbose', help='Change verbosity to DEBUG', required=False, action='store_true')
 parser.add_argument('-w', '--wallet', help='Wallet file location', required=False, default=None)
+parser.add_argument('--profile', help='Profile the wallet, writing reports next to trtl.log', required=False,
+                    nargs='?', const=Profiler.SAMPLE, choices=Profiler.PROFILE_MODES)
+parser.add_argument('--memory', help='Trace memory use, writing snapshots next to trtl.log', required=False,
+                    action='store_true')
 args = parser.parse_args()
 
 #check if verbosity arg is set
@@ -49,6 +56,15 @@ logger.addHandler(fh)
 
 logger.info("Turtle Wallet Started")
 signal.signal(signal.SIGINT, signal.SIG_DFL) # Required to handle interrupts closing the program
+global_variables.shutdown_coordinator = ShutdownCoordinator()
+if args.profile:
+    # Started on this thread, which runs the GTK main loop, so cProfile traces it
+    global_variables.profiler = Profiler.Profiler(Profiler.get_log_directory(), args.profile)
+    global_variables.profiler.start()
+if args.memory:
+    # Started before the wallet is opened, so everything it loads is traced
+    global_variables.memory_diagnostics = MemoryDiagnostics(Profiler.get_log_directory())
+    global_variables.memory_diagnostics.start()
 logger.info("Starting Splash Screen")
 splash_screen = SplashScreen(args.wallet) # Create a new instance of the splash screen
 
@@ -58,6 +74,11 @@ if not splash_screen.startup_cancelled:
 else:
     logger.info("Tutle Wallet exiting")
 
-if global_variables.wallet_connection:
-    logger.info("Stopping wallet daemon")
-    global_variables.wallet_connection.stop_wallet_daemon()
+# Stop the background services and the wallet daemon, each within a deadline
+global_variables.shutdown_coordinator.shutdown()
+
+# Write the final profile once everything has stopped, so the shutdown is in it too
+if global_variables.profiler:
+    global_variables.profiler.stop()
+if global_variables.memory_diagnostics:
+    global_variables.memory_diagnostics.stop()